@@ -0,0 +1,162 @@
+import atexit
+import logging
+import multiprocessing
+import signal
+from array import array
+from datetime import datetime
+from multiprocessing import shared_memory
+from queue import Empty, Full
+
+from adc import BYTES_PER_READING
+
+# This module is imported by power_monitor.py and runs the ADC sampling in a dedicated child process.
+#
+# The worker captures blocks of frames back-to-back and writes each one into a slot of a preallocated shared memory ring.
+# The main process picks up finished blocks from the ring and does the power calculations, aggregation, and database writes
+# on another core, so sampling never pauses while the rest of the pipeline is busy.
+
+logger = logging.getLogger('power_monitor')
+
+WRITING = -1    # Slot sequence value while the worker is overwriting a slot.
+
+
+class SampleBlock:
+    '''A block of frames captured by the acquisition worker.'''
+
+    def __init__(self, frames, time, duration, board_voltage, info=None):
+        self.frames = frames                # array('H') of readings, ordered frame by frame in scan order
+        self.time = time                    # UTC datetime when the capture started
+        self.duration = duration            # Seconds of signal covered by the block
+        self.board_voltage = board_voltage  # Tracked board voltage at the time of the capture
+        self.info = info or dict()          # Extra details about the capture from the worker's info_func (timing diagnostics, streamed sums)
+
+
+class AcquisitionWorker:
+    '''Continuously captures blocks of ADC frames in a child process.
+
+    <capture> is called repeatedly in the child process and must return a tuple of (frames, duration), where frames is an array('H')
+    of at most <block_len> readings. If provided, <setup> is called once in the child process before the first capture, and
+    <info_func> is called after every capture and must return a picklable dictionary of extra details about it, which is passed
+    along as the block's info. Frames can be empty, when everything the consumer needs is in the info.
+
+    The ring buffer holds <num_slots> blocks. The worker never waits for the consumer: if the consumer falls behind by more than
+    the number of slots, the oldest unread block is overwritten and counted as an overrun. Each slot carries the sequence number
+    of the block it holds, which is cleared while the slot is being written, so the consumer can detect a block that was
+    overwritten while it was being copied. The queue of finished blocks holds at most <num_slots> entries too: when it's full,
+    the worker skips the entry, and the consumer counts the gap in sequence numbers as overruns.
+
+    stop() also runs when the parent process exits, so that a crash can't leave the worker running or the shared memory in /dev/shm.
+    '''
+
+    def __init__(self, capture, block_len, board_voltage_func, num_slots=4, setup=None, info_func=None):
+        self.capture = capture
+        self.setup = setup
+        self.info_func = info_func
+        self.board_voltage_func = board_voltage_func
+        self.num_slots = num_slots
+        self.block_len = block_len
+        self.block_bytes = block_len * BYTES_PER_READING
+        self.overruns = 0
+        self.process = None
+        self._next_seq = 0     # Sequence number of the next block that the consumer expects.
+
+        # The worker is forked so that it inherits the already opened SPI device and the prepared frame reader.
+        self._ctx = multiprocessing.get_context('fork')
+        self.stop_flag = self._ctx.Event()
+        self._ready = self._ctx.Queue(maxsize=num_slots)
+        self._slot_seq = self._ctx.Array('q', [WRITING] * num_slots, lock=False)
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, num_slots * self.block_bytes))
+        # The forked child exits without running atexit handlers, so this only runs in the parent.
+        atexit.register(self.stop)
+
+    def start(self):
+        '''Starts the acquisition process.'''
+        self.process = self._ctx.Process(target=self._run, name='power_monitor_acquisition', daemon=True)
+        self.process.start()
+        logger.debug(f"Started acquisition process (PID {self.process.pid}) with {self.num_slots} x {self.block_len} reading buffers.")
+
+    def stop(self):
+        '''Stops the acquisition process and releases the shared memory.'''
+        if self._shm is None:
+            return
+        atexit.unregister(self.stop)
+        self.stop_flag.set()
+        if self.process:
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.kill()     # The worker ignores SIGTERM.
+                self.process.join()
+            self.process = None
+        self._ready.close()
+        try:
+            self._shm.close()
+        except BufferError:     # A view of the buffer is still in use. The segment is unlinked anyway, and freed once it's released.
+            pass
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+        self._shm = None
+
+    def get_block(self, timeout=5):
+        '''Returns the next SampleBlock in capture order, or None if no block was completed within <timeout> seconds.'''
+        while True:
+            try:
+                seq, length, time, duration, board_voltage, info = self._ready.get(timeout=timeout)
+            except Empty:
+                return None
+
+            if seq > self._next_seq:     # The worker skipped these blocks because the queue was full.
+                self.overruns += seq - self._next_seq
+            self._next_seq = seq + 1
+
+            slot = seq % self.num_slots
+            offset = slot * self.block_bytes
+            if self._slot_seq[slot] != seq:
+                self.overruns += 1
+                continue
+            frames = array('H')
+            frames.frombytes(self._shm.buf[offset:offset + length * BYTES_PER_READING])
+            if self._slot_seq[slot] != seq:    # The worker lapped us while we were copying.
+                self.overruns += 1
+                continue
+
+            return SampleBlock(frames, time, duration, board_voltage, info)
+
+    def _run(self):
+        '''Acquisition loop that runs in the child process.'''
+        # Shutdown is coordinated by the parent process through stop_flag.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+        buf = self._shm.buf
+        seq = 0
+        truncated = 0   # Captures that were longer than block_len, and were cut short so they couldn't spill into the next slot.
+        try:
+            if self.setup:
+                self.setup()
+            while not self.stop_flag.is_set():
+                board_voltage = self.board_voltage_func()
+                now = datetime.utcnow()
+                frames, duration = self.capture()
+                if len(frames) > self.block_len:
+                    truncated += 1
+                    if truncated == 1 or truncated % 100 == 0:
+                        logger.warning(f"A capture of {len(frames)} readings didn't fit in the {self.block_len} reading buffer, so it was truncated ({truncated} so far).")
+                    frames = frames[:self.block_len]
+                data = frames.tobytes()
+
+                slot = seq % self.num_slots
+                offset = slot * self.block_bytes
+                self._slot_seq[slot] = WRITING
+                buf[offset:offset + len(data)] = data
+                self._slot_seq[slot] = seq
+                info = self.info_func() if self.info_func else None
+                try:
+                    self._ready.put_nowait((seq, len(frames), now, duration, board_voltage, info))
+                except Full:
+                    pass    # The consumer is num_slots blocks behind, so this block will be overwritten before it's read anyway.
+                seq += 1
+        finally:
+            del buf
+            self._shm.close()
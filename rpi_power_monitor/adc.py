@@ -0,0 +1,260 @@
+import ctypes
+import fcntl
+import logging
+import sys
+from array import array
+from time import monotonic, perf_counter_ns
+
+# This module is imported by power_monitor.py and provides batched reads of the MCP3008 over SPI.
+#
+# The MCP3008 only starts a new conversion on the falling edge of chip-select, so a single long xfer2() call (which holds CS low
+# for the whole buffer) can't be used to read more than one conversion. Instead, the spidev driver's SPI_IOC_MESSAGE(n) ioctl
+# is used to submit up to n 3-byte transfers in a single syscall, with the driver toggling chip-select between each transfer.
+
+logger = logging.getLogger('power_monitor')
+
+SPI_IOC_MAGIC = ord('k')
+SPI_IOC_TRANSFER_SIZE = 32          # sizeof(struct spi_ioc_transfer)
+SPI_BUFSIZ = 4096                   # The default bufsiz parameter of the spidev kernel module (total bytes per message).
+BYTES_PER_CONVERSION = 3
+BYTES_PER_READING = array('H').itemsize
+
+# The ioctl size field is 14 bits wide, which limits a single message to 511 transfers.
+MAX_TRANSFERS_PER_MESSAGE = min(((1 << 14) - 1) // SPI_IOC_TRANSFER_SIZE, SPI_BUFSIZ // BYTES_PER_CONVERSION)
+
+# Maps PCB channel numbers to the MCP3008 channels they're wired to.
+ADC_CHANNELS = {
+    1 : 0,  # PCB channel # : ADC channel #
+    2 : 1,
+    3 : 2,
+    4 : 3,
+    5 : 6,
+    6 : 7
+    }
+BOARD_VOLTAGE_CHANNEL = 4   # +3.3V rail, through a 1/2 voltage divider
+AC_VOLTAGE_CHANNEL = 5
+
+# Lookup table used to keep only the two most significant result bits (B9 and B8) from the second byte of each reply.
+_HIGH_BITS_MASK = bytes(i & 3 for i in range(256))
+
+
+class SpiIocTransfer(ctypes.Structure):
+    '''Mirrors struct spi_ioc_transfer from linux/spi/spidev.h'''
+    _fields_ = [
+        ('tx_buf', ctypes.c_uint64),
+        ('rx_buf', ctypes.c_uint64),
+        ('len', ctypes.c_uint32),
+        ('speed_hz', ctypes.c_uint32),
+        ('delay_usecs', ctypes.c_uint16),
+        ('bits_per_word', ctypes.c_uint8),
+        ('cs_change', ctypes.c_uint8),
+        ('tx_nbits', ctypes.c_uint8),
+        ('rx_nbits', ctypes.c_uint8),
+        ('word_delay_usecs', ctypes.c_uint8),
+        ('pad', ctypes.c_uint8),
+    ]
+
+
+def spi_ioc_message(num_transfers):
+    '''Returns the ioctl request number for SPI_IOC_MESSAGE(num_transfers).'''
+    size = num_transfers * SPI_IOC_TRANSFER_SIZE
+    return (1 << 30) | (size << 16) | (SPI_IOC_MAGIC << 8)
+
+
+def command_bytes(adc_num):
+    '''Returns the 3 byte command that starts a single-ended conversion on the provided ADC channel.'''
+    return [1, 8 + adc_num << 4, 0]
+
+
+def decode_replies(rx):
+    '''Decodes a buffer of 3-byte MCP3008 replies into an array of 10-bit readings.'''
+    count = len(rx) // BYTES_PER_CONVERSION
+    buf = bytearray(2 * count)
+    buf[0::2] = rx[1::3].translate(_HIGH_BITS_MASK)
+    buf[1::2] = rx[2::3]
+    readings = array('H', buf)
+    if sys.byteorder == 'little':
+        readings.byteswap()
+    return readings
+
+
+class FrameReader:
+    '''Reads complete frames from the MCP3008, where a frame is one conversion for every ADC channel in the scan order.
+
+    When batched is True, frames are read in blocks of up to MAX_TRANSFERS_PER_MESSAGE conversions, each block being a single
+    ioctl() call, and the replies are decoded in bulk. Otherwise (or if the SPI object doesn't expose a file descriptor, or the
+    ioctl is rejected), the reader uses one xfer2() call per conversion.
+
+    If timing is set to an array('q'), the number of frames and a perf_counter_ns() timestamp are appended to it after every block
+    (or every frame, when using xfer2()). See diagnostics.py.
+    '''
+
+    def __init__(self, spi, scan, batched=True, max_transfers=MAX_TRANSFERS_PER_MESSAGE):
+        self.spi = spi
+        self.scan = list(scan)
+        self.frame_size = len(self.scan)
+        self.frames_per_block = max(1, max_transfers // self.frame_size)
+        self._blocks = dict()   # Prepared ioctl messages, keyed by the number of frames they contain.
+        self._fileno = None
+        self.timing = None
+
+        if batched:
+            try:
+                self._fileno = spi.fileno()
+            except (AttributeError, OSError):
+                logger.debug("SPI device does not expose a file descriptor - batched reads will fall back to xfer2().")
+
+    def read(self, num_frames):
+        '''Reads <num_frames> frames and returns a flat array of readings, ordered frame by frame in scan order.'''
+        if self._fileno is None:
+            return self._read_xfer2(num_frames)
+
+        readings = array('H')
+        remaining = num_frames
+        while remaining > 0:
+            frames = min(remaining, self.frames_per_block)
+            try:
+                readings.extend(self._read_block(frames))
+                if self.timing is not None:
+                    self.timing.extend((frames, perf_counter_ns()))
+            except OSError as e:
+                logger.warning(f"Batched SPI read failed ({e}). Falling back to individual SPI transfers.")
+                self._fileno = None
+                readings.extend(self._read_xfer2(remaining))
+                break
+            remaining -= frames
+
+        return readings
+
+    def _read_block(self, num_frames):
+        '''Submits a single SPI_IOC_MESSAGE containing <num_frames> frames and returns the decoded readings.'''
+        block = self._blocks.get(num_frames)
+        if block is None:
+            block = self._prepare_block(num_frames)
+            self._blocks[num_frames] = block
+
+        request, transfers, tx, rx = block
+        fcntl.ioctl(self._fileno, request, transfers, True)
+        return decode_replies(bytes(rx))
+
+    def _prepare_block(self, num_frames):
+        '''Allocates the transmit/receive buffers and transfer descriptors for a block of <num_frames> frames.'''
+        num_transfers = num_frames * self.frame_size
+        tx_bytes = []
+        for _ in range(num_frames):
+            for adc_num in self.scan:
+                tx_bytes += command_bytes(adc_num)
+
+        tx = (ctypes.c_uint8 * len(tx_bytes))(*tx_bytes)
+        rx = (ctypes.c_uint8 * len(tx_bytes))()
+        transfers = (SpiIocTransfer * num_transfers)()
+        speed_hz = int(self.spi.max_speed_hz)
+        for i in range(num_transfers):
+            transfers[i].tx_buf = ctypes.addressof(tx) + i * BYTES_PER_CONVERSION
+            transfers[i].rx_buf = ctypes.addressof(rx) + i * BYTES_PER_CONVERSION
+            transfers[i].len = BYTES_PER_CONVERSION
+            transfers[i].speed_hz = speed_hz
+            transfers[i].bits_per_word = 8
+            # Release chip-select between conversions so the ADC starts a new one. It's left unset on the final transfer,
+            # where cs_change would otherwise keep the chip selected after the message completes.
+            transfers[i].cs_change = 1 if i < num_transfers - 1 else 0
+
+        # tx is kept with the block so that its buffer stays alive as long as the transfer descriptors point at it.
+        return spi_ioc_message(num_transfers), transfers, tx, rx
+
+    def _read_xfer2(self, num_frames):
+        '''Reads <num_frames> frames using one xfer2() call per conversion.'''
+        readings = array('H')
+        xfer2 = self.spi.xfer2
+        commands = [command_bytes(adc_num) for adc_num in self.scan]
+        timing = self.timing
+        for _ in range(num_frames):
+            for command in commands:
+                r = xfer2(list(command))
+                readings.append(((r[1] & 3) << 8) + r[2])
+            if timing is not None:
+                timing.extend((1, perf_counter_ns()))
+
+        return readings
+
+
+class FrameReaderGroup:
+    '''Reads frames from several boards (each with its own FrameReader), and combines them into a single frame per step.
+
+    The boards are read in turn, <interleave_frames> frames at a time, so that the boards' samples cover the same span of time. Each
+    combined frame is the frames of every board, concatenated in board order. The group can be used anywhere a FrameReader is used.
+    With <interleave_frames> greater than 1, consecutive frames from a board aren't evenly spaced in time, so it can't be combined with
+    shared voltage interpolation.
+    Timing is recorded by the group, once per step, rather than by the boards' readers.
+    '''
+
+    def __init__(self, readers, interleave_frames=1):
+        self.readers = list(readers)
+        self.scan = [adc_num for reader in self.readers for adc_num in reader.scan]
+        self.frame_size = len(self.scan)
+        self.frames_per_block = max(1, interleave_frames)
+        self.timing = None
+
+    def read(self, num_frames):
+        '''Reads <num_frames> combined frames and returns a flat array of readings, ordered frame by frame in scan order.'''
+        parts = [array('H') for _ in self.readers]
+        remaining = num_frames
+        while remaining > 0:
+            frames = min(remaining, self.frames_per_block)
+            for part, reader in zip(parts, self.readers):
+                part.extend(reader.read(frames))
+            if self.timing is not None:
+                self.timing.extend((frames, perf_counter_ns()))
+            remaining -= frames
+
+        # Interleave each board's readings into the combined frames.
+        readings = array('H', bytes(num_frames * self.frame_size * BYTES_PER_READING))
+        offset = 0
+        for part, reader in zip(parts, self.readers):
+            for slot in range(reader.frame_size):
+                readings[offset + slot::self.frame_size] = part[slot::reader.frame_size]
+            offset += reader.frame_size
+
+        return readings
+
+
+class BoardVoltageTracker:
+    '''Tracks the voltage of the board's +3.3V rail, which is used as the ADC reference.
+
+    The rail is only measured every <interval> seconds, and each measurement is folded into an exponentially weighted moving
+    average. A warning is logged when the average drifts more than <tolerance> (a fraction of the nominal voltage) away from nominal.
+    '''
+
+    def __init__(self, read_func, interval=60, tolerance=0.05, alpha=0.2, nominal=3.3):
+        self.read_func = read_func
+        self.interval = interval
+        self.tolerance = tolerance
+        self.alpha = alpha
+        self.nominal = nominal
+        self.voltage = None
+        self.in_tolerance = True
+        self._next_update = 0
+
+    def get(self):
+        '''Returns the tracked board voltage, measuring the rail first if the update interval has passed.'''
+        now = monotonic()
+        if now >= self._next_update:
+            self._next_update = now + self.interval
+            self.update(self.read_func())
+
+        return self.voltage
+
+    def update(self, reading):
+        '''Folds a new board voltage measurement into the moving average.'''
+        if self.voltage is None:
+            self.voltage = reading
+        else:
+            self.voltage += self.alpha * (reading - self.voltage)
+
+        drift = abs(self.voltage - self.nominal) / self.nominal
+        if drift > self.tolerance and self.in_tolerance:
+            logger.warning(f"The board voltage has drifted to {round(self.voltage, 3)}V, which is more than {round(self.tolerance * 100, 1)}% away from {self.nominal}V. Please check your Pi's power supply.")
+            self.in_tolerance = False
+        elif drift <= self.tolerance and not self.in_tolerance:
+            logger.info(f"The board voltage has returned to {round(self.voltage, 3)}V.")
+            self.in_tolerance = True
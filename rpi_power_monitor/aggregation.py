@@ -0,0 +1,207 @@
+from array import array
+from heapq import heappop, heappush, heapify
+from math import fsum
+
+# This module is imported by power_monitor.py and smooths the calculated figures over the last few captures before they're stored or
+# published.
+#
+# Each figure has its own RollingAggregate, which keeps the last <window> values in a fixed-size ring buffer. The simple moving average
+# keeps a running sum (a new value is added and the value it overwrites is subtracted), so updates cost the same no matter how long the
+# window is. The running sum is recomputed from the buffer each time the ring wraps around, so floating point error can't build up.
+# The exponentially weighted moving average only needs the previous average. The median splits the window between two heaps (the lower
+# half in a max-heap, the upper half in a min-heap), so an update costs O(log window). Values that leave the window are only removed from a
+# heap once they reach its top (lazy deletion), and the heaps are rebuilt if the stale values ever outnumber the window.
+
+METHODS = ('sma', 'ewma', 'median')
+
+
+class SlidingMedian:
+    '''The median of a window of values, which are added and removed one at a time.'''
+
+    __slots__ = ('_low', '_high', '_low_size', '_high_size', '_removed')
+
+    def __init__(self):
+        self._low = []          # Max-heap (of negated values) of the lower half of the window, which holds the extra value of an odd window.
+        self._high = []         # Min-heap of the upper half of the window.
+        self._low_size = 0      # Number of values in each half, excluding the removed values that are still in the heaps.
+        self._high_size = 0
+        self._removed = dict()  # Value : number of copies that have been removed, but are still in a heap.
+
+    @property
+    def value(self):
+        if (self._low_size + self._high_size) % 2:
+            return -self._low[0]
+        return (-self._low[0] + self._high[0]) / 2
+
+    def add(self, value):
+        if not self._low or value <= -self._low[0]:
+            heappush(self._low, -value)
+            self._low_size += 1
+        else:
+            heappush(self._high, value)
+            self._high_size += 1
+        self._balance()
+
+    def remove(self, value):
+        '''Removes a value that was added before.'''
+        self._removed[value] = self._removed.get(value, 0) + 1
+        if value <= -self._low[0]:
+            self._low_size -= 1
+            if value == -self._low[0]:
+                self._prune(self._low, -1)
+        else:
+            self._high_size -= 1
+            if value == self._high[0]:
+                self._prune(self._high, 1)
+        self._balance()
+
+        if len(self._low) + len(self._high) > 2 * (self._low_size + self._high_size) + 16:
+            self._rebuild()
+
+    def _prune(self, heap, sign):
+        '''Pops the removed values from the top of <heap>.'''
+        while heap:
+            count = self._removed.get(sign * heap[0])
+            if not count:
+                return
+            if count == 1:
+                del self._removed[sign * heap[0]]
+            else:
+                self._removed[sign * heap[0]] = count - 1
+            heappop(heap)
+
+    def _balance(self):
+        if self._low_size > self._high_size + 1:
+            heappush(self._high, -heappop(self._low))
+            self._low_size -= 1
+            self._high_size += 1
+            self._prune(self._low, -1)
+        elif self._low_size < self._high_size:
+            heappush(self._low, -heappop(self._high))
+            self._low_size += 1
+            self._high_size -= 1
+            self._prune(self._high, 1)
+
+    def _rebuild(self):
+        '''Drops every removed value from the heaps.'''
+        for heap, sign in ((self._low, -1), (self._high, 1)):
+            kept = []
+            for item in heap:
+                count = self._removed.get(sign * item)
+                if count:
+                    self._removed[sign * item] = count - 1
+                else:
+                    kept.append(item)
+            heapify(kept)
+            heap[:] = kept
+        self._removed = {value : count for value, count in self._removed.items() if count}
+
+
+class RollingAggregate:
+    '''A rolling average of a single figure.
+
+    Arguments:
+    window -- int, the number of values that are averaged. In EWMA mode, this sets the default smoothing factor (2 / (window + 1)).
+    method -- str, 'sma' (simple moving average), 'ewma' (exponentially weighted moving average), or 'median'.
+    alpha -- float, the EWMA smoothing factor (0 < alpha <= 1), overriding the one derived from <window>.
+    '''
+
+    __slots__ = ('window', 'method', 'alpha', 'count', 'value', '_buffer', '_index', '_sum', '_median')
+
+    def __init__(self, window=2, method='sma', alpha=None):
+        if method not in METHODS:
+            raise ValueError(f"Unknown rolling aggregate method {method!r}. Choose one of {', '.join(METHODS)}.")
+        self.window = window
+        self.method = method
+        self.alpha = alpha if alpha is not None else 2 / (window + 1)
+        self.count = 0          # Number of values added, capped at window.
+        self.value = None       # The current aggregate, or None until the first value has been added.
+        self._buffer = array('d', bytes(8 * window))
+        self._index = 0
+        self._sum = 0.0
+        self._median = SlidingMedian() if method == 'median' else None
+
+    @property
+    def full(self):
+        '''True once <window> values have been added.'''
+        return self.count == self.window
+
+    def add(self, value):
+        '''Adds <value> to the window (replacing the oldest value once the window is full), and returns the updated aggregate.'''
+        if self.method == 'ewma':
+            self.value = value if self.value is None else self.value + self.alpha * (value - self.value)
+            self.count = min(self.count + 1, self.window)
+            return self.value
+
+        oldest = self._buffer[self._index]
+        self._buffer[self._index] = value
+        self._index += 1
+        if self.count < self.window:
+            self.count += 1
+        elif self._median:
+            self._median.remove(oldest)
+        else:
+            self._sum -= oldest
+
+        if self._median:
+            self._median.add(value)
+            self.value = self._median.value
+        else:
+            self._sum += value
+            if self._index == self.window:
+                self._sum = fsum(self._buffer[:self.count])
+            self.value = self._sum / self.count
+
+        if self._index == self.window:
+            self._index = 0
+        return self.value
+
+    def reset(self):
+        '''Empties the window.'''
+        self.count = 0
+        self.value = None
+        self._index = 0
+        self._sum = 0.0
+        if self._median:
+            self._median = SlidingMedian()
+
+
+class Decimator:
+    '''Reduces the figures of every capture to their mean, min, max, and last value over each <interval> seconds.'''
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.start = None       # Time of the first capture in the current interval.
+        self.stats = dict()     # Name : [count, sum, min, max, last]
+
+    def add(self, values, time):
+        '''Adds the figures of a capture.
+
+        Arguments:
+        values -- dict, maps each figure's name (any hashable key) to its value.
+        time -- datetime, the time of the capture.
+
+        Returns None, or if <time> starts a new interval, a tuple of (start time, {name : (mean, min, max, last)}) for the completed interval.
+        '''
+        completed = None
+        if self.start is None:
+            self.start = time
+        elif (time - self.start).total_seconds() >= self.interval:
+            completed = (self.start, {name : (total / count, lo, hi, last) for name, (count, total, lo, hi, last) in self.stats.items()})
+            self.start = time
+            self.stats = dict()
+
+        for name, value in values.items():
+            stats = self.stats.get(name)
+            if stats is None:
+                self.stats[name] = [1, value, value, value, value]
+            else:
+                stats[0] += 1
+                stats[1] += value
+                if value < stats[2]:
+                    stats[2] = value
+                elif value > stats[3]:
+                    stats[3] = value
+                stats[4] = value
+
+        return completed
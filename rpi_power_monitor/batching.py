@@ -0,0 +1,46 @@
+import threading
+
+# This module is imported by power_monitor.py and decides when a batch of points is flushed to the database.
+#
+# A batch is flushed when it reaches the current point limit, <max_bytes>, or <max_age> seconds, whichever comes first, so a monitor with
+# only a few channels still writes regularly. The point limit adapts to the observed write latency: while writes complete within the
+# target latency, the limit grows (up to <max_points>), which cuts down on requests when the database is healthy. When a write takes
+# longer than the target, the limit is halved (down to <min_points>).
+
+GROWTH = 1.25   # Point limit multiplier after a fast write.
+
+
+class AdaptiveBatchPolicy:
+    '''Flush rules for a batch of points.
+
+    Arguments:
+    min_points -- int, the smallest (and starting) point limit.
+    max_points -- int, the largest point limit. If it's equal to <min_points>, the limit is fixed.
+    max_bytes -- int, a batch that grows beyond this many bytes is flushed, regardless of its point count.
+    max_age -- float, seconds after which a batch is flushed, regardless of its size.
+    target_latency -- float, the write latency (in seconds) that the point limit adapts to.
+    '''
+
+    def __init__(self, min_points=25, max_points=25, max_bytes=262144, max_age=10, target_latency=0.5):
+        self.min_points = min_points
+        self.max_points = max(min_points, max_points)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.target_latency = target_latency
+        self.points = min_points    # The current point limit.
+        self.lock = threading.Lock()
+
+    def due(self, batch):
+        '''Returns True if <batch> (a LineProtocolBuffer) should be flushed.'''
+        return len(batch) >= self.points or batch.size >= self.max_bytes or (len(batch) and batch.age() >= self.max_age)
+
+    def record(self, latency, points):
+        '''Adapts the point limit to a write of <points> points that took <latency> seconds. Safe to call from the writer thread.'''
+        if self.max_points == self.min_points:
+            return
+        with self.lock:
+            if latency > self.target_latency:
+                self.points = max(self.min_points, self.points // 2)
+            elif points >= self.points:
+                # Only grow after a full-sized batch was written quickly, so that small (age-triggered) batches don't inflate the limit.
+                self.points = min(self.max_points, int(self.points * GROWTH) + 1)
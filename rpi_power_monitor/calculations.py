@@ -0,0 +1,191 @@
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# This module is imported by power_monitor.py and computes the per-channel sums that calculate_power() turns into RMS current,
+# RMS voltage, real power, and power factor.
+#
+# When NumPy is installed, every channel is processed at once: the captured current and voltage samples are stacked into
+# channels x samples matrices, and the sums are computed with a handful of array operations. Integer samples are summed as int64,
+# so the results are identical to the pure-Python loop. Interpolated (float) voltage samples are summed as float64, and can differ
+# from the pure-Python sums in the last few bits.
+
+
+class ChannelSums:
+    '''The sums over a capture of one channel's current and voltage samples.'''
+
+    __slots__ = ('num_samples', 'current', 'voltage', 'inst_power', 'squared_voltage', 'squared_current', 'current_min', 'current_max')
+
+    def __init__(self, num_samples, current, voltage, inst_power, squared_voltage, squared_current, current_min, current_max):
+        self.num_samples = num_samples
+        self.current = current                  # Sum of the raw current samples
+        self.voltage = voltage                  # Sum of the raw voltage samples
+        self.inst_power = inst_power            # Sum of current * voltage
+        self.squared_voltage = squared_voltage  # Sum of voltage * voltage
+        self.squared_current = squared_current  # Sum of current * current
+        self.current_min = current_min          # Lowest raw current sample
+        self.current_max = current_max          # Highest raw current sample
+
+    @property
+    def current_delta(self):
+        '''Peak-to-peak of the raw current samples.'''
+        return self.current_max - self.current_min
+
+    def add(self, other):
+        '''Adds the sums of <other> (a later run of samples from the same channel) to these sums.'''
+        self.num_samples += other.num_samples
+        self.current += other.current
+        self.voltage += other.voltage
+        self.inst_power += other.inst_power
+        self.squared_voltage += other.squared_voltage
+        self.squared_current += other.squared_current
+        self.current_min = min(self.current_min, other.current_min)
+        self.current_max = max(self.current_max, other.current_max)
+
+
+def channel_sums(ct_samples, v_samples):
+    '''Returns the ChannelSums of a single channel, computed with a pure-Python loop.'''
+    sum_inst_power = 0
+    sum_squared_current = 0
+    sum_raw_current = 0
+    sum_squared_voltage = 0
+    sum_raw_voltage = 0
+
+    for ct, voltage in zip(ct_samples, v_samples):
+        sum_raw_current += ct
+        sum_raw_voltage += voltage
+        sum_inst_power += ct * voltage
+        sum_squared_voltage += voltage * voltage
+        sum_squared_current += ct * ct
+
+    return ChannelSums(len(ct_samples), sum_raw_current, sum_raw_voltage, sum_inst_power, sum_squared_voltage, sum_squared_current, min(ct_samples), max(ct_samples))
+
+
+def channel_sums_vectorized(channels):
+    '''Returns a dictionary of ChannelSums, keyed by channel, computed with NumPy.
+
+    Arguments:
+    channels -- dict, maps a channel number to a tuple of (current samples, voltage samples). Each sample buffer must be an array.array,
+                and every buffer must hold the same number of samples.
+    '''
+    chan_nums = list(channels.keys())
+    ct = np.vstack([np.frombuffer(ct_samples, dtype=ct_samples.typecode) for ct_samples, _ in channels.values()]).astype(np.int64)
+    v = np.vstack([np.frombuffer(v_samples, dtype=v_samples.typecode) for _, v_samples in channels.values()])
+    v = v.astype(np.float64 if v.dtype.kind == 'f' else np.int64)
+    return dict(zip(chan_nums, matrix_sums(ct, v)))
+
+
+def matrix_sums(ct, v):
+    '''Returns a list of ChannelSums, one for each row of the channels x samples matrices <ct> and <v>.'''
+    num_samples = ct.shape[1]
+    sum_current = ct.sum(axis=1).tolist()
+    sum_voltage = v.sum(axis=1).tolist()
+    sum_inst_power = (ct * v).sum(axis=1).tolist()
+    sum_squared_voltage = (v * v).sum(axis=1).tolist()
+    sum_squared_current = (ct * ct).sum(axis=1).tolist()
+    current_min = ct.min(axis=1).tolist()
+    current_max = ct.max(axis=1).tolist()
+
+    return [
+        ChannelSums(num_samples, sum_current[i], sum_voltage[i], sum_inst_power[i], sum_squared_voltage[i], sum_squared_current[i], current_min[i], current_max[i])
+        for i in range(ct.shape[0])
+    ]
+
+
+def delay_samples(v_samples, start, stop, frac, vectorized=True):
+    '''Returns samples <start> to <stop> of <v_samples> delayed by <frac> (0 to 1) of a sample, as an array('d').
+
+    Each sample is linearly interpolated between the sample and the one before it, so <start> must be at least 1.
+    '''
+    if vectorized and np is not None:
+        v = np.frombuffer(v_samples, dtype=v_samples.typecode)[start - 1 : stop].astype(np.float64)
+        v_prev = v[:-1]
+        v_next = v[1:]
+        delayed = array('d')
+        delayed.frombytes((v_next + (v_prev - v_next) * frac).tobytes())
+        return delayed
+
+    return array('d', [v1 + (v0 - v1) * frac for v0, v1 in zip(v_samples[start - 1 : stop - 1], v_samples[start:stop])])
+
+
+def all_channel_sums(channels, vectorized=True):
+    '''Returns a dictionary of ChannelSums, keyed by channel, using NumPy when it's available and <vectorized> is True.
+
+    <channels> maps a channel number to a tuple of (current samples, voltage samples).
+    '''
+    if vectorized and np is not None and len({len(ct_samples) for ct_samples, _ in channels.values()}) == 1:
+        return channel_sums_vectorized(channels)
+
+    return {chan_num : channel_sums(ct_samples, v_samples) for chan_num, (ct_samples, v_samples) in channels.items()}
+
+
+class StreamAccumulator:
+    '''Accumulates the ChannelSums of every channel directly from blocks of frames as they're read, without keeping the samples.
+
+    Arguments:
+    layout -- dict, maps a channel number to a tuple of (CT reading index, voltage reading index, voltage interpolation weight) within a
+              frame (see RPiPowerMonitor.build_frame_reader()).
+    frame_size -- int, the number of readings in a frame.
+    shared_voltage -- bool, True if each channel's voltage is interpolated between the voltage reading of its frame and the next frame's.
+                      The last frame of each block is held back until the next block arrives.
+    vectorized -- bool, True to use NumPy when it's available.
+    '''
+
+    def __init__(self, layout, frame_size, shared_voltage=False, vectorized=True):
+        self.layout = dict(layout)
+        self.frame_size = frame_size
+        self.shared_voltage = shared_voltage
+        self.vectorized = vectorized and np is not None
+        self.pending = None     # The held back frame, in shared voltage mode.
+        self.sums = dict()
+
+    def reset(self, keep_pending=False):
+        '''Starts a new integration window. Pass keep_pending=True if the next block directly follows the last one.'''
+        self.sums = dict()
+        if not keep_pending:
+            self.pending = None
+
+    def add(self, frames):
+        '''Adds a flat array of whole frames (as returned by FrameReader.read()) to the running sums.'''
+        if self.shared_voltage:
+            if self.pending is not None:
+                frames = self.pending + frames
+            self.pending = frames[-self.frame_size:]
+            if len(frames) < 2 * self.frame_size:
+                return
+
+        if self.vectorized:
+            block_sums = self._block_sums_vectorized(frames)
+        else:
+            block_sums = self._block_sums(frames)
+
+        for chan_num, sums in block_sums.items():
+            if chan_num in self.sums:
+                self.sums[chan_num].add(sums)
+            else:
+                self.sums[chan_num] = sums
+
+    def _block_sums(self, frames):
+        stride = self.frame_size
+        block_sums = dict()
+        for chan_num, (ct_index, v_index, weight) in self.layout.items():
+            ct_samples = frames[ct_index::stride]
+            v_samples = frames[v_index::stride]
+            if self.shared_voltage:
+                ct_samples = ct_samples[:-1]
+                v_samples = [v0 + (v1 - v0) * weight for v0, v1 in zip(v_samples, v_samples[1:])]
+            block_sums[chan_num] = channel_sums(ct_samples, v_samples)
+        return block_sums
+
+    def _block_sums_vectorized(self, frames):
+        matrix = np.frombuffer(frames, dtype=frames.typecode).reshape(-1, self.frame_size).astype(np.int64)
+        ct_indexes, v_indexes, weights = zip(*self.layout.values())
+        ct = matrix[:, list(ct_indexes)].T
+        v = matrix[:, list(v_indexes)].T
+        if self.shared_voltage:
+            ct = ct[:, :-1]
+            v = v[:, :-1] + (v[:, 1:] - v[:, :-1]) * np.array(weights)[:, np.newaxis]
+        return dict(zip(self.layout.keys(), matrix_sums(ct, v)))
@@ -0,0 +1,72 @@
+# This module is imported by power_monitor.py and holds the per-channel settings that the power calculations use on every capture.
+#
+# The plan for each enabled channel is compiled once by load_config(), with the config values already converted and combined, so
+# that the compute and aggregation stages don't need to look anything up in the config dictionary.
+
+
+class ChannelPlan:
+    '''The compiled, read-only settings of an enabled CT channel.
+
+    Arguments:
+    num -- int, the PCB channel number.
+    board -- int, the number of the board the channel is wired to.
+    adc_channel -- int, the MCP3008 channel on that board.
+    type -- str, 'consumption', 'production', or 'mains'.
+    current_scale -- float, calibration * rating * the default calibration factor. Multiply by the ADC reference voltage / 1024 to get the
+                     scaling factor that converts raw current readings to amps.
+    two_pole -- bool, True if the channel measures one leg of a two-pole circuit (its power is doubled).
+    reversed -- bool, True if the CT is installed backwards (its power changes sign).
+    cutoff_figure -- str, 'current' if the noise filter compares amps to the cutoff, or 'power' if it compares watts.
+    cutoff -- float, the noise filter threshold. 0 disables the filter.
+    phase_shift -- float, the configured phase correction in degrees.
+    '''
+
+    __slots__ = ('num', 'board', 'adc_channel', 'type', 'current_scale', 'two_pole', 'reversed', 'power_multiplier', 'cutoff_figure', 'cutoff', 'phase_shift')
+
+    def __init__(self, num, board, adc_channel, type, current_scale, two_pole=False, reversed=False, cutoff_figure='current', cutoff=0, phase_shift=0):
+        set_value = super().__setattr__
+        set_value('num', num)
+        set_value('board', board)
+        set_value('adc_channel', adc_channel)
+        set_value('type', type)
+        set_value('current_scale', current_scale)
+        set_value('two_pole', two_pole)
+        set_value('reversed', reversed)
+        # Applied to the real power: doubled for two-pole circuits, and negated for reversed CTs.
+        set_value('power_multiplier', (2 if two_pole else 1) * (-1 if reversed else 1))
+        set_value('cutoff_figure', cutoff_figure)
+        set_value('cutoff', cutoff)
+        set_value('phase_shift', phase_shift)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"ChannelPlan is read-only (tried to set {name}).")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"ChannelPlan is read-only (tried to delete {name}).")
+
+    def __repr__(self):
+        return f"ChannelPlan({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+    @classmethod
+    def from_config(cls, num, settings, board, adc_channel, default_calibration, phase_shift=0):
+        '''Compiles the plan of channel <num> from its [current_transformers.channel_<num>] config <settings>.
+
+        amps_cutoff_threshold takes precedence over the deprecated watts_cutoff_threshold. If neither is set, the noise filter is disabled.
+        '''
+        if settings.get('amps_cutoff_threshold') is not None:
+            cutoff_figure, cutoff = 'current', float(settings['amps_cutoff_threshold'])
+        else:
+            cutoff_figure, cutoff = 'power', float(settings.get('watts_cutoff_threshold', 0))
+
+        return cls(
+            num=num,
+            board=board,
+            adc_channel=adc_channel,
+            type=settings['type'],
+            current_scale=settings['calibration'] * int(settings['rating']) * default_calibration,
+            two_pole=bool(settings['two_pole']),
+            reversed=bool(settings.get('reversed')),
+            cutoff_figure=cutoff_figure,
+            cutoff=cutoff,
+            phase_shift=phase_shift,
+        )
@@ -0,0 +1,109 @@
+from array import array
+from bisect import bisect_right
+from collections import deque
+from statistics import median
+from time import perf_counter_ns
+
+# This module is imported by power_monitor.py and summarizes the acquisition timing recorded by the frame readers.
+#
+# When timing diagnostics are enabled, the frame reader records a perf_counter_ns() timestamp after every block it reads, along with the
+# number of frames in the block (see FrameReader.timing). Batched reads return a whole block from a single ioctl(), so the interval between
+# frames is taken as the block's elapsed time divided by its frame count. Preemption inside a block shows up as a block with a longer
+# average interval, which is counted as a gap.
+
+# Upper edges (in microseconds) of the inter-sample interval histogram bins. The last bin holds everything above the last edge.
+HISTOGRAM_EDGES_US = (10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+HISTOGRAM_LABELS = [f'<{HISTOGRAM_EDGES_US[0]}us'] + [f'{lo}-{hi}us' for lo, hi in zip(HISTOGRAM_EDGES_US, HISTOGRAM_EDGES_US[1:])] + [f'>{HISTOGRAM_EDGES_US[-1]}us']
+
+
+def start_timing():
+    '''Returns a new timing record for a frame reader, starting now.'''
+    return array('q', [0, perf_counter_ns()])
+
+
+class CaptureTiming:
+    '''The timing summary of a single capture.
+
+    Arguments:
+    counts -- list, the number of frame intervals in each histogram bin.
+    frames -- int, the number of frames read.
+    elapsed_ns -- int, the time spent reading them, in nanoseconds.
+    gaps -- int, the number of blocks whose average frame interval was more than gap_factor times the capture's median.
+    max_interval_ns -- float, the longest average frame interval of any block, in nanoseconds.
+    '''
+
+    __slots__ = ('counts', 'frames', 'elapsed_ns', 'gaps', 'max_interval_ns')
+
+    def __init__(self, counts, frames, elapsed_ns, gaps, max_interval_ns):
+        self.counts = counts
+        self.frames = frames
+        self.elapsed_ns = elapsed_ns
+        self.gaps = gaps
+        self.max_interval_ns = max_interval_ns
+
+
+def summarize_timing(timing, gap_factor=1.5):
+    '''Summarizes a timing record (pairs of frame count and timestamp, as recorded by a frame reader) into a CaptureTiming.'''
+    intervals = []  # (frames, average frame interval in ns) for each block
+    prev_t = timing[1]
+    for i in range(2, len(timing), 2):
+        frames, t = timing[i], timing[i + 1]
+        intervals.append((frames, (t - prev_t) / frames))
+        prev_t = t
+
+    counts = [0] * len(HISTOGRAM_LABELS)
+    if not intervals:
+        return CaptureTiming(counts, 0, 0, 0, 0)
+
+    threshold = median(interval for _, interval in intervals) * gap_factor
+    gaps = 0
+    for frames, interval in intervals:
+        counts[bisect_right(HISTOGRAM_EDGES_US, interval / 1000)] += frames
+        if interval > threshold:
+            gaps += 1
+
+    return CaptureTiming(counts, sum(frames for frames, _ in intervals), timing[-1] - timing[1], gaps, max(interval for _, interval in intervals))
+
+
+class TimingStats:
+    '''Keeps the timing summaries of the last <window> captures, and reports the combined histogram, gap count, and per-channel sample rate.'''
+
+    def __init__(self, window=60):
+        self.captures = deque(maxlen=window)
+
+    def add(self, capture_timing):
+        self.captures.append(capture_timing)
+
+    def snapshot(self):
+        '''Returns a dictionary describing the acquisition timing over the window, or None if no captures have been recorded.'''
+        if not self.captures:
+            return None
+
+        counts = [sum(capture.counts[i] for capture in self.captures) for i in range(len(HISTOGRAM_LABELS))]
+        frames = sum(capture.frames for capture in self.captures)
+        elapsed_ns = sum(capture.elapsed_ns for capture in self.captures)
+        return {
+            'captures' : len(self.captures),
+            'histogram' : dict(zip(HISTOGRAM_LABELS, counts)),
+            'gaps' : sum(capture.gaps for capture in self.captures),
+            'max_interval_us' : max(capture.max_interval_ns for capture in self.captures) / 1000,
+            'mean_interval_us' : elapsed_ns / frames / 1000 if frames else 0,
+            'per_channel_sample_rate' : frames / (elapsed_ns / 1e9) if elapsed_ns else 0,
+        }
+
+    def format(self):
+        '''Returns a multi-line text rendering of the snapshot, for terminal mode and the logs.'''
+        snapshot = self.snapshot()
+        if snapshot is None:
+            return "No acquisition timing has been recorded yet."
+
+        total = sum(snapshot['histogram'].values()) or 1
+        lines = [
+            f"Acquisition timing over the last {snapshot['captures']} captures: {round(snapshot['per_channel_sample_rate'], 1)} SPS per channel, "
+            f"mean interval {round(snapshot['mean_interval_us'], 1)} us, max {round(snapshot['max_interval_us'], 1)} us, {snapshot['gaps']} gaps."
+        ]
+        for label, count in snapshot['histogram'].items():
+            if count:
+                lines.append(f"{label:>12} | {'#' * max(1, round(40 * count / total))} {count}")
+
+        return '\n'.join(lines)
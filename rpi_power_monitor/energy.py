@@ -0,0 +1,115 @@
+import json
+import logging
+import os
+from time import monotonic
+
+# This module is imported by power_monitor.py and integrates real power into watt-hour counters on the device.
+#
+# Each capture's real power is integrated with the trapezoid rule between the timestamps of consecutive captures, so a capture that's
+# skipped (for example, an acquisition overrun) still has its energy counted. Positive power is counted as imported energy and negative
+# power as exported energy. When the power changes sign between two captures, the segment is split where it crosses zero.
+#
+# The counters are checkpointed to a JSON file, which is written to a temporary file first and then moved into place with os.replace(),
+# so that a power loss during a write can't corrupt the saved counters.
+
+logger = logging.getLogger('power_monitor')
+
+
+class EnergyCounters:
+    '''Per-source import and export watt-hour counters.
+
+    Arguments:
+    path -- str, the checkpoint file. If it exists, the counters resume from it. None disables checkpoints.
+    checkpoint_interval -- float, the minimum number of seconds between checkpoints.
+    max_gap -- float, the longest gap (in seconds) between two captures that will be integrated. Longer gaps (e.g. the system clock
+               jumping) are skipped and logged, since nothing is known about the power during them.
+    '''
+
+    def __init__(self, path=None, checkpoint_interval=60, max_gap=300):
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+        self.max_gap = max_gap
+        self.counters = dict()      # Source name : {'import' : Wh, 'export' : Wh}
+        self._last = None           # (time, {source : power}) of the previous update
+        self._next_checkpoint = monotonic() + checkpoint_interval
+        if path:
+            self.load()
+
+    def load(self):
+        '''Loads the counters from the checkpoint file, if there is one.'''
+        try:
+            with open(self.path, 'r') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Unable to load the energy counters from {self.path} ({e}). The counters will start from zero.")
+            return
+
+        self.counters = {source : {'import' : float(values.get('import', 0)), 'export' : float(values.get('export', 0))} for source, values in saved.get('counters', {}).items()}
+        logger.debug(f"Loaded the energy counters from {self.path} (saved {saved.get('saved')}).")
+
+    def update(self, powers, time):
+        '''Integrates the power of each source since the previous update.
+
+        Arguments:
+        powers -- dict, maps a source name (such as 'ct1' or 'net') to its real power in watts.
+        time -- datetime, when the power was measured.
+        '''
+        if self._last is not None:
+            last_time, last_powers = self._last
+            dt = (time - last_time).total_seconds()
+            if 0 < dt <= self.max_gap:
+                for source, power in powers.items():
+                    last_power = last_powers.get(source)
+                    if last_power is None:
+                        continue
+                    imported, exported = integrate(last_power, power, dt)
+                    counters = self.counters.setdefault(source, {'import' : 0.0, 'export' : 0.0})
+                    counters['import'] += imported
+                    counters['export'] += exported
+            elif dt > self.max_gap:
+                logger.warning(f"Skipped {round(dt)} seconds of energy integration, because there were no captures during that time.")
+
+        self._last = (time, dict(powers))
+
+        if self.path and monotonic() >= self._next_checkpoint:
+            self.checkpoint()
+
+    def checkpoint(self):
+        '''Atomically writes the counters to the checkpoint file.'''
+        self._next_checkpoint = monotonic() + self.checkpoint_interval
+        if not self.path:
+            return
+        tmp_path = f'{self.path}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'saved' : self._last[0].isoformat() if self._last else None, 'counters' : self.counters}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Unable to save the energy counters to {self.path}: {e}")
+
+    def snapshot(self):
+        '''Returns a copy of the counters, in watt-hours, keyed by source.'''
+        return {source : dict(values) for source, values in self.counters.items()}
+
+
+def integrate(p0, p1, dt):
+    '''Integrates a linear power segment from <p0> to <p1> watts over <dt> seconds.
+
+    Returns a tuple of (imported Wh, exported Wh), both positive.
+    '''
+    if p0 >= 0 and p1 >= 0:
+        return (p0 + p1) / 2 * dt / 3600, 0.0
+    if p0 <= 0 and p1 <= 0:
+        return 0.0, -(p0 + p1) / 2 * dt / 3600
+
+    # The segment crosses zero - split it where it does.
+    t_zero = dt * p0 / (p0 - p1)
+    first = p0 / 2 * t_zero / 3600
+    second = p1 / 2 * (dt - t_zero) / 3600
+    if p0 > 0:
+        return first, -second
+    return second, -first
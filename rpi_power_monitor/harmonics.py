@@ -0,0 +1,132 @@
+import logging
+from math import cos, pi, sqrt
+from time import perf_counter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# This module is imported by power_monitor.py and measures the harmonic content of captured current and voltage waveforms.
+#
+# Each waveform has its mean removed and is multiplied by a Hann window (the coefficients are cached per capture length). With NumPy, the
+# spectrum comes from a single real FFT, and each harmonic's amplitude is taken from the bins around its expected frequency (the capture
+# isn't synchronized to the line, so each harmonic's energy spreads over the window's main lobe). Without NumPy, the Goertzel algorithm is
+# evaluated at each harmonic frequency instead, which is cheaper than a full DFT when only a handful of frequencies are needed.
+
+logger = logging.getLogger('power_monitor')
+
+MAIN_LOBE_BINS = 2  # Half width of the Hann window's main lobe, in FFT bins.
+MIN_CYCLES = 2 * MAIN_LOBE_BINS + 1     # Shorter captures can't separate neighboring harmonics.
+
+
+class HarmonicAnalyzer:
+    '''Computes THD and the harmonic spectrum (up to <max_harmonic>) of captured waveforms.
+
+    Analysis is rate limited so that it never takes more than <budget> (a fraction, e.g. 0.05 for 5%) of the main loop's time, and runs at
+    most once every <interval> seconds. Call due() before analyze() to find out if a capture should be analyzed.
+    '''
+
+    def __init__(self, frequency=60, max_harmonic=15, interval=10, budget=0.05, vectorized=True):
+        self.frequency = frequency
+        self.max_harmonic = max_harmonic
+        self.interval = interval
+        self.budget = budget
+        self.vectorized = vectorized and np is not None
+        self._windows = dict()      # Hann window coefficients, keyed by length.
+        self._next_run = 0
+        self._limited = False
+        self._too_short = False
+
+    def due(self):
+        '''Returns True if enough time has passed since the last analysis.'''
+        return perf_counter() >= self._next_run
+
+    def analyze(self, waveforms, sample_rate):
+        '''Analyzes each waveform, and schedules the next analysis so that the time spent stays within the budget.
+
+        Arguments:
+        waveforms -- dict, maps a name (such as 'ct1' or 'voltage') to a sequence of raw samples.
+        sample_rate -- float, samples per second of each waveform.
+
+        Returns a dictionary keyed like <waveforms>, where each value is a dictionary with 'thd' (total harmonic distortion, in percent)
+        and 'harmonics' (a list of each harmonic's amplitude as a percentage of the fundamental, starting with the 2nd harmonic).
+        Returns None if the waveforms cover fewer than MIN_CYCLES line cycles.
+        '''
+        start = perf_counter()
+        length = len(next(iter(waveforms.values())))
+        cycles = length * self.frequency / sample_rate
+        if cycles < MIN_CYCLES:
+            if not self._too_short:
+                logger.warning(f"Captures only cover {round(cycles, 1)} line cycles, which is too short for harmonic analysis (at least {MIN_CYCLES} are needed). Use a longer capture, such as line_cycles = {MIN_CYCLES + 1}.")
+                self._too_short = True
+            self._next_run = start + self.interval
+            return None
+
+        max_harmonic = min(self.max_harmonic, int((sample_rate / 2) // self.frequency))
+        if max_harmonic < self.max_harmonic and not self._limited:
+            logger.warning(f"The per-channel sample rate ({round(sample_rate)} SPS) is too low to measure harmonics above the {max_harmonic}th.")
+            self._limited = True
+
+        results = dict()
+        for name, samples in waveforms.items():
+            if self.vectorized:
+                amplitudes = self._amplitudes_fft(samples, sample_rate, max_harmonic)
+            else:
+                amplitudes = self._amplitudes_goertzel(samples, sample_rate, max_harmonic)
+            results[name] = spectrum(amplitudes)
+
+        elapsed = perf_counter() - start
+        self._next_run = start + max(self.interval, elapsed / self.budget)
+        return results
+
+    def window(self, length):
+        '''Returns the (cached) Hann window coefficients for a capture of <length> samples.'''
+        window = self._windows.get(length)
+        if window is None:
+            if self.vectorized:
+                window = np.hanning(length)
+            else:
+                window = [0.5 - 0.5 * cos(2 * pi * n / (length - 1)) for n in range(length)]
+            self._windows[length] = window
+        return window
+
+    def _amplitudes_fft(self, samples, sample_rate, max_harmonic):
+        x = np.asarray(samples, dtype=np.float64)
+        x = (x - x.mean()) * self.window(len(x))
+        power = np.abs(np.fft.rfft(x)) ** 2
+        bin_width = sample_rate / len(x)
+
+        amplitudes = []
+        for h in range(1, max_harmonic + 1):
+            center = int(round(h * self.frequency / bin_width))
+            lo = max(1, center - MAIN_LOBE_BINS)
+            hi = min(len(power), center + MAIN_LOBE_BINS + 1)
+            amplitudes.append(sqrt(power[lo:hi].sum()))
+        return amplitudes
+
+    def _amplitudes_goertzel(self, samples, sample_rate, max_harmonic):
+        mean = sum(samples) / len(samples)
+        x = [(value - mean) * w for value, w in zip(samples, self.window(len(samples)))]
+
+        amplitudes = []
+        for h in range(1, max_harmonic + 1):
+            coeff = 2 * cos(2 * pi * h * self.frequency / sample_rate)
+            s1 = s2 = 0.0
+            for value in x:
+                s1, s2 = value + coeff * s1 - s2, s1
+            amplitudes.append(sqrt(max(0.0, s1 * s1 + s2 * s2 - coeff * s1 * s2)))
+        return amplitudes
+
+
+def spectrum(amplitudes):
+    '''Converts a list of harmonic amplitudes (starting with the fundamental) into THD and harmonic percentages of the fundamental.'''
+    fundamental = amplitudes[0]
+    if not fundamental:
+        return {'thd' : 0, 'harmonics' : [0] * (len(amplitudes) - 1)}
+
+    harmonics = [100 * amplitude / fundamental for amplitude in amplitudes[1:]]
+    return {
+        'thd' : sqrt(sum(h * h for h in harmonics)),
+        'harmonics' : harmonics,
+    }
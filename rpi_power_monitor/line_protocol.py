@@ -0,0 +1,177 @@
+import re
+from datetime import datetime, timedelta, timezone
+from time import monotonic
+
+# This module is imported by power_monitor.py and serializes points directly into InfluxDB line protocol, which is written with
+# write_points(protocol='line').
+#
+# Each point is formatted into a single line as soon as it's added, so no intermediate dictionaries are built, and the client doesn't
+# need to re-serialize anything. The series key of each measurement and tag set (the part of the line before the fields, including the
+# power monitor's 'id' tag) is escaped once and cached, as are the field keys. Numeric fields are always written as floats, so a figure that happens to be a
+# whole number (e.g. a power factor of 0) can't conflict with the field's float type in the database.
+#
+# parse_line() does the reverse, for storage backends that keep the points themselves (see local_store.py).
+
+EPOCH = datetime(1970, 1, 1)
+MILLISECOND = timedelta(milliseconds=1)
+
+KEY_ESCAPES = re.compile(r'\\([,= ])')
+STRING_ESCAPES = re.compile(r'\\(["\\])')
+
+
+def escape_measurement(name):
+    return str(name).replace(',', r'\,').replace(' ', r'\ ')
+
+
+def escape_key(key):
+    '''Escapes a tag key, tag value, or field key.'''
+    return str(key).replace(',', r'\,').replace('=', r'\=').replace(' ', r'\ ')
+
+
+def format_value(value):
+    '''Formats a field value.'''
+    if type(value) is float:
+        return repr(value)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return repr(float(value))
+    return '"' + str(value).replace('\\', '\\\\').replace('"', r'\"') + '"'
+
+
+def timestamp_ms(time):
+    '''Converts a datetime (naive UTC, or timezone aware) to integer milliseconds since the epoch.'''
+    if time.tzinfo is not None:
+        time = time.astimezone(timezone.utc).replace(tzinfo=None)
+    return (time - EPOCH) // MILLISECOND
+
+
+def split_unescaped(text, separator, maxsplit=-1):
+    '''Splits <text> on each <separator> that isn't escaped with a backslash or inside a double quoted string.'''
+    parts = []
+    start = 0
+    quoted = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == '\\':
+            i += 1
+        elif char == '"':
+            quoted = not quoted
+        elif char == separator and not quoted and len(parts) != maxsplit:
+            parts.append(text[start:i])
+            start = i + 1
+        i += 1
+    parts.append(text[start:])
+    return parts
+
+
+def parse_value(value):
+    '''Parses a field value.'''
+    if not value:
+        raise ValueError("Missing field value.")
+    if value[0] == '"':
+        return STRING_ESCAPES.sub(r'\1', value[1:-1])
+    if value in ('t', 'T', 'true', 'True', 'TRUE'):
+        return True
+    if value in ('f', 'F', 'false', 'False', 'FALSE'):
+        return False
+    if value[-1] in 'iu':
+        return int(value[:-1])
+    return float(value)
+
+
+def parse_line(line):
+    '''Parses a line of line protocol. Raises ValueError if it's invalid.
+
+    Returns a tuple of (measurement, tags, fields, timestamp), where tags is a sorted tuple of (key, value) pairs, fields is a dict, and
+    timestamp is the line's timestamp (or None if it doesn't have one).
+    '''
+    simple = '\\' not in line and '"' not in line     # True for every line the power monitor writes.
+    parts = line.split(' ') if simple else split_unescaped(line, ' ')
+    if len(parts) not in (2, 3):
+        raise ValueError(f"Invalid line protocol: {line!r}")
+
+    if simple:
+        series = parts[0].split(',')
+        measurement = series[0]
+        tags = tuple(sorted(tag.split('=', 1) for tag in series[1:]))
+        field_set = [field.split('=', 1) for field in parts[1].split(',')]
+    else:
+        series = split_unescaped(parts[0], ',')
+        measurement = KEY_ESCAPES.sub(r'\1', series[0])
+        tags = tuple(sorted([KEY_ESCAPES.sub(r'\1', item) for item in split_unescaped(tag, '=', 1)] for tag in series[1:]))
+        field_set = [split_unescaped(field, '=', 1) for field in split_unescaped(parts[1], ',')]
+        field_set = [(KEY_ESCAPES.sub(r'\1', field[0]), *field[1:]) for field in field_set]
+
+    if not measurement or any(len(tag) != 2 for tag in tags) or any(len(field) != 2 for field in field_set):
+        raise ValueError(f"Invalid line protocol: {line!r}")
+    fields = {key : parse_value(value) for key, value in field_set}
+    return measurement, tuple(tuple(tag) for tag in tags), fields, int(parts[2]) if len(parts) == 3 else None
+
+
+class LineProtocolBuffer:
+    '''A batch of points in line protocol, with millisecond timestamps.
+
+    Arguments:
+    identifier -- str, the power monitor's name, which is added to every point as the 'id' tag.
+    '''
+
+    def __init__(self, identifier):
+        self.identifier = identifier
+        self.lines = []
+        self.size = 0           # Length of the batch in characters, without the newlines between the lines.
+        self.started = None     # monotonic() time of the oldest point in the batch.
+        self._series = dict()   # (measurement, tags) : escaped series key
+        self._keys = dict()     # Field key : escaped field key
+        self._time = None       # The last timestamp that was converted, and its value in milliseconds. Most points of a batch share it.
+        self._time_ms = None
+
+    def __len__(self):
+        return len(self.lines)
+
+    def series(self, measurement, tags=()):
+        '''Returns the escaped series key of <measurement> with <tags> (a tuple of (key, value) pairs) and the id tag.'''
+        key = (measurement, tags)
+        series = self._series.get(key)
+        if series is None:
+            tag_set = sorted([(str(k), v) for k, v in tags] + [('id', self.identifier)])
+            series = escape_measurement(measurement) + ''.join(f',{escape_key(k)}={escape_key(v)}' for k, v in tag_set)
+            self._series[key] = series
+        return series
+
+    def add(self, measurement, fields, time, tags=()):
+        '''Formats a point and adds it to the batch. Fields that are None are left out.
+
+        Arguments:
+        measurement -- str, the measurement name.
+        fields -- dict, maps each field key to its value.
+        time -- datetime, the point's timestamp.
+        tags -- tuple, (key, value) pairs of tags, in addition to the id tag.
+        '''
+        keys = self._keys
+        field_set = ','.join(f'{keys.get(k) or keys.setdefault(k, escape_key(k))}={format_value(v)}' for k, v in fields.items() if v is not None)
+        if not field_set:
+            return
+        if time is not self._time:
+            self._time = time
+            self._time_ms = timestamp_ms(time)
+        line = f'{self.series(measurement, tags)} {field_set} {self._time_ms}'
+        if not self.lines:
+            self.started = monotonic()
+        self.lines.append(line)
+        self.size += len(line)
+
+    def getvalue(self):
+        '''Returns the batch as a single line protocol string.'''
+        return '\n'.join(self.lines)
+
+    def age(self):
+        '''Returns the number of seconds since the oldest point in the batch was added, or 0 if the batch is empty.'''
+        return monotonic() - self.started if self.lines else 0
+
+    def clear(self):
+        '''Empties the batch. The cached series keys are kept.'''
+        self.lines.clear()
+        self.size = 0
+        self.started = None
@@ -0,0 +1,404 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from time import time
+
+from line_protocol import EPOCH, MILLISECOND, parse_line, timestamp_ms
+from storage import StorageBackend, RejectedWriteError, RetryableWriteError
+
+# This module is imported by power_monitor.py and provides the 'local' storage backend, which keeps the points in SQLite files on the Pi
+# instead of sending them to InfluxDB.
+#
+# Points are stored in tiers: 'autogen' holds the points that are written without a retention policy (raw_cts, home_load, solar, net,
+# voltages, ...), the rollup retention policies (rp_1min, ...) each get their own tier, and 'downsampled' holds the raw points summarized
+# to the mean, min, and max of each field over <downsample_interval> (as <field>, <field>_min, and <field>_max, with the number of raw
+# points in _points). Each tier is a directory of time-partitioned files: one per UTC day for the raw points, and one per UTC month for the
+# other tiers. A raw partition is downsampled once its day is over, and whole partitions are deleted once they're older than their tier's
+# retention, so expiring data never rewrites what's kept. This maintenance runs in its own thread with its own connections, so writes
+# (and the sampling loop, when there's no background writer) never wait for a day to be downsampled. Each write to a raw partition counts
+# up its 'changes', and a day is downsampled again if points were written to it since it was last downsampled.
+#
+# Within a partition, each measurement is a table with a column per field, keyed by series and time. A series is a measurement and tag set
+# (stored in the _series table), so a point costs one row of floats rather than a copy of its tags and field keys. Each batch is written
+# in a single transaction, in WAL mode with synchronous = NORMAL, which keeps SD card writes to about the size of the data itself.
+#
+# query() returns the points of a time range, and aggregate() returns the mean, min, max, and count of a field per interval. Both open
+# their own read-only connections, so they can be called from any thread while points are being written.
+
+logger = logging.getLogger('power_monitor')
+
+RAW = 'autogen'             # The tier of points that are written without a retention policy.
+DOWNSAMPLED = 'downsampled' # The tier that the raw points are downsampled into.
+DAY = 86400000              # Milliseconds per day.
+MAX_OPEN = 4                # The most partitions that are kept open for writing.
+CACHE_KB = 512              # SQLite page cache per open partition.
+
+
+def quote(identifier):
+    '''Quotes a table or column name.'''
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def partition_name(tier, time):
+    '''Returns the name of the <tier> partition that holds the time <time> (milliseconds since the epoch).'''
+    date = EPOCH + time * MILLISECOND
+    return date.strftime('%Y-%m-%d') if tier == RAW else date.strftime('%Y-%m')
+
+
+def partition_bounds(name):
+    '''Returns the (start, end) of the partition <name>, in milliseconds since the epoch.'''
+    if len(name) == 10:
+        start = datetime.strptime(name, '%Y-%m-%d')
+        end = start + timedelta(days=1)
+    else:
+        start = datetime.strptime(name, '%Y-%m')
+        end = (start + timedelta(days=32)).replace(day=1)
+    return timestamp_ms(start), timestamp_ms(end)
+
+
+class Partition:
+    '''A single partition file.
+
+    Arguments:
+    path -- str, the partition file.
+    readonly -- bool, True to open an existing partition for queries only.
+    '''
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        if readonly:
+            self.db = sqlite3.connect(f'file:{path}?mode=ro', uri=True, isolation_level=None, check_same_thread=False)
+        else:
+            self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode = WAL')
+            self.db.execute('PRAGMA synchronous = NORMAL')
+            self.db.execute(f'PRAGMA cache_size = -{CACHE_KB}')
+            self.db.execute('CREATE TABLE IF NOT EXISTS _series (id INTEGER PRIMARY KEY, measurement TEXT NOT NULL, tags TEXT NOT NULL, UNIQUE (measurement, tags))')
+            self.db.execute('CREATE TABLE IF NOT EXISTS _meta (key TEXT PRIMARY KEY, value)')
+        self._statements = dict()
+        self.load()
+
+    def load(self):
+        '''Loads the partition's series and measurement columns.'''
+        self.series = dict()    # (measurement, tags) : series id
+        self.tags = dict()      # Series id : (measurement, tags)
+        for series_id, measurement, tags in self.db.execute('SELECT id, measurement, tags FROM _series'):
+            tags = tuple(sorted(json.loads(tags).items()))
+            self.series[(measurement, tags)] = series_id
+            self.tags[series_id] = (measurement, tags)
+        self.columns = dict()   # Measurement : field columns
+        for (table,) in self.db.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE '\\_%' ESCAPE '\\'"):
+            self.columns[table] = [row[1] for row in self.db.execute(f'PRAGMA table_info({quote(table)})')][2:]
+
+    def get_meta(self, key):
+        row = self.db.execute('SELECT value FROM _meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO _meta (key, value) VALUES (?, ?)', (key, value))
+
+    def count_change(self):
+        '''Counts a write to the partition, so that maintenance can tell that it changed.'''
+        self.db.execute("INSERT INTO _meta (key, value) VALUES ('changes', 1) ON CONFLICT (key) DO UPDATE SET value = value + 1")
+
+    def series_id(self, measurement, tags):
+        '''Returns the id of the series of <measurement> with <tags> (a sorted tuple of (key, value) pairs), adding it if it's new.'''
+        series_id = self.series.get((measurement, tags))
+        if series_id is None:
+            series_id = self.db.execute('INSERT INTO _series (measurement, tags) VALUES (?, ?)', (measurement, json.dumps(dict(tags), sort_keys=True))).lastrowid
+            self.series[(measurement, tags)] = series_id
+            self.tags[series_id] = (measurement, tags)
+        return series_id
+
+    def match(self, measurement, tags=None):
+        '''Returns the ids of the series of <measurement> that have all of <tags> (a dict).'''
+        wanted = {(key, str(value)) for key, value in (tags or {}).items()}
+        return [series_id for series_id, (name, series_tags) in self.tags.items() if name == measurement and wanted.issubset(series_tags)]
+
+    def insert(self, measurement, keys, rows):
+        '''Stores rows of (series id, time, values...), where the values are those of the fields <keys>.
+
+        Like InfluxDB, a point with the same series and time as a stored point updates its fields.
+        '''
+        statement = self._statements.get((measurement, keys))
+        if statement is None:
+            columns = self.columns.get(measurement)
+            if columns is None:
+                self.db.execute(f'CREATE TABLE {quote(measurement)} (time INTEGER NOT NULL, series INTEGER NOT NULL, PRIMARY KEY (series, time)) WITHOUT ROWID')
+                columns = self.columns[measurement] = []
+            for key in keys:
+                if key not in columns:
+                    self.db.execute(f'ALTER TABLE {quote(measurement)} ADD COLUMN {quote(key)}')
+                    columns.append(key)
+            statement = (f'INSERT INTO {quote(measurement)} (series, time, {", ".join(quote(key) for key in keys)}) VALUES ({", ".join("?" * (len(keys) + 2))}) '
+                         f'ON CONFLICT (series, time) DO UPDATE SET {", ".join(f"{quote(key)} = excluded.{quote(key)}" for key in keys)}')
+            self._statements[(measurement, keys)] = statement
+        self.db.executemany(statement, rows)
+
+    def close(self):
+        self.db.close()
+
+
+class LocalStore(StorageBackend):
+    '''Stores points in time-partitioned SQLite files.
+
+    Arguments:
+    path -- str, the directory of the store.
+    retention -- dict, maps tiers to the number of days that their points are kept. Tiers that aren't listed (or are None) are kept forever.
+    downsample_interval -- int, seconds summarized by each point of the downsampled tier. Must divide a day evenly. 0 disables downsampling.
+    maintenance_interval -- float, seconds between checks for partitions to downsample or delete (by the maintenance thread).
+    '''
+
+    def __init__(self, path, retention=None, downsample_interval=60, maintenance_interval=3600):
+        if downsample_interval and (downsample_interval < 1 or 86400 % downsample_interval):
+            raise ValueError(f"The downsample interval ({downsample_interval} seconds) must divide a day evenly.")
+        self.path = path
+        self.retention = retention or dict()
+        self.downsample_interval = downsample_interval
+        self.maintenance_interval = maintenance_interval
+        self.partitions = OrderedDict()     # (tier, name) : Partition open for writing, least recently used first.
+        self.lock = threading.Lock()       # Guards the partitions that are open for writing.
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def connect(self):
+        os.makedirs(self.path, exist_ok=True)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run_maintenance, name='local-store-maintenance', daemon=True)
+            self._thread.start()
+
+    def run_maintenance(self):
+        while not self._stopping.is_set():
+            try:
+                self.maintain()
+            except Exception as e:
+                logger.warning(f"Local store maintenance failed: {e}")
+            self._stopping.wait(self.maintenance_interval)
+
+    def partition_path(self, tier, name):
+        return os.path.join(self.path, tier, f'{name}.db')
+
+    def list_partitions(self, tier):
+        '''Returns the names of the partitions of <tier>, oldest first.'''
+        try:
+            return sorted(name[:-3] for name in os.listdir(os.path.join(self.path, tier)) if name.endswith('.db'))
+        except FileNotFoundError:
+            return []
+
+    def partition(self, tier, name):
+        '''Returns the partition <name> of <tier> for writing, creating it if it doesn't exist.'''
+        partition = self.partitions.get((tier, name))
+        if partition is not None:
+            self.partitions.move_to_end((tier, name))
+            return partition
+
+        os.makedirs(os.path.join(self.path, tier), exist_ok=True)
+        partition = self.partitions[(tier, name)] = Partition(self.partition_path(tier, name))
+        while len(self.partitions) > MAX_OPEN:
+            self.partitions.popitem(last=False)[1].close()
+        return partition
+
+    def discard(self, tier, name):
+        '''Closes a partition that's open for writing, so that it's reloaded from its file when it's next used.'''
+        partition = self.partitions.pop((tier, name), None)
+        if partition is not None:
+            partition.close()
+
+    def write(self, data, retention_policy=None):
+        tier = retention_policy or RAW
+        now = int(time() * 1000)
+        batches = dict()    # Partition name : [(measurement, tags, fields, time), ...]
+        try:
+            for line in data.split('\n'):
+                if line:
+                    measurement, tags, fields, timestamp = parse_line(line)
+                    timestamp = now if timestamp is None else timestamp
+                    batches.setdefault(partition_name(tier, timestamp), []).append((measurement, tags, fields, timestamp))
+        except ValueError as e:
+            raise RejectedWriteError(e) from e
+
+        with self.lock:
+            for name, points in batches.items():
+                try:
+                    partition = self.partition(tier, name)
+                    partition.db.execute('BEGIN')
+                    rows = dict()   # (measurement, field keys) : [(series id, time, values...), ...]
+                    for measurement, tags, fields, timestamp in points:
+                        rows.setdefault((measurement, tuple(fields)), []).append((partition.series_id(measurement, tags), timestamp, *fields.values()))
+                    for (measurement, keys), measurement_rows in rows.items():
+                        partition.insert(measurement, keys, measurement_rows)
+                    if tier == RAW:
+                        partition.count_change()
+                    partition.db.execute('COMMIT')
+                except (sqlite3.Error, OSError) as e:
+                    # The transaction is rolled back, and the partition is reopened so that its cached series and columns match the file.
+                    self.discard(tier, name)
+                    raise RetryableWriteError(e) from e
+
+    def maintain(self):
+        '''Downsamples the raw partitions of past days, and deletes the partitions that are older than their tier's retention.
+
+        Called by the maintenance thread. Only deleting a partition waits for the write lock.
+        '''
+        now = int(time() * 1000)
+        today = partition_name(RAW, now)
+        pending = set()     # Raw partitions that haven't been downsampled.
+        if self.downsample_interval:
+            for name in self.list_partitions(RAW):
+                if self._stopping.is_set():
+                    return
+                if name >= today:
+                    continue
+                try:
+                    self.downsample(name)
+                except (sqlite3.Error, OSError) as e:
+                    logger.warning(f"Failed to downsample the {name} partition of the local store: {e}")
+                    pending.add(name)
+
+        for tier in os.listdir(self.path):
+            days = self.retention.get(tier)
+            if not days or not os.path.isdir(os.path.join(self.path, tier)):
+                continue
+            for name in self.list_partitions(tier):
+                if partition_bounds(name)[1] > now - days * DAY or (tier == RAW and name in pending):
+                    continue
+                path = self.partition_path(tier, name)
+                with self.lock:
+                    self.discard(tier, name)
+                    for suffix in ('', '-wal', '-shm'):
+                        try:
+                            os.remove(path + suffix)
+                        except FileNotFoundError:
+                            pass
+                logger.debug(f"Deleted the {name} partition of the {tier} tier of the local store.")
+
+    def downsample(self, name):
+        '''Summarizes the raw partition <name> into the downsampled tier, unless it hasn't changed since it was last downsampled.'''
+        start, end = partition_bounds(name)
+        step = self.downsample_interval * 1000
+        source = Partition(self.partition_path(RAW, name))
+        target = None
+        try:
+            # The source is read from a single snapshot, so points written during the downsampling count as a change for the next run.
+            source.db.execute('BEGIN')
+            changes = source.get_meta('changes')
+            if changes == source.get_meta('downsampled'):
+                return
+            source.load()
+
+            os.makedirs(os.path.join(self.path, DOWNSAMPLED), exist_ok=True)
+            target = Partition(self.partition_path(DOWNSAMPLED, partition_name(DOWNSAMPLED, start)))
+            target.db.execute('BEGIN')
+            for measurement, columns in source.columns.items():
+                if not columns:
+                    continue
+                if measurement in target.columns:
+                    # Remove the figures of an earlier run, in case late points were written to the day since.
+                    target.db.execute(f'DELETE FROM {quote(measurement)} WHERE time >= ? AND time < ?', (start, end))
+                figures = ', '.join(f'AVG({quote(column)}), MIN({quote(column)}), MAX({quote(column)})' for column in columns)
+                rows = source.db.execute(f'SELECT series, time / {step} * {step} AS bucket, COUNT(*), {figures} FROM {quote(measurement)} GROUP BY series, bucket')
+                keys = ('_points',) + tuple(key for column in columns for key in (column, f'{column}_min', f'{column}_max'))
+                target.insert(measurement, keys, [(target.series_id(*source.tags[row[0]]), *row[1:]) for row in rows])
+            target.db.execute('COMMIT')
+            source.db.execute('COMMIT')
+            source.set_meta('downsampled', changes)
+        finally:
+            source.close()
+            if target is not None:
+                target.close()
+        logger.debug(f"Downsampled the {name} partition of the local store.")
+
+    def read_partitions(self, tier, start, end):
+        '''Yields the partitions of <tier> that overlap <start> to <end> (milliseconds since the epoch), opened read-only.'''
+        for name in self.list_partitions(tier):
+            first, last = partition_bounds(name)
+            if first >= end or last <= start:
+                continue
+            try:
+                partition = Partition(self.partition_path(tier, name), readonly=True)
+            except sqlite3.Error as e:
+                logger.debug(f"Skipped the {name} partition of the local store: {e}")
+                continue
+            try:
+                yield partition
+            finally:
+                partition.close()
+
+    def query(self, measurement, start, end, fields=None, tags=None, tier=RAW):
+        '''Returns the points of <measurement> from <start> to <end>.
+
+        Arguments:
+        measurement -- str, the measurement name (e.g. 'home_load').
+        start, end -- datetime, naive UTC or timezone aware. <end> is exclusive.
+        fields -- list, the field keys to return. None returns every field.
+        tags -- dict, only return points that have these tag values (e.g. {'ct' : 1}).
+        tier -- str, the retention policy that the points were written to, or DOWNSAMPLED.
+
+        Returns a list of (time, tags, fields) tuples, oldest first, where time is a naive UTC datetime and tags and fields are dicts.
+        '''
+        start, end = timestamp_ms(start), timestamp_ms(end)
+        points = []
+        for partition in self.read_partitions(tier, start, end):
+            columns = [column for column in partition.columns.get(measurement, []) if fields is None or column in fields]
+            series_ids = partition.match(measurement, tags)
+            if not columns or not series_ids:
+                continue
+            rows = partition.db.execute(f'SELECT time, series, {", ".join(quote(column) for column in columns)} FROM {quote(measurement)} '
+                                        f'WHERE series IN ({", ".join("?" * len(series_ids))}) AND time >= ? AND time < ?', (*series_ids, start, end))
+            for row in rows:
+                points.append((row[0], dict(partition.tags[row[1]][1]), {column : value for column, value in zip(columns, row[2:]) if value is not None}))
+        points.sort(key=lambda point: point[0])
+        return [(EPOCH + timestamp * MILLISECOND, point_tags, point_fields) for timestamp, point_tags, point_fields in points]
+
+    def aggregate(self, measurement, field, start, end, interval=None, tags=None, tier=RAW):
+        '''Returns the mean, min, max, and count of <field> in each series of <measurement>, per <interval>, from <start> to <end>.
+
+        Arguments:
+        measurement, start, end, tags, tier -- see query().
+        field -- str, the field key.
+        interval -- int, seconds per result, aligned to the epoch (like InfluxDB's GROUP BY time()). None for a single result per series.
+
+        The points of the downsampled tier are weighted by the number of raw points that they summarize.
+        Returns a list of (time, tags, mean, min, max, count) tuples, ordered by tags and then time. time is the start of the interval.
+        '''
+        start, end = timestamp_ms(start), timestamp_ms(end)
+        bucket = f'time / {interval * 1000} * {interval * 1000}' if interval else str(start)
+        value = quote(field)
+        if tier == DOWNSAMPLED:
+            figures = f'SUM(CASE WHEN {value} IS NULL THEN 0 ELSE "_points" END), SUM({value} * "_points"), MIN({quote(field + "_min")}), MAX({quote(field + "_max")})'
+        else:
+            figures = f'COUNT({value}), SUM({value}), MIN({value}), MAX({value})'
+
+        results = dict()    # (tags, bucket) : [count, sum, min, max]
+        for partition in self.read_partitions(tier, start, end):
+            series_ids = partition.match(measurement, tags)
+            if field not in partition.columns.get(measurement, []) or not series_ids:
+                continue
+            rows = partition.db.execute(f'SELECT series, {bucket} AS bucket, {figures} FROM {quote(measurement)} '
+                                        f'WHERE series IN ({", ".join("?" * len(series_ids))}) AND time >= ? AND time < ? GROUP BY series, bucket', (*series_ids, start, end))
+            for series_id, time_bucket, count, total, low, high in rows:
+                if not count:
+                    continue
+                key = (partition.tags[series_id][1], time_bucket)
+                result = results.get(key)
+                if result is None:
+                    results[key] = [count, total, low, high]
+                else:
+                    # The same interval in another partition (an interval that spans partitions, or a series across the whole range).
+                    result[0] += count
+                    result[1] += total
+                    result[2] = min(result[2], low)
+                    result[3] = max(result[3], high)
+        return [(EPOCH + time_bucket * MILLISECOND, dict(series_tags), total / count, low, high, count) for (series_tags, time_bucket), (count, total, low, high) in sorted(results.items())]
+
+    def close(self):
+        self._stopping.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(10)
+        with self.lock:
+            while self.partitions:
+                self.partitions.popitem()[1].close()
@@ -17,8 +17,9 @@ def plot_data(samples, title, sample_rate, enabled_channels, *args, **kwargs):
     fig = make_subplots(specs=[[{"secondary_y": True}]])
     for chan_num in enabled_channels:
 
-        fig.add_trace(go.Scatter(x=x, y=samples[f'ct{chan_num}'], name=f'CT {chan_num}'))
-        fig.add_trace(go.Scatter(x=x, y=samples[f'v{chan_num}'], name=f'AC Voltage ({chan_num})'), secondary_y=True)
+        # The sample buffers are compact arrays, which plotly doesn't accept directly.
+        fig.add_trace(go.Scatter(x=x, y=list(samples[f'ct{chan_num}']), name=f'CT {chan_num}'))
+        fig.add_trace(go.Scatter(x=x, y=list(samples[f'v{chan_num}']), name=f'AC Voltage ({chan_num})'), secondary_y=True)
 
     fig.update_layout(
         title=title,
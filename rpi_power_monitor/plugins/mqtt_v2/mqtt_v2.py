@@ -24,6 +24,8 @@ def start_plugin(data, stop_flag, config, logger, *args, **kwargs):
     minchangedict["voltage"] = config.get('voltage_change')
     minchangedict["pf"] = config.get('pf_change')
     minchangedict["current"] = config.get('current_change')
+    minchangedict["import_wh"] = config.get('energy_change', 0)
+    minchangedict["export_wh"] = config.get('energy_change', 0)
     max_publish_seconds = config.get('max_publish_seconds')
     lastpublishval = {}
     client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
@@ -136,6 +138,24 @@ def start_plugin(data, stop_flag, config, logger, *args, **kwargs):
                     lastpublishval["net"][key] = value
                     lastpublishval["net"][key + "-time"] = time()
 
+        for source, counters in data.get('energy', {}).items():
+            for key, value in (('import_wh', counters['import']), ('export_wh', counters['export'])):
+                topic = f"{prefix}/energy/{source}/{key}"
+                payload = str(round(value, 2))
+                try:
+                    testvar = lastpublishval["energy-" + source]
+                except KeyError:
+                    lastpublishval["energy-" + source] = {}
+                try:
+                    testvar = lastpublishval["energy-" + source][key]
+                except KeyError:
+                    lastpublishval["energy-" + source][key] = 0
+                    lastpublishval["energy-" + source][key + "-time"] = 0
+                if abs(value - lastpublishval["energy-" + source][key]) >= minchangedict[key] or time() - lastpublishval["energy-" + source][key + "-time"] >= max_publish_seconds:
+                    client.publish(topic, payload)
+                    lastpublishval["energy-" + source][key] = value
+                    lastpublishval["energy-" + source][key + "-time"] = time()
+
         topic = f"{prefix}/voltage"
         voltage = data.get('voltage')
         if voltage is not None:
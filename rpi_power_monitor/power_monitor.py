@@ -5,8 +5,8 @@ import os
 import subprocess
 import sys
 import timeit
-from datetime import datetime
-from math import sqrt, cos
+from datetime import datetime, timedelta
+from math import sqrt, cos, floor
 from socket import AF_INET, SOCK_DGRAM, socket, getaddrinfo
 import ipaddress
 from textwrap import dedent
@@ -20,10 +20,28 @@ from multiprocessing import Manager, Event
 import signal
 from copy import deepcopy
 import os
+from array import array
+from functools import partial
+from contextlib import nullcontext
 
 from plotting import plot_data
-from influxdb import InfluxDBClient
-from influxdb.exceptions import InfluxDBServerError
+from adc import FrameReader, FrameReaderGroup, BoardVoltageTracker, ADC_CHANNELS
+from acquisition import AcquisitionWorker
+from calculations import all_channel_sums, delay_samples, StreamAccumulator
+from channel_plan import ChannelPlan
+from harmonics import HarmonicAnalyzer
+from aggregation import RollingAggregate, Decimator, METHODS as AVERAGING_METHODS
+from energy import EnergyCounters
+from rollups import Rollups, parse_interval
+from line_protocol import LineProtocolBuffer
+from writer import InfluxWriter, POLICIES as WRITE_QUEUE_POLICIES
+from batching import AdaptiveBatchPolicy
+from spool import Spool
+from diagnostics import TimingStats, start_timing, summarize_timing
+from realtime import apply_realtime, release_cpu, gc_paused, measure_jitter, format_jitter
+from simulator import SimulatedSpiDev
+from storage import create_backend, RetryableWriteError, RejectedWriteError, BACKENDS as STORAGE_BACKENDS
+from local_store import LocalStore
 
 # Logging Config
 logger = logging.getLogger('power_monitor')
@@ -42,6 +60,7 @@ parser.add_argument('--mode', type=str, help="Operating Mode. Defaults to 'main'
 parser.add_argument('--samples', type=int, help="Optionally specify the number of samples to capture in plot mode.", required=False)
 parser.add_argument('--title', type=str, help="Optionally specify the title of the generated plot.", required=False)
 parser.add_argument('--config', type=pathlib.Path, help='path to config.toml file.', default= os.path.join(module_root, 'config.toml'), required=False)
+parser.add_argument('--simulate', type=str, nargs='?', const='synthetic', help="Use a simulated ADC instead of the power monitor HAT. Provide the path to a CSV file created by dump_data() to replay it, or no value for synthetic waveforms.", required=False)
 parser.add_argument('-v', '--verbose', help='Increases verbosity of program output.', action='store_true')
 parser.add_argument('-V', '--version', help='Displays the power monitor software version and exits.', action='store_true')
 
@@ -52,7 +71,21 @@ retention_policies = {
     },
     'autogen' : {      # This is the default retention policy.
         'duration' : '30d'
-    }
+    },
+    'rp_1min' : {      # rp_1min and rp_1hour are only created when their rollup intervals are enabled.
+        'duration' : '365d'
+    },
+    'rp_1hour' : {
+        'duration' : 'INF'
+    },
+}
+
+# The retention policy that each rollup interval is written to.
+rollup_retention_policies = {
+    '1s' : 'autogen',
+    '1m' : 'rp_1min',
+    '5m' : 'rp_5min',
+    '1h' : 'rp_1hour',
 }
 
 
@@ -60,7 +93,7 @@ retention_policies = {
 
 class RPiPowerMonitor:
     """ Class to take readings from the MCP3008 and calculate power """
-    def __init__(self, mode='main', config='rpi_power_monitor/config.toml', spi=None):
+    def __init__(self, mode='main', config='rpi_power_monitor/config.toml', spi=None, simulate=None):
         self.pid = os.getpid()
         self.imported_plugins = dict()
         
@@ -69,26 +102,58 @@ class RPiPowerMonitor:
             self.cleanup()
 
         self.load_config(config)
-        
-        if spi:
-            self.spi = spi
-        else:
-            self.spi = spidev.SpiDev()
-            self.spi.open(0, 0)
-            self.spi.max_speed_hz = 1750000
+
+        # SPI devices - one per board. <spi> may be a single SPI object (used for board 1), or a dictionary of SPI objects keyed by board number.
+        self.spi_devices = dict()
+        for board_num, board in self.boards.items():
+            if isinstance(spi, dict) and spi.get(board_num):
+                self.spi_devices[board_num] = spi[board_num]
+            elif spi and not isinstance(spi, dict) and board_num == 1:
+                self.spi_devices[board_num] = spi
+            elif simulate:
+                self.spi_devices[board_num] = SimulatedSpiDev(replay_file=None if simulate == 'synthetic' else simulate, board=board_num)
+            else:
+                self.spi_devices[board_num] = spidev.SpiDev()
+                self.spi_devices[board_num].open(board['bus'], board['device'])
+                self.spi_devices[board_num].max_speed_hz = 1750000
+        self.spi = self.spi_devices[min(self.spi_devices)]
+
+        self.build_frame_reader()
+        self.accumulator = StreamAccumulator(self.frame_layout, self.frame_reader.frame_size, self.shared_voltage, self.vectorized) if self.streaming else None
+        self.stream_sums = None         # Channel sums of the last streaming capture.
+        self.harmonic_analyzer = HarmonicAnalyzer(self.grid_frequency, self.max_harmonic, self.harmonics_interval, self.harmonics_budget, self.vectorized) if self.harmonics_enabled else None
+        self.rollups = Rollups(self.rollup_intervals, self.energy_max_gap) if self.rollups_enabled else None
+        self.rollup_points = {rp_name : LineProtocolBuffer(self.name) for rp_name in rollup_retention_policies.values()}     # Rollup points waiting to be written, keyed by retention policy.
+        self.decimator = Decimator(self.decimation_interval) if self.decimation_enabled else None
+        self.energy = EnergyCounters(self.energy_file, self.energy_checkpoint_interval, self.energy_max_gap) if self.energy_enabled else None
+        self.acquisition = None
+        self.board_voltage = {board_num : BoardVoltageTracker(partial(self.get_board_voltage, board_num), interval=self.board_voltage_interval, tolerance=self.board_voltage_tolerance) for board_num in self.boards.keys()}
+        self.voltage_midpoint = 512     # Running estimate of the AC voltage wave's DC offset, used to detect zero crossings.
+        self.carried_frames = None      # Frames read past the end of the previous cycle-synchronized capture.
+        self.frame_period = None        # Seconds per frame, as measured by the last cycle-synchronized capture.
+        self.timing_stats = TimingStats(self.timing_window) if self.timing_diagnostics else None
+        self.capture_timing = None      # CaptureTiming of the last capture, when timing diagnostics are enabled.
         
         # Get DB Client
         self.get_db_client()
-        if not self.client:
+        if not self.storage:
             logger.error(f"Failed to connect to InfluxDB server at {self.config['database']['host']}:{self.config['database']['port']}. Please make sure it's reachable and try again.")
             self.cleanup(-1)
         
         # Other Initializations
-        # Validate continuous queries and retention policies
-        self.validate_rps()
-        self.validate_cqs()        
-        self.points_buffer = [] # A buffer to hold sublists of points so that they can be written altogether (reduces DB overhead)
-        self.def_cal = 0.88     # This is the default calibration factor for all CTs from my shop.
+        # Validate continuous queries and retention policies (unless the backend's schema is managed outside of the power monitor)
+        if self.storage.manages_schema:
+            self.validate_rps()
+            if self.continuous_queries:
+                self.validate_cqs()
+        self.points_buffer = LineProtocolBuffer(self.name) # A buffer to hold points so that they can be written altogether (reduces DB overhead)
+        self.batch_policy = AdaptiveBatchPolicy(self.batch_size, self.max_batch_size, self.max_batch_bytes, self.max_batch_age, self.target_write_latency)
+        if self.background_writer:
+            spool = Spool(self.spool_path, self.spool_max_bytes) if self.spool_enabled else None
+            self.writer = InfluxWriter(self.storage, self.write_queue_size, self.write_queue_policy, spool=spool, retry_interval=self.spool_retry_interval, replay_rate=self.spool_replay_rate,
+                                       replay_bytes=self.spool_replay_bytes, batch_policy=self.batch_policy)
+        else:
+            self.writer = None
         self.terminal_mode = False
         self.PF_DELTA = 20      # This value enforces a minimum amperage waveform quality in order to calculate PF. 
                                 # If the measured waveform peak-trough delta is less than this value, PF will not be calculated and will be set to zero.
@@ -98,6 +163,53 @@ class RPiPowerMonitor:
             self.load_plugins(self.config.get('plugins'))   # Note: Plugins are initialized here, but they are only started when the power monitor routine starts.
 
     
+    def build_frame_reader(self):
+        """ Builds the frame reader for the enabled channels, and records where each channel's current and voltage readings sit in a frame.
+
+        Each board with enabled channels gets its own scan. When more than one board is in use, the boards' frames are combined by a FrameReaderGroup.
+        """
+        readers = []
+        self.frame_layout = dict()     # PCB channel # : (CT reading index, voltage reading index, voltage interpolation weight)
+        self.voltage_skew = dict()      # PCB channel # : delay of the voltage reading after the CT reading, as a fraction of a frame
+        offset = 0
+        for board_num in self.boards.keys():
+            channels = [pcb_chan for pcb_chan in self.enabled_channels if self.channel_map[pcb_chan][0] == board_num]
+            if not channels:
+                continue
+            if self.shared_voltage:
+                # Each frame is one voltage reading followed by a reading of every enabled CT on the board. The voltage for each CT is
+                # interpolated between this frame's voltage reading and the next frame's.
+                scan = [5] + [self.channel_map[pcb_chan][1] for pcb_chan in channels]
+                for position, pcb_chan in enumerate(channels, start=1):
+                    self.frame_layout[pcb_chan] = (offset + position, offset, position)
+            else:
+                # Each frame is a CT reading followed by a voltage reading, for every enabled CT on the board.
+                scan = []
+                for i, pcb_chan in enumerate(channels):
+                    scan += [self.channel_map[pcb_chan][1], 5]
+                    self.frame_layout[pcb_chan] = (offset + 2 * i, offset + 2 * i + 1, None)
+            readers.append(FrameReader(self.spi_devices[board_num], scan, batched=self.batched_reads))
+            offset += len(scan)
+
+        if len(readers) == 1:
+            self.frame_reader = readers[0]
+        else:
+            self.frame_reader = FrameReaderGroup(readers, interleave_frames=self.board_interleave_frames)
+
+        if self.shared_voltage:
+            # A board's next voltage reading comes one (combined) frame after this one, so the weight is the CT's position within the frame.
+            for pcb_chan, (ct_index, v_index, position) in self.frame_layout.items():
+                self.frame_layout[pcb_chan] = (ct_index, v_index, position / self.frame_reader.frame_size)
+
+        for pcb_chan, (ct_index, v_index, weight) in self.frame_layout.items():
+            # The interpolated voltage lines up with its CT reading. Otherwise, the voltage reading is taken one conversion after the CT reading.
+            self.voltage_skew[pcb_chan] = 0 if self.shared_voltage else (v_index - ct_index) / self.frame_reader.frame_size
+
+        # In shared voltage mode, one extra frame is read after each capture to provide the voltage readings that close the final frame.
+        self.trailing_frames = 1 if self.shared_voltage else 0
+        # Index of the voltage reading in each frame that's used to detect zero crossings.
+        self.voltage_slot = self.frame_layout[self.enabled_channels[0]][1]
+
     def validate_cqs(self):
         '''Ensures that the continuous queries exist in the configured Influx database, and creates them if not.'''
 
@@ -107,7 +219,7 @@ class RPiPowerMonitor:
 
         try:
             db_name = self.config['database']['database_name']
-            cqs = self.client.get_list_continuous_queries()
+            cqs = self.storage.get_list_continuous_queries()
             existing_cqs = []
             for db in cqs:
                 if db_name in db.keys():
@@ -117,47 +229,47 @@ class RPiPowerMonitor:
             # Home Power, Energy
             if 'cq_home_power_5m' not in existing_cqs:
                 for duration, rp_name in retention_policies.items():
-                    self.client.create_continuous_query(f'cq_home_power_{duration}', f'SELECT mean("power") AS "power", mean("current") AS "current" INTO "{rp_name}"."home_load_{duration}" FROM "home_load" GROUP BY time({duration})')
+                    self.storage.create_continuous_query(f'cq_home_power_{duration}', f'SELECT mean("power") AS "power", mean("current") AS "current" INTO "{rp_name}"."home_load_{duration}" FROM "home_load" GROUP BY time({duration})')
                     logger.debug(f"Created continuous query: cq_home_power_{duration}")
             
             if 'cq_home_energy_5m' not in existing_cqs:
                 for duration, rp_name in retention_policies.items():
-                    self.client.create_continuous_query(f'cq_home_energy_{duration}', f'''SELECT integral("power") / 3600000 AS "energy" INTO "{rp_name}"."home_energy_{duration}" FROM "home_load" GROUP BY time({duration})''')
+                    self.storage.create_continuous_query(f'cq_home_energy_{duration}', f'''SELECT integral("power") / 3600000 AS "energy" INTO "{rp_name}"."home_energy_{duration}" FROM "home_load" GROUP BY time({duration})''')
                     logger.debug(f"Created continuous query: cq_home_energy_{duration}")
 
             # Net Power, Energy
             if 'cq_net_power_5m' not in existing_cqs:
                 for duration, rp_name in retention_policies.items():
-                    self.client.create_continuous_query(f'cq_net_power_{duration}', f'SELECT mean("power") AS "power", mean("current") AS "current" INTO "{rp_name}"."net_power_{duration}" FROM "net" GROUP BY time({duration})')
+                    self.storage.create_continuous_query(f'cq_net_power_{duration}', f'SELECT mean("power") AS "power", mean("current") AS "current" INTO "{rp_name}"."net_power_{duration}" FROM "net" GROUP BY time({duration})')
                     logger.debug(f"Created continuous query: cq_net_power_{duration}")
 
             if 'cq_net_energy_5m' not in existing_cqs:
                 for duration, rp_name in retention_policies.items():
-                    self.client.create_continuous_query(f'cq_net_energy_{duration}', f'''SELECT integral("power") / 3600000 AS "energy" INTO "{rp_name}"."net_energy_{duration}" FROM "net" GROUP BY time({duration})''')
+                    self.storage.create_continuous_query(f'cq_net_energy_{duration}', f'''SELECT integral("power") / 3600000 AS "energy" INTO "{rp_name}"."net_energy_{duration}" FROM "net" GROUP BY time({duration})''')
                     logger.debug(f"Created continuous query: cq_net_energy_{duration}")
 
             # Solar Power, Energy
             if 'cq_solar_power_5m' not in existing_cqs:
                 for duration, rp_name in retention_policies.items():
-                    self.client.create_continuous_query(f'cq_solar_power_{duration}', f'SELECT mean("power") AS "power", mean("current") AS "current" INTO "{rp_name}"."solar_power_{duration}" FROM "solar" GROUP BY time({duration})')
+                    self.storage.create_continuous_query(f'cq_solar_power_{duration}', f'SELECT mean("power") AS "power", mean("current") AS "current" INTO "{rp_name}"."solar_power_{duration}" FROM "solar" GROUP BY time({duration})')
                     logger.debug(f"Created continuous query: cq_solar_power_{duration}")
             
             if 'cq_solar_energy_5m' not in existing_cqs:
                 for duration, rp_name in retention_policies.items():
-                    self.client.create_continuous_query(f'cq_solar_energy_{duration}', f'''SELECT integral("power") / 3600000 AS "energy" INTO "{rp_name}"."solar_energy_{duration}" FROM "solar" GROUP BY time({duration})''')
+                    self.storage.create_continuous_query(f'cq_solar_energy_{duration}', f'''SELECT integral("power") / 3600000 AS "energy" INTO "{rp_name}"."solar_energy_{duration}" FROM "solar" GROUP BY time({duration})''')
                     logger.debug(f"Created continuous query: cq_solar_energy_{duration}")
 
              # Individual CT Energies
-            for chan in range(1, 7):
+            for chan in range(1, self.num_channels + 1):
                 if f'cq_ct{chan}_power_5m' not in existing_cqs:
                     for duration, rp_name in retention_policies.items():
-                        self.client.create_continuous_query(f'cq_ct{chan}_power_{duration}', f'''SELECT mean("power") AS "power", mean("current") AS "current" INTO "{rp_name}"."ct{chan}_power_{duration}" FROM "raw_cts" WHERE "ct" = '{chan}' GROUP BY time({duration})''')
+                        self.storage.create_continuous_query(f'cq_ct{chan}_power_{duration}', f'''SELECT mean("power") AS "power", mean("current") AS "current" INTO "{rp_name}"."ct{chan}_power_{duration}" FROM "raw_cts" WHERE "ct" = '{chan}' GROUP BY time({duration})''')
                         logger.debug(f"Created continuous query: cq_ct{chan}_power_{duration}")
 
                 # Individual CT Power, Energy
                 if f'cq_ct{chan}_energy_5m' not in existing_cqs:
                     for duration, rp_name in retention_policies.items():
-                        self.client.create_continuous_query(f'cq_ct{chan}_energy_{duration}', f'''SELECT integral("power") / 3600000 AS "energy" INTO "{rp_name}"."ct{chan}_energy_{duration}" FROM "raw_cts" WHERE "ct" = '{chan}' GROUP BY time({duration})''')
+                        self.storage.create_continuous_query(f'cq_ct{chan}_energy_{duration}', f'''SELECT integral("power") / 3600000 AS "energy" INTO "{rp_name}"."ct{chan}_energy_{duration}" FROM "raw_cts" WHERE "ct" = '{chan}' GROUP BY time({duration})''')
                         logger.debug(f"Created continuous query: cq_ct{chan}_energy_{duration}")
 
         except Exception as e:
@@ -166,20 +278,26 @@ class RPiPowerMonitor:
         return
 
     def validate_rps(self):
-        '''Ensures that the retention policies exist in the configured Influx database, and creates them if not.'''
+        '''Ensures that the retention policies in use exist in the configured Influx database, and creates them if not.
+
+        The rollup retention policies (rp_1min, rp_1hour) are only created for the rollup intervals that are enabled.
+        '''
+        rps = ['autogen', 'rp_5min']
+        if self.rollups_enabled:
+            rps += [rollup_retention_policies[label] for label in self.rollup_intervals]
 
         # Validate retention policies and continuous queries.
         try:
-            existing_rps = self.client.get_list_retention_policies()
+            existing_rps = self.storage.get_list_retention_policies()
             rp_names = [rp['name'] for rp in existing_rps]
         except Exception as e:
             logger.warning(f"Failed to retrieve InfluxDB Retention Policies. Is Influx running?")
             self.cleanup(-1)
         
         try:
-            for rp in retention_policies.keys():
+            for rp in dict.fromkeys(rps):
                 if rp not in rp_names:
-                    self.client.create_retention_policy(rp, retention_policies[rp]['duration'], 1, default = (True if rp == 'autogen' else False))
+                    self.storage.create_retention_policy(rp, retention_policies[rp]['duration'], 1, default = (True if rp == 'autogen' else False))
                     logger.debug(f"Created retention policy {rp}")
         except Exception as e:
             logger.warning("Failed to create one or more retention policies!")
@@ -209,6 +327,7 @@ class RPiPowerMonitor:
         self.ac_transformer_output_voltage = config.get('grid_voltage').get('ac_transformer_output_voltage')
         self.voltage_calibration = config.get('grid_voltage').get('voltage_calibration')
         self.name = config['general'].get('name')
+        self.grid_frequency = config.get('grid_voltage').get('frequency', 60)
 
         # Enabled Channels
         self.enabled_channels = [int(channel.split('_')[-1]) for channel, settings in config['current_transformers'].items() if settings['enabled'] ]
@@ -218,16 +337,95 @@ class RPiPowerMonitor:
         else:
             logger.debug(f"Sampling enabled for {len(self.enabled_channels)} channels.")
         
-        ADC_CHANNELS = {
-            1 : 0,  # PCB channel # : ADC channel #
-            2 : 1,
-            3 : 2,
-            4 : 3,
-            5 : 6,
-            6 : 7
-            }
-
-        self.enabled_adc_ct_channels = {pcb_chan : adc_chan for pcb_chan, adc_chan in ADC_CHANNELS.items() if pcb_chan in self.enabled_channels}
+        # Boards (optional section). Each board is an MCP3008 on its own SPI bus/chip-select pair. If no boards are configured, a single board on bus 0, device 0 is used.
+        # Channels 1-6 are the inputs of board 1, channels 7-12 are the inputs of board 2, and so on.
+        boards = config.get('boards', {'board_1' : {}})
+        self.boards = dict()
+        for board_name, settings in boards.items():
+            try:
+                self.boards[int(board_name.split('_')[-1])] = {'bus' : int(settings.get('bus', 0)), 'device' : int(settings.get('device', 0))}
+            except ValueError:
+                logger.critical(f"Invalid config file setting: boards must be named board_1, board_2, etc., and the bus and device settings must be numbers. Please check the {board_name} settings.")
+                self.cleanup(-1)
+        self.boards = dict(sorted(self.boards.items()))
+        self.num_channels = len(ADC_CHANNELS) * max(self.boards.keys())
+        
+        self.channel_map = dict()   # PCB channel # : (board #, ADC channel #)
+        for pcb_chan in range(1, self.num_channels + 1):
+            board_num = (pcb_chan - 1) // len(ADC_CHANNELS) + 1
+            if board_num in self.boards:
+                self.channel_map[pcb_chan] = (board_num, ADC_CHANNELS[(pcb_chan - 1) % len(ADC_CHANNELS) + 1])
+        for chan_num in self.enabled_channels:
+            if chan_num not in self.channel_map:
+                logger.critical(f"Channel_{chan_num} is enabled, but board_{(chan_num - 1) // len(ADC_CHANNELS) + 1} is not configured in the boards section of config.toml.")
+                self.cleanup(-1)
+        if len(self.boards) > 1:
+            logger.debug(f"Configured {len(self.boards)} boards: {self.boards}")
+
+        # Sampling settings (optional section)
+        sampling = config.get('sampling', {})
+        self.batched_reads = sampling.get('batched_reads', False)
+        if self.batched_reads:
+            logger.debug("Batched SPI reads enabled.")
+        self.background_acquisition = sampling.get('background_acquisition', False)
+        if self.background_acquisition:
+            logger.debug("Background acquisition enabled.")
+        self.shared_voltage = sampling.get('shared_voltage', False)
+        if self.shared_voltage:
+            logger.debug("Shared voltage sampling enabled.")
+        try:
+            self.line_cycles = int(sampling.get('line_cycles', 0))
+            if self.line_cycles < 0:
+                raise ValueError
+        except ValueError:
+            logger.critical("The value of the line_cycles sampling setting must be a whole number (0 disables cycle-synchronized sampling). Please correct this in your config.toml file and relaunch the software.")
+            self.cleanup(-1)
+        if self.line_cycles:
+            logger.debug(f"Cycle-synchronized sampling enabled ({self.line_cycles} line cycles per capture).")
+        # When several boards are in use, they take turns reading board_interleave_frames frames each.
+        try:
+            self.board_interleave_frames = int(sampling.get('board_interleave_frames', 1))
+        except ValueError:
+            logger.critical("The value of the board_interleave_frames sampling setting must be a whole number. Please correct this in your config.toml file and relaunch the software.")
+            self.cleanup(-1)
+        if self.shared_voltage and self.board_interleave_frames > 1:
+            # Shared voltage interpolation assumes that each board's frames are evenly spaced in time. When the boards take turns several
+            # frames at a time, there's a gap after each board's run of frames, which the interpolation weights and timing don't account for.
+            logger.critical("board_interleave_frames can't be greater than 1 when shared_voltage is enabled. Please correct this in your config.toml file and relaunch the software.")
+            self.cleanup(-1)
+        # Real-time mode pins the sampling process to realtime_cpu, gives it SCHED_FIFO priority, locks its memory, and pauses garbage collection during captures.
+        self.realtime = sampling.get('realtime', False)
+        try:
+            self.realtime_cpu = sampling.get('realtime_cpu')
+            if self.realtime_cpu is not None:
+                self.realtime_cpu = int(self.realtime_cpu)
+            self.realtime_priority = int(sampling.get('realtime_priority', 50))
+            if not 1 <= self.realtime_priority <= 99:
+                raise ValueError
+        except ValueError:
+            logger.critical("The realtime_cpu sampling setting must be a CPU number, and realtime_priority must be a whole number between 1 and 99. Please correct this in your config.toml file and relaunch the software.")
+            self.cleanup(-1)
+        if self.realtime:
+            logger.debug("Real-time sampling enabled.")
+        # The power calculations use NumPy when it's installed, unless vectorized is set to false.
+        self.vectorized = sampling.get('vectorized', True)
+        # Timing diagnostics record a timestamp per block of frames, and report a histogram of the intervals between samples over the last timing_window captures.
+        self.timing_diagnostics = sampling.get('timing_diagnostics', False)
+        try:
+            self.timing_window = int(sampling.get('timing_window', 60))
+            self.timing_gap_factor = float(sampling.get('timing_gap_factor', 1.5))
+        except ValueError:
+            logger.critical("The timing_window and timing_gap_factor sampling settings must be numbers. Please correct this in your config.toml file and relaunch the software.")
+            self.cleanup(-1)
+        if self.timing_diagnostics:
+            logger.debug("Acquisition timing diagnostics enabled.")
+        # The board voltage is re-measured every board_voltage_interval seconds, and a warning is logged if it drifts more than board_voltage_tolerance (%) from 3.3V.
+        try:
+            self.board_voltage_interval = float(sampling.get('board_voltage_interval', 60))
+            self.board_voltage_tolerance = float(sampling.get('board_voltage_tolerance', 5)) / 100
+        except ValueError:
+            logger.critical("The board_voltage_interval and board_voltage_tolerance sampling settings must be numbers. Please correct this in your config.toml file and relaunch the software.")
+            self.cleanup(-1)
 
         # CT Type Check
         for ct_channel, settings in config['current_transformers'].items():
@@ -255,6 +453,206 @@ class RPiPowerMonitor:
         self.consumption_channels = [int(channel.split('_')[-1]) for channel, settings in config['current_transformers'].items() if settings['type'] == 'consumption' and settings['enabled'] == True]
         logger.debug(f"Identified {len(self.consumption_channels)} consumption channels: ({self.consumption_channels})")
 
+        # Phase correction validation
+        # phase_shift is optional, and is the number of degrees to delay the channel's voltage wave relative to its current wave.
+        # Phase correction is enabled when any enabled channel has the setting.
+        self.phase_shifts = dict()
+        for channel, settings in config['current_transformers'].items():
+            if 'phase_shift' not in settings.keys():
+                continue
+            try:
+                phase_shift = float(settings['phase_shift'])
+            except ValueError:
+                logger.critical(f"The value of {channel.capitalize()}'s phase_shift must be a number. Please correct this in your config.toml file and relaunch the software.")
+                self.cleanup(-1)
+            if abs(phase_shift) > 90:
+                logger.critical(f"The value of {channel.capitalize()}'s phase_shift must be between -90 and 90 degrees. Please correct this in your config.toml file and relaunch the software.")
+                self.cleanup(-1)
+            chan_num = int(channel.split('_')[-1])
+            if chan_num in self.enabled_channels:
+                self.phase_shifts[chan_num] = phase_shift
+        if self.phase_shifts:
+            self.phase_shifts = {chan_num : self.phase_shifts.get(chan_num, 0) for chan_num in self.enabled_channels}
+            logger.debug(f"Phase correction enabled. Phase shifts (degrees): {self.phase_shifts}")
+
+        # Harmonic analysis (optional section). THD and the harmonic spectrum of each waveform are computed at most every <interval> seconds,
+        # using no more than <budget> percent of the main loop's time.
+        harmonics = config.get('harmonics', {})
+        self.harmonics_enabled = harmonics.get('enabled', False)
+        try:
+            self.max_harmonic = int(harmonics.get('max_harmonic', 15))
+            self.harmonics_interval = float(harmonics.get('interval', 10))
+            self.harmonics_budget = float(harmonics.get('budget', 5)) / 100
+            if self.max_harmonic < 2 or self.harmonics_budget <= 0:
+                raise ValueError
+        except ValueError:
+            logger.critical("Invalid harmonics settings: max_harmonic must be a whole number of at least 2, and interval and budget must be positive numbers. Please correct this in your config.toml file and relaunch the software.")
+            self.cleanup(-1)
+        if self.harmonics_enabled:
+            logger.debug(f"Harmonic analysis enabled, up to the {self.max_harmonic}th harmonic.")
+
+        # Energy counters (optional section). The real power of every capture is integrated into import and export watt-hour counters,
+        # which are saved to <checkpoint_file> every <checkpoint_interval> seconds so that they survive restarts.
+        energy = config.get('energy', {})
+        self.energy_enabled = energy.get('enabled', False)
+        self.energy_file = energy.get('checkpoint_file', os.path.join(module_root, 'energy.json'))
+        try:
+            self.energy_checkpoint_interval = float(energy.get('checkpoint_interval', 60))
+            self.energy_max_gap = float(energy.get('max_gap', 300))
+            if self.energy_checkpoint_interval <= 0 or self.energy_max_gap <= 0:
+                raise ValueError
+        except ValueError:
+            logger.critical("Invalid energy settings: checkpoint_interval and max_gap must be positive numbers of seconds. Please correct this in your config.toml file and relaunch the software.")
+            self.cleanup(-1)
+        if self.energy_enabled:
+            logger.debug(f"Energy counters enabled, saved to {self.energy_file}.")
+
+        # Averaging (optional section). The calculated figures are smoothed over the last <window> polling cycles with a simple moving average,
+        # an exponentially weighted moving average, or a rolling median.
+        averaging = config.get('averaging', {})
+        self.averaging_method = averaging.get('method', 'sma')
+        try:
+            self.averaging_window = int(averaging.get('window', 2))
+            self.averaging_alpha = float(averaging['alpha']) if averaging.get('alpha') is not None else None
+            if self.averaging_window < 1 or (self.averaging_alpha is not None and not 0 < self.averaging_alpha <= 1):
+                raise ValueError
+        except ValueError:
+            logger.critical("Invalid averaging settings: window must be a whole number greater than 0, and alpha must be a number greater than 0 and no more than 1. Please correct this in your config.toml file and relaunch the software.")
+            self.cleanup(-1)
+        if self.averaging_method not in AVERAGING_METHODS:
+            logger.critical(f"The averaging method must be one of: {', '.join(AVERAGING_METHODS)}. Please correct this in your config.toml file and relaunch the software.")
+            self.cleanup(-1)
+        logger.debug(f"Averaging figures with {self.averaging_method} over {self.averaging_window} polling cycles.")
+
+        # Rollups (optional section). The mean, min, and max of each figure, and the energy, are computed on the device for each interval and
+        # written to the interval's retention policy. The continuous queries that compute the 5 minute figures in InfluxDB are only created
+        # when rollups are disabled, unless continuous_queries is set.
+        rollups = config.get('rollups', {})
+        self.rollups_enabled = rollups.get('enabled', False)
+        self.rollup_intervals = rollups.get('intervals', list(rollup_retention_policies.keys()))
+        self.continuous_queries = rollups.get('continuous_queries', not self.rollups_enabled)
+        invalid = [label for label in self.rollup_intervals if label not in rollup_retention_policies]
+        if invalid:
+            logger.critical(f"Invalid rollup intervals: {', '.join(invalid)}. The supported intervals are: {', '.join(rollup_retention_policies.keys())}. Please correct this in your config.toml file and relaunch the software.")
+            self.cleanup(-1)
+        if self.rollups_enabled:
+            logger.debug(f"Rollups enabled for intervals: {', '.join(self.rollup_intervals)}.")
+
+        # Decimation (optional section). Instead of writing every third averaged value, the figures of every capture are reduced to their
+        # mean, min, and max (and optionally the last value) over each <interval> seconds, and one point per figure is written per interval.
+        decimation = config.get('decimation', {})
+        self.decimation_enabled = decimation.get('enabled', False)
+        self.decimation_last = decimation.get('include_last', False)
+        try:
+            self.decimation_interval = float(decimation.get('interval', 10))
+            if self.decimation_interval <= 0:
+                raise ValueError
+        except ValueError:
+            logger.critical("Invalid decimation settings: interval must be a positive number of seconds. Please correct this in your config.toml file and relaunch the software.")
+            self.cleanup(-1)
+        if self.decimation_enabled:
+            logger.debug(f"Decimation enabled, writing the mean, min, and max of each figure every {self.decimation_interval} seconds.")
+
+        # Background writer. Batches of points are written to Influx from a separate thread, so that a slow or failing write can't stall
+        # sampling. At most <write_queue_size> batches are queued, and <write_queue_policy> decides what happens when the queue is full.
+        database = config.get('database', {})
+
+        # Batching. A batch of points is written when it reaches batch_size points, max_batch_kb, or max_batch_age seconds. If max_batch_size is
+        # larger than batch_size, the point limit grows while writes take less than target_write_latency seconds, and shrinks when they take longer.
+        try:
+            self.batch_size = int(database.get('batch_size', 25))
+            self.max_batch_size = int(database.get('max_batch_size', self.batch_size))
+            self.max_batch_bytes = int(float(database.get('max_batch_kb', 256)) * 1024)
+            self.max_batch_age = float(database.get('max_batch_age', 10))
+            self.target_write_latency = float(database.get('target_write_latency', 0.5))
+            if self.batch_size < 1 or self.max_batch_size < self.batch_size or min(self.max_batch_bytes, self.max_batch_age, self.target_write_latency) <= 0:
+                raise ValueError
+        except ValueError:
+            logger.critical("Invalid database batching settings: batch_size must be a whole number greater than 0, max_batch_size must be a whole number no less than batch_size, and max_batch_kb, max_batch_age, and target_write_latency must be positive numbers. Please correct this in your config.toml file and relaunch the software.")
+            self.cleanup(-1)
+        self.compress_writes = database.get('gzip', False)
+
+        # Storage backend. 'influxdb' writes with the influxdb client package. 'http' writes line protocol over persistent HTTP connections,
+        # to InfluxDB 1.x's /write endpoint (api = "v1"), or to /api/v2/write (api = "v2", for InfluxDB 2.x, with token, org, and the bucket
+        # in database_name). ssl = true uses HTTPS, and pool_size is the number of idle connections that are kept open. 'local' stores the
+        # points on the Pi instead (see the local_store section below).
+        self.storage_backend = database.get('backend', 'influxdb')
+        if self.storage_backend not in STORAGE_BACKENDS:
+            logger.critical(f"The backend database setting must be one of: {', '.join(STORAGE_BACKENDS)}. Please correct this in your config.toml file and relaunch the software.")
+            self.cleanup(-1)
+        if database.get('api', 'v1') not in ('v1', 'v2'):
+            logger.critical("The api database setting must be v1 or v2. Please correct this in your config.toml file and relaunch the software.")
+            self.cleanup(-1)
+
+        self.background_writer = database.get('background_writer', True)
+        self.write_queue_policy = database.get('write_queue_policy', 'drop_oldest')
+        try:
+            self.write_queue_size = int(database.get('write_queue_size', 20))
+            if self.write_queue_size < 1:
+                raise ValueError
+        except ValueError:
+            logger.critical("The value of the write_queue_size database setting must be a whole number greater than 0. Please correct this in your config.toml file and relaunch the software.")
+            self.cleanup(-1)
+        if self.write_queue_policy not in WRITE_QUEUE_POLICIES:
+            logger.critical(f"The write_queue_policy database setting must be one of: {', '.join(WRITE_QUEUE_POLICIES)}. Please correct this in your config.toml file and relaunch the software.")
+            self.cleanup(-1)
+
+        # Spool (optional section). While Influx is unreachable, the background writer stores batches in a SQLite database at <path> (up to
+        # <max_size_mb>), retries every <retry_interval> seconds, and replays the backlog at <replay_rate> batches per second once it's back.
+        spool = config.get('spool', {})
+        self.spool_enabled = spool.get('enabled', False)
+        self.spool_path = spool.get('path', os.path.join(module_root, 'spool.db'))
+        try:
+            self.spool_max_bytes = int(float(spool.get('max_size_mb', 100)) * 1048576)
+            self.spool_retry_interval = float(spool.get('retry_interval', 30))
+            self.spool_replay_rate = float(spool.get('replay_rate', 2))
+            self.spool_replay_bytes = int(float(spool.get('replay_batch_kb', 512)) * 1024)
+            if min(self.spool_max_bytes, self.spool_retry_interval, self.spool_replay_rate, self.spool_replay_bytes) <= 0:
+                raise ValueError
+        except ValueError:
+            logger.critical("Invalid spool settings: max_size_mb, retry_interval, replay_rate, and replay_batch_kb must be positive numbers. Please correct this in your config.toml file and relaunch the software.")
+            self.cleanup(-1)
+        # Local store (optional section, used with backend = "local"). Points are stored in SQLite files under <path>: one per day for the raw
+        # points, which are kept for raw_retention_days and downsampled to the mean, min, and max per downsample_interval, which are kept for
+        # downsampled_retention_days. The rollup retention policies are kept as long as their InfluxDB counterparts. 0 days keeps points forever.
+        local_store = config.get('local_store', {})
+        self.local_store_path = local_store.get('path', os.path.join(module_root, 'data'))
+        try:
+            downsample_interval = local_store.get('downsample_interval', '1m')
+            self.downsample_interval = parse_interval(downsample_interval) if downsample_interval else 0
+            if 86400 % max(self.downsample_interval, 1):
+                raise ValueError
+            self.local_store_retention = {rp : int(settings['duration'][:-1]) for rp, settings in retention_policies.items() if settings['duration'] != 'INF'}
+            self.local_store_retention['autogen'] = float(local_store.get('raw_retention_days', 30))
+            self.local_store_retention['downsampled'] = float(local_store.get('downsampled_retention_days', 365))
+            if min(self.local_store_retention.values()) < 0:
+                raise ValueError
+        except ValueError:
+            logger.critical("Invalid local_store settings: downsample_interval must be an interval like \"1m\" that divides a day evenly (or \"\" to disable downsampling), and raw_retention_days and downsampled_retention_days must be numbers no less than 0. Please correct this in your config.toml file and relaunch the software.")
+            self.cleanup(-1)
+
+        if self.spool_enabled and not self.background_writer:
+            logger.warning("The spool needs the background writer, so it has been disabled. Remove background_writer = false from the database section to use it.")
+            self.spool_enabled = False
+        if self.spool_enabled:
+            logger.debug(f"Spooling to {self.spool_path} while Influx is unreachable (up to {round(self.spool_max_bytes / 1048576)} MB).")
+
+        # Streaming mode accumulates each channel's sums as blocks of frames are read, instead of keeping every sample of the capture, so the
+        # integration window (stream_frames) can be as long as needed. Phase correction, cycle-synchronized captures, and harmonic analysis need the raw samples.
+        self.streaming = sampling.get('streaming', False)
+        try:
+            self.stream_frames = int(sampling.get('stream_frames', 500))
+            if self.stream_frames < 1:
+                raise ValueError
+        except ValueError:
+            logger.critical("The value of the stream_frames sampling setting must be a whole number greater than 0. Please correct this in your config.toml file and relaunch the software.")
+            self.cleanup(-1)
+        if self.streaming and (self.phase_shifts or self.line_cycles or self.harmonics_enabled):
+            logger.warning("Streaming mode can't be combined with phase correction, cycle-synchronized sampling, or harmonic analysis, so it has been disabled.")
+            self.streaming = False
+        if self.streaming:
+            logger.debug(f"Streaming mode enabled ({self.stream_frames} frames per integration window).")
+
         # Two-pole validation
         for channel, settings in config['current_transformers'].items():
             if 'two_pole' not in settings.keys():
@@ -286,12 +684,29 @@ class RPiPowerMonitor:
             except ValueError:
                 logger.critical(f"The value of {channel.capitalize()}'s watts_cutoff_threshold must be a number. Please correct this in your config.toml file and relaunch the software.")
                 self.cleanup(-1)
-            
-            
-            
+
+        # Compile the settings that the power calculations use on every capture.
+        self.def_cal = 0.88     # This is the default calibration factor for all CTs from my shop.
+        self.voltage_scale = (self.grid_voltage / self.ac_transformer_output_voltage) * 11 * self.voltage_calibration  # Rough approximation of the AC transformer ratio
+        self.channel_plans = dict()
+        for chan_num in self.enabled_channels:
+            board_num, adc_channel = self.channel_map[chan_num]
+            self.channel_plans[chan_num] = ChannelPlan.from_config(chan_num, config['current_transformers'][f'channel_{chan_num}'], board_num, adc_channel, self.def_cal, self.phase_shifts.get(chan_num, 0))
+
 
     def get_db_client(self):
-        '''Creates an InfluxDB Client using the loaded configuration.'''
+        '''Creates the storage backend using the loaded configuration, and checks that the database is reachable.'''
+
+        if self.storage_backend == 'local':
+            logger.debug(f"Storing points in the local store at {self.local_store_path}...")
+            try:
+                self.storage = LocalStore(self.local_store_path, self.local_store_retention, self.downsample_interval)
+                self.storage.connect()
+            except Exception as e:
+                logger.critical(f"Failed to open the local store at {self.local_store_path}. Reason: {e}")
+                self.storage = None
+                self.cleanup(-1)
+            return
 
         host = self.config['database']['host']
         port = self.config['database']['port']
@@ -316,24 +731,16 @@ class RPiPowerMonitor:
             self.cleanup(-1)
 
         try:
-            client = InfluxDBClient(
-                host=host,
-                port=port,
-                username=self.config['database']['username'],
-                password=self.config['database']['password'],
-                database=self.config['database']['database_name'],
-                timeout=7,
-                retries=2)
-            self.client = client
-
+            self.storage = create_backend(self.config['database'], self.compress_writes)
         except Exception as e:
             logger.warning(f"Failed to connect to InfluxDB database at {host}:{port}")
-            self.client = None
+            logger.debug(f"Error message:\n{e}")
+            self.storage = None
             self.cleanup(-1)
 
         # Test Client
         try:
-            self.client.create_database(self.config['database']['database_name'])
+            self.storage.connect()
         except ConnectionRefusedError:
             logger.warning("DB connection refused - is Influx running?")
             self.cleanup(-1)
@@ -347,75 +754,265 @@ class RPiPowerMonitor:
         
 
     def dump_data(self, dump_type, samples):
-        """ Writes raw data to a CSV file titled 'data-dump-<current_time>.csv' """
+        """ Writes raw data to a CSV file titled 'data-dump-<current_time>.csv' 
+        
+        Arguments:
+        samples -- dict, the sample dictionary returned by collect_data(). A current and voltage column is written for each enabled channel.
+        """
         speed_kHz = self.spi.max_speed_hz / 1000
         now = datetime.now().strftime('%m-%d-%Y-%H-%M')
         filename = f'data-dump-{now}.csv'
+        columns = [f'ct{chan_num}' for chan_num in self.enabled_channels] + [f'v{chan_num}' for chan_num in self.enabled_channels]
         with open(filename, 'w') as f:
-            headers = ["Sample#", "ct1", "ct2", "ct3", "ct4", "ct5", "ct6", "voltage"]
+            headers = ["Sample#"] + columns
             writer = csv.writer(f)
             writer.writerow(headers)
-            # samples contains lists for each data sample.
-            for i in range(0, len(samples[0])):
-                ct1_data = samples[0]
-                ct2_data = samples[1]
-                ct3_data = samples[2]
-                ct4_data = samples[3]
-                ct5_data = samples[4]
-                ct6_data = samples[5]
-                v_data = samples[-1]
-                writer.writerow([i, ct1_data[i], ct2_data[i], ct3_data[i], ct4_data[i], ct5_data[i], ct6_data[i], v_data[i]])
+            # samples contains an array for each channel's current and voltage waves.
+            writer.writerows([i, *row] for i, row in enumerate(zip(*[samples[column] for column in columns])))
         logger.info(f"CSV written to {filename}.")
 
-    def get_board_voltage(self):
+    def get_board_voltage(self, board_num=1):
         """ Take 10 sample readings and return the average board voltage from the +3.3V rail. """
+        spi = self.spi_devices[board_num]
         samples = []
         while len(samples) <= 10:
-            data = self.read_adc(4) # channel 4 is the 3.3V ref voltage
+            data = self.read_adc(4, spi) # channel 4 is the 3.3V ref voltage
             samples.append(data)
 
         avg_reading = sum(samples) / len(samples)
         board_voltage = (avg_reading / 1024) * 3.31 * 2
         return board_voltage
 
-    def read_adc(self, adc_num):
+    def get_board_voltages(self):
+        """ Returns a dictionary of the tracked board voltage of each board, keyed by board number. """
+        return {board_num : tracker.get() for board_num, tracker in self.board_voltage.items()}
+
+    def read_adc(self, adc_num, spi=None):
         """ Read SPI data from the MCP3008, 8 channels in total. """
-        r = self.spi.xfer2([1, 8 + adc_num << 4, 0])
+        r = (spi or self.spi).xfer2([1, 8 + adc_num << 4, 0])
         data = ((r[1] & 3) << 8) + r[2]
         return data
 
     def collect_data(self, num_samples):
-        """  Takes <num_samples> readings from the ADC for each ADC channel and returns a dictionary containing the CT channel number as the key, and a list of that channel's sample data.
+        """  Takes <num_samples> readings from the ADC for each ADC channel and returns a dictionary containing the CT channel number as the key, and an array of that channel's sample data.
         
         Arguments:
         num_samples -- int, the number of samples to collect for each channel.
 
-        Returns a dictionary where the keys are ct1 - ct6, voltage, and time, and the value of each key is a list of that channel's samples (except for 'time', which is a UTC datetime)
+        Returns a dictionary where the keys are ct<n> and v<n> for each enabled channel, time, and duration, and the value of each ct/v key is an array of that channel's samples ('time' is a UTC datetime, and 'duration' is the capture time in seconds)
         """
         now = datetime.utcnow()  # Get time of reading
+        frames, duration = self.capture_frames(num_samples)
+        return self.split_frames(frames, now, duration)
 
-        samples = dict()
-        for pcb_chan in self.enabled_channels:
-            samples[f'ct{pcb_chan}'] = []
-            samples[f'v{pcb_chan}'] = []
+    def collect_sums(self, num_samples, continuous=False):
+        """ Streams <num_samples> frames through the accumulator, and returns a sample dictionary with the channel sums instead of the samples.
+
+        Returns a dictionary with the keys 'sums' (a dictionary of ChannelSums, keyed by channel), 'time', and 'duration'.
+        """
+        now = datetime.utcnow()
+        _, duration = self.capture_frames(num_samples, continuous, streaming=True)
+        return {'sums' : self.stream_sums, 'time' : now, 'duration' : duration}
+
+    def capture_frames(self, num_samples, continuous=False, streaming=False):
+        """ Reads a capture worth of frames from the ADC, either a fixed <num_samples> frames, or a whole number of line cycles if line_cycles is set.
+
+        Arguments:
+        num_samples -- int, the number of frames to capture (or, in cycle-synchronized mode, the capture length to fall back to if no zero crossings are found).
+        continuous -- bool, True if captures are taken back-to-back, which allows frames read past the end of one line cycle window to start the next window.
+        streaming -- bool, True to feed each block of frames to the accumulator as it's read. The frames aren't kept, and the channel sums are stored in stream_sums.
+
+        Returns a tuple of (frames, duration), where duration is the number of seconds of signal covered by the frames. 
+        In shared voltage mode, the frames include one trailing frame. When streaming, the returned frames are empty.
+        """
+        with gc_paused() if self.realtime else nullcontext():
+            if self.timing_stats is not None:
+                self.frame_reader.timing = start_timing()
+
+            if streaming:
+                frames, duration = self.stream_frames_to_sums(num_samples, continuous)
+            elif self.line_cycles:
+                frames, duration = self.read_cycles(self.line_cycles, num_samples, continuous)
+            else:
+                start = timeit.default_timer()
+                frames = self.frame_reader.read(num_samples + self.trailing_frames)
+                stop = timeit.default_timer()
+                duration = (stop - start) * num_samples / (num_samples + self.trailing_frames)
+
+        if self.timing_stats is not None:
+            self.capture_timing = summarize_timing(self.frame_reader.timing, self.timing_gap_factor)
+            self.frame_reader.timing = None
+        return frames, duration
+
+    def stream_frames_to_sums(self, num_samples, continuous=False):
+        """ Reads <num_samples> frames a block at a time, adding each block to the accumulator. See capture_frames(). """
+        reader = self.frame_reader
+        accumulator = self.accumulator
+        # In shared voltage mode, the accumulator holds back the last frame of each window to start the next one, unless there's a gap between captures.
+        accumulator.reset(keep_pending=continuous)
+        remaining = num_samples
+        if accumulator.pending is None:
+            remaining += self.trailing_frames
 
         start = timeit.default_timer()
-        for _ in range(num_samples):
-            for pcb_chan, adc_chan in self.enabled_adc_ct_channels.items():
-                samples[f'ct{pcb_chan}'].append(self.read_adc(adc_chan))
-                samples[f'v{pcb_chan}'].append(self.read_adc(5))
+        while remaining > 0:
+            frames = min(remaining, reader.frames_per_block)
+            accumulator.add(reader.read(frames))
+            remaining -= frames
         stop = timeit.default_timer()
-        duration = stop - start
-       
-        samples['time'] = now
+
+        self.stream_sums = accumulator.sums
+        return array('H'), stop - start
+
+    def enable_realtime(self):
+        """ Switches the calling process to real-time mode, and logs the capture jitter measured before and after the switch.
+
+        This runs in the acquisition process when background acquisition is enabled. Otherwise, the whole power monitor process is switched.
+        """
+        read_block = partial(self.frame_reader.read, self.frame_reader.frames_per_block)
+        before = measure_jitter(read_block)
+        applied = apply_realtime(cpu=self.realtime_cpu, priority=self.realtime_priority)
+        with gc_paused():
+            after = measure_jitter(read_block)
+        logger.info(f"Real-time sampling mode: {', '.join(applied) or 'no settings could be applied'}.")
+        logger.info(f"Capture jitter ({self.frame_reader.frames_per_block} frame blocks) before: {format_jitter(before)}. After: {format_jitter(after)}.")
+
+    def max_capture_length(self, num_samples):
+        """ Returns the maximum number of readings that capture_frames(<num_samples>) can return. """
+        if self.streaming:
+            return 0
+        if self.line_cycles:
+            return (num_samples * 4 + self.trailing_frames) * self.frame_reader.frame_size
+        return (num_samples + self.trailing_frames) * self.frame_reader.frame_size
+
+    def read_cycles(self, num_cycles, num_samples, continuous=False):
+        """ Reads frames until <num_cycles> complete line cycles have been captured, starting and ending on a rising zero crossing of the voltage wave.
+
+        The voltage is checked for zero crossings after each block of frames is read, using the DC offset of the previous capture as the
+        zero level. At most 4 * <num_samples> frames (plus the trailing frames) are read, so the capture never exceeds max_capture_length().
+        If no window is found within them (for example, if there's no AC voltage), the first <num_samples> frames are returned instead.
+
+        Returns a tuple of (frames, duration) - see capture_frames().
+        """
+        reader = self.frame_reader
+        stride = reader.frame_size
+        max_frames = num_samples * 4
+        hysteresis = 10     # ADC counts the voltage must fall below the zero level before a rising crossing is counted.
+        low_level = self.voltage_midpoint - hysteresis
+        zero_level = self.voltage_midpoint
+
+        frames = array('H')
+        start_frame = end_frame = None
+        scanned = 0         # Number of frames that have been checked for zero crossings
+        if continuous and self.carried_frames:
+            # The carried frames begin on the rising crossing that ended the previous window, so this window starts right away.
+            frames.extend(self.carried_frames)
+            start_frame = 0
+            scanned = 1
+        self.carried_frames = None
+
+        frames_read = 0     # Frames read from the ADC by this call (excluding carried frames)
+        crossings = 0
+        armed = False
+        start = timeit.default_timer()
+        while end_frame is None:
+            if len(frames) // stride <= scanned:
+                # Read a block at a time, but never past max_frames, which bounds the capture length.
+                block = min(reader.frames_per_block, max_frames - len(frames) // stride)
+                if block <= 0:
+                    break
+                frames.extend(reader.read(block))
+                frames_read += block
+            for frame_num, value in enumerate(frames[scanned * stride + self.voltage_slot::stride], start=scanned):
+                if value < low_level:
+                    armed = True
+                elif armed and value >= zero_level:
+                    armed = False
+                    if start_frame is None:
+                        start_frame = frame_num
+                    else:
+                        crossings += 1
+                        if crossings == num_cycles:
+                            end_frame = frame_num
+                            break
+            scanned = len(frames) // stride
+
+        # In shared voltage mode, the window needs one more frame after the frame that ends the last cycle.
+        if end_frame is not None and (end_frame + self.trailing_frames) * stride > len(frames):
+            frames.extend(reader.read(self.trailing_frames))
+            frames_read += self.trailing_frames
+        elapsed = timeit.default_timer() - start
+
+        if end_frame is None:
+            logger.debug(f"Unable to find {num_cycles} complete line cycles in {max_frames} frames. Falling back to a {num_samples} sample capture.")
+            window = frames[:(num_samples + self.trailing_frames) * stride]
+        else:
+            window = frames[start_frame * stride : (end_frame + self.trailing_frames) * stride]
+            if continuous:
+                self.carried_frames = frames[end_frame * stride:]
+
+        v_samples = window[self.voltage_slot::stride]
+        self.voltage_midpoint = sum(v_samples) / len(v_samples)
+
+        # Scale the elapsed time to the number of frames in the window, based on the rate that frames were read.
+        if frames_read:
+            self.frame_period = elapsed / frames_read
+        duration = self.frame_period * (len(window) // stride - self.trailing_frames)
+        return window, duration
+
+    def split_frames(self, frames, time, duration):
+        """ Splits a flat array of interleaved frames (as read by the FrameReader) into the sample dictionary returned by collect_data(). """
+        samples = dict()
+        stride = self.frame_reader.frame_size
+        num_frames = len(frames) // stride - self.trailing_frames
+        for pcb_chan, (ct_index, v_index, weight) in self.frame_layout.items():
+            if self.shared_voltage:
+                # Reconstruct the voltage at the moment the CT was read by interpolating between the voltage readings that start
+                # this frame and the next one, based on the CT's position in the scan order.
+                v_samples = frames[v_index::stride]
+                samples[f'ct{pcb_chan}'] = frames[ct_index::stride][:num_frames]
+                samples[f'v{pcb_chan}'] = array('f', [v0 + (v1 - v0) * weight for v0, v1 in zip(v_samples[:num_frames], v_samples[1:])])
+            else:
+                samples[f'ct{pcb_chan}'] = frames[ct_index::stride]
+                samples[f'v{pcb_chan}'] = frames[v_index::stride]
+
+        samples['time'] = time
         samples['duration'] = duration
         return samples
 
+    def align_phase(self, samples):
+        """ Realigns each channel's voltage wave with its current wave using the configured phase_shift and the known scan-order skew.
+
+        The voltage wave is delayed by a fractional number of samples using linear interpolation between neighboring samples, in float64
+        and with NumPy when it's available (see delay_samples()). All channels are trimmed to the window where every channel's delayed
+        voltage is defined, so that they keep the same sample count.
+
+        Returns a new sample dictionary with the same keys as <samples>.
+        """
+        num_samples = len(samples[f'ct{self.enabled_channels[0]}'])
+        samples_per_degree = (num_samples / samples['duration']) / (self.grid_frequency * 360)
+
+        delays = dict()
+        lo, hi = 0, num_samples
+        for chan_num, phase_shift in self.phase_shifts.items():
+            delay = self.voltage_skew[chan_num] + phase_shift * samples_per_degree
+            whole = floor(delay)
+            delays[chan_num] = (whole, delay - whole)
+            lo = max(lo, whole + 1)
+            hi = min(hi, num_samples + whole)
+
+        aligned = dict(samples)
+        for chan_num, (whole, frac) in delays.items():
+            aligned[f'ct{chan_num}'] = samples[f'ct{chan_num}'][lo:hi]
+            aligned[f'v{chan_num}'] = delay_samples(samples[f'v{chan_num}'], lo - whole, hi - whole, frac, self.vectorized)
+
+        return aligned
+
     def calculate_power(self, samples, board_voltage):
         """ Calculates amperage, real power, power factor, and voltage
         
         Arguments:
-        samples -- dict, a dictionary containing lists of each channel's sample data, and a voltage wave that's been collected for each corresponding channel.
+        samples -- dict, a dictionary containing arrays of each channel's sample data, and a voltage wave that's been collected for each corresponding channel.
 
         Returns a dictionary containing a dictionary for each channel, with the following structure:
         {
@@ -430,415 +1027,95 @@ class RPiPowerMonitor:
             'ct6' : { ... }
         }
         """
-        ct1_samples = samples.get('ct1')        # current samples for ct1
-        ct2_samples = samples.get('ct2')        # current samples for ct2
-        ct3_samples = samples.get('ct3')        # current samples for ct3
-        ct4_samples = samples.get('ct4')        # current samples for ct4
-        ct5_samples = samples.get('ct5')        # current samples for ct5
-        ct6_samples = samples.get('ct6')        # current samples for ct6
-        v_samples_1 = samples.get('v1')      # voltage wave specifically for ct1
-        v_samples_2 = samples.get('v2')      # voltage wave specifically for ct2
-        v_samples_3 = samples.get('v3')      # voltage wave specifically for ct3
-        v_samples_4 = samples.get('v4')      # voltage wave specifically for ct4
-        v_samples_5 = samples.get('v5')      # voltage wave specifically for ct5
-        v_samples_6 = samples.get('v6')      # voltage wave specifically for ct6
-
-        # Variable Initialization
-        sum_inst_power_ct1 = 0
-        sum_inst_power_ct2 = 0
-        sum_inst_power_ct3 = 0
-        sum_inst_power_ct4 = 0
-        sum_inst_power_ct5 = 0
-        sum_inst_power_ct6 = 0
-        sum_squared_current_ct1 = 0
-        sum_squared_current_ct2 = 0
-        sum_squared_current_ct3 = 0
-        sum_squared_current_ct4 = 0
-        sum_squared_current_ct5 = 0
-        sum_squared_current_ct6 = 0
-        sum_raw_current_ct1 = 0
-        sum_raw_current_ct2 = 0
-        sum_raw_current_ct3 = 0
-        sum_raw_current_ct4 = 0
-        sum_raw_current_ct5 = 0
-        sum_raw_current_ct6 = 0
-        sum_squared_voltage_1 = 0
-        sum_squared_voltage_2 = 0
-        sum_squared_voltage_3 = 0
-        sum_squared_voltage_4 = 0
-        sum_squared_voltage_5 = 0
-        sum_squared_voltage_6 = 0
-        sum_raw_voltage_1 = 0
-        sum_raw_voltage_2 = 0
-        sum_raw_voltage_3 = 0
-        sum_raw_voltage_4 = 0
-        sum_raw_voltage_5 = 0
-        sum_raw_voltage_6 = 0
-
-        # Scaling factors
-        vref = board_voltage / 1024
-        ct1_scaling_factor = vref * self.config['current_transformers']['channel_1']['calibration'] * int(self.config['current_transformers']['channel_1']['rating']) * self.def_cal
-        ct2_scaling_factor = vref * self.config['current_transformers']['channel_2']['calibration'] * int(self.config['current_transformers']['channel_2']['rating']) * self.def_cal
-        ct3_scaling_factor = vref * self.config['current_transformers']['channel_3']['calibration'] * int(self.config['current_transformers']['channel_3']['rating']) * self.def_cal
-        ct4_scaling_factor = vref * self.config['current_transformers']['channel_4']['calibration'] * int(self.config['current_transformers']['channel_4']['rating']) * self.def_cal
-        ct5_scaling_factor = vref * self.config['current_transformers']['channel_5']['calibration'] * int(self.config['current_transformers']['channel_5']['rating']) * self.def_cal
-        ct6_scaling_factor = vref * self.config['current_transformers']['channel_6']['calibration'] * int(self.config['current_transformers']['channel_6']['rating']) * self.def_cal
-        ac_voltage_ratio = (self.grid_voltage / self.ac_transformer_output_voltage) * 11  # Rough approximation
-        voltage_scaling_factor = vref * ac_voltage_ratio * self.voltage_calibration
-
-        # Get the number of samples by checking the length of one of the sample buffers.
-        for chan_num in range(1, 7):
-            if f'ct{chan_num}' in samples.keys():
-                num_samples = len(samples[f'ct{chan_num}'])
-                break
-
-        for i in range(0, num_samples):
-            if ct1_samples:
-                ct1 = (int(ct1_samples[i]))
-                voltage_1 = (int(v_samples_1[i]))
-                sum_raw_current_ct1 += ct1
-                sum_raw_voltage_1 += voltage_1
-                inst_power_ct1 = ct1 * voltage_1
-                sum_inst_power_ct1 += inst_power_ct1
-                squared_voltage_1 = voltage_1 * voltage_1
-                sum_squared_voltage_1 += squared_voltage_1
-                sq_ct1 = ct1 * ct1
-                sum_squared_current_ct1 += sq_ct1
-                
-
-            if ct2_samples:
-                ct2 = (int(ct2_samples[i]))
-                voltage_2 = (int(v_samples_2[i]))
-                sum_raw_current_ct2 += ct2
-                sum_raw_voltage_2 += voltage_2
-                inst_power_ct2 = ct2 * voltage_2
-                sum_inst_power_ct2 += inst_power_ct2
-                squared_voltage_2 = voltage_2 * voltage_2
-                sum_squared_voltage_2 += squared_voltage_2
-                sq_ct2 = ct2 * ct2
-                sum_squared_current_ct2 += sq_ct2
-                
-
-            if ct3_samples:
-                ct3 = (int(ct3_samples[i]))
-                voltage_3 = (int(v_samples_3[i]))
-                sum_raw_current_ct3 += ct3
-                sum_raw_voltage_3 += voltage_3
-                inst_power_ct3 = ct3 * voltage_3
-                sum_inst_power_ct3 += inst_power_ct3
-                squared_voltage_3 = voltage_3 * voltage_3
-                sum_squared_voltage_3 += squared_voltage_3
-                sq_ct3 = ct3 * ct3
-                sum_squared_current_ct3 += sq_ct3
-                
-
-            if ct4_samples:
-                ct4 = (int(ct4_samples[i]))
-                voltage_4 = (int(v_samples_4[i]))
-                sum_raw_current_ct4 += ct4
-                sum_raw_voltage_4 += voltage_4
-                inst_power_ct4 = ct4 * voltage_4
-                sum_inst_power_ct4 += inst_power_ct4
-                squared_voltage_4 = voltage_4 * voltage_4
-                sum_squared_voltage_4 += squared_voltage_4
-                sq_ct4 = ct4 * ct4
-                sum_squared_current_ct4 += sq_ct4
-                
-
-            if ct5_samples:
-                ct5 = (int(ct5_samples[i]))
-                voltage_5 = (int(v_samples_5[i]))
-                sum_raw_current_ct5 += ct5
-                sum_raw_voltage_5 += voltage_5
-                inst_power_ct5 = ct5 * voltage_5
-                sum_inst_power_ct5 += inst_power_ct5
-                squared_voltage_5 = voltage_5 * voltage_5
-                sum_squared_voltage_5 += squared_voltage_5
-                sq_ct5 = ct5 * ct5
-                sum_squared_current_ct5 += sq_ct5
-                
-
-            if ct6_samples:
-                ct6 = (int(ct6_samples[i]))
-                voltage_6 = (int(v_samples_6[i]))
-                sum_raw_current_ct6 += ct6
-                sum_raw_voltage_6 += voltage_6
-                inst_power_ct6 = ct6 * voltage_6
-                sum_inst_power_ct6 += inst_power_ct6
-                squared_voltage_6 = voltage_6 * voltage_6
-                sum_squared_voltage_6 += squared_voltage_6
-                sq_ct6 = ct6 * ct6
-                sum_squared_current_ct6 += sq_ct6
+        if 'sums' in samples:
+            # Streaming mode - the sums were accumulated during the capture.
+            channel_sums = samples['sums']
+        else:
+            if self.phase_shifts:
+                samples = self.align_phase(samples)
+            channel_sums = all_channel_sums({chan_num : (samples[f'ct{chan_num}'], samples[f'v{chan_num}']) for chan_num in self.enabled_channels}, self.vectorized)
 
         results = dict()
+        for chan_num, sums in channel_sums.items():
+            plan = self.channel_plans[chan_num]
+            num_samples = sums.num_samples
 
-        if ct1_samples:
-            avg_raw_current_ct1 = sum_raw_current_ct1 / num_samples
-            avg_raw_voltage_1 = sum_raw_voltage_1 / num_samples
-            real_power_1 = ((sum_inst_power_ct1 / num_samples) - (avg_raw_current_ct1 * avg_raw_voltage_1))  * ct1_scaling_factor * voltage_scaling_factor
-            mean_square_current_ct1 = sum_squared_current_ct1 / num_samples
-            mean_square_voltage_1 = sum_squared_voltage_1 / num_samples
-            rms_current_ct1 = sqrt(mean_square_current_ct1 - (avg_raw_current_ct1 * avg_raw_current_ct1)) * ct1_scaling_factor
-            rms_voltage_1 = sqrt(mean_square_voltage_1 - (avg_raw_voltage_1 * avg_raw_voltage_1)) * voltage_scaling_factor
-            apparent_power_1 = rms_voltage_1 * rms_current_ct1
-            try:
-                power_factor_1 = real_power_1 / apparent_power_1
-                power_factor_1 = abs(power_factor_1)
-            except ZeroDivisionError:
-                power_factor_1 = 0
-            if self.config['current_transformers']['channel_1']['two_pole']:
-                real_power_1 = real_power_1 * 2
-            if self.config['current_transformers']['channel_1'].get('reversed'):
-                # Change the sign of the power calculation, and then make the current calculation match.
-                real_power_1 = real_power_1 * -1
-            if real_power_1 < 0 and rms_voltage_1 > 10:
-                rms_current_ct1 = abs(rms_current_ct1) * -1
-
-            # Filter out PF if the amperage data is not sufficient.
-            delta = max(ct1_samples) - min(ct1_samples)
-            if delta < self.PF_DELTA:
-                power_factor_1 = 0
-                
-            results[1] = {
-                'type': self.config['current_transformers']['channel_1']['type'],
-                'power': real_power_1,
-                'current': rms_current_ct1,
-                'voltage': rms_voltage_1,
-                'pf': power_factor_1
-            }
-
-        if ct2_samples:
-            avg_raw_current_ct2 = sum_raw_current_ct2 / num_samples
-            avg_raw_voltage_2 = sum_raw_voltage_2 / num_samples
-            real_power_2 = ((sum_inst_power_ct2 / num_samples) - (avg_raw_current_ct2 * avg_raw_voltage_2))  * ct2_scaling_factor * voltage_scaling_factor
-            mean_square_current_ct2 = sum_squared_current_ct2 / num_samples
-            mean_square_voltage_2 = sum_squared_voltage_2 / num_samples
-            rms_current_ct2 = sqrt(mean_square_current_ct2 - (avg_raw_current_ct2 * avg_raw_current_ct2)) * ct2_scaling_factor
-            rms_voltage_2 = sqrt(mean_square_voltage_2 - (avg_raw_voltage_2 * avg_raw_voltage_2)) * voltage_scaling_factor
-            apparent_power_2 = rms_voltage_2 * rms_current_ct2
-            try:
-                power_factor_2 = real_power_2 / apparent_power_2
-                power_factor_2 = abs(power_factor_2)
-            except ZeroDivisionError:
-                power_factor_2 = 0
-            if self.config['current_transformers']['channel_2']['two_pole']:
-                real_power_2 = real_power_2 * 2
-            if self.config['current_transformers']['channel_2'].get('reversed'):
-                # Change the sign of the power calculation, and then make the current calculation match.
-                real_power_2 = real_power_2 * -1
-            if real_power_2 < 0 and rms_voltage_2 > 10:
-                rms_current_ct2 = abs(rms_current_ct2) * -1
-
-            # Filter out PF if the amperage data is not sufficient.
-            delta = max(ct2_samples) - min(ct2_samples)
-            if delta < self.PF_DELTA:
-                power_factor_2 = 0
-                
-            results[2] = {
-                'type': self.config['current_transformers']['channel_2']['type'],
-                'power': real_power_2,
-                'current': rms_current_ct2,
-                'voltage': rms_voltage_2,
-                'pf': power_factor_2
-            }
-
-        if ct3_samples:
-            avg_raw_current_ct3 = sum_raw_current_ct3 / num_samples
-            avg_raw_voltage_3 = sum_raw_voltage_3 / num_samples
-            real_power_3 = ((sum_inst_power_ct3 / num_samples) - (avg_raw_current_ct3 * avg_raw_voltage_3))  * ct3_scaling_factor * voltage_scaling_factor
-            mean_square_current_ct3 = sum_squared_current_ct3 / num_samples
-            mean_square_voltage_3 = sum_squared_voltage_3 / num_samples
-            rms_current_ct3 = sqrt(mean_square_current_ct3 - (avg_raw_current_ct3 * avg_raw_current_ct3)) * ct3_scaling_factor
-            rms_voltage_3 = sqrt(mean_square_voltage_3 - (avg_raw_voltage_3 * avg_raw_voltage_3)) * voltage_scaling_factor
-            apparent_power_3 = rms_voltage_3 * rms_current_ct3
-            try:
-                power_factor_3 = real_power_3 / apparent_power_3
-                power_factor_3 = abs(power_factor_3)
-            except ZeroDivisionError:
-                power_factor_3 = 0
-            if self.config['current_transformers']['channel_3']['two_pole']:
-                real_power_3 = real_power_3 * 2
-            if self.config['current_transformers']['channel_3'].get('reversed'):
-                # Change the sign of the power calculation, and then make the current calculation match.
-                real_power_3 = real_power_3 * -1
-            if real_power_3 < 0 and rms_voltage_3 > 10:
-                rms_current_ct3 = abs(rms_current_ct3) * -1
-
-            # Filter out PF if the amperage data is not sufficient.
-            delta = max(ct3_samples) - min(ct3_samples)
-            if delta < self.PF_DELTA:
-                power_factor_3 = 0
-                
-            results[3] = {
-                'type': self.config['current_transformers']['channel_3']['type'],
-                'power': real_power_3,
-                'current': rms_current_ct3,
-                'voltage': rms_voltage_3,
-                'pf': power_factor_3
-            }
-
-        if ct4_samples:
-            avg_raw_current_ct4 = sum_raw_current_ct4 / num_samples
-            avg_raw_voltage_4 = sum_raw_voltage_4 / num_samples
-            real_power_4 = ((sum_inst_power_ct4 / num_samples) - (avg_raw_current_ct4 * avg_raw_voltage_4))  * ct4_scaling_factor * voltage_scaling_factor
-            mean_square_current_ct4 = sum_squared_current_ct4 / num_samples
-            mean_square_voltage_4 = sum_squared_voltage_4 / num_samples
-            rms_current_ct4 = sqrt(mean_square_current_ct4 - (avg_raw_current_ct4 * avg_raw_current_ct4)) * ct4_scaling_factor
-            rms_voltage_4 = sqrt(mean_square_voltage_4 - (avg_raw_voltage_4 * avg_raw_voltage_4)) * voltage_scaling_factor
-            apparent_power_4 = rms_voltage_4 * rms_current_ct4
-            try:
-                power_factor_4 = real_power_4 / apparent_power_4
-                power_factor_4 = abs(power_factor_4)
-            except ZeroDivisionError:
-                power_factor_4 = 0
-            if self.config['current_transformers']['channel_4']['two_pole']:
-                real_power_4 = real_power_4 * 2
-            if self.config['current_transformers']['channel_4'].get('reversed'):
-                # Change the sign of the power calculation, and then make the current calculation match.
-                real_power_4 = real_power_4 * -1
-            if real_power_4 < 0 and rms_voltage_4 > 10:
-                rms_current_ct4 = abs(rms_current_ct4) * -1
-
-            # Filter out PF if the amperage data is not sufficient.
-            delta = max(ct4_samples) - min(ct4_samples)
-            if delta < self.PF_DELTA:
-                power_factor_4 = 0
-                
-            results[4] = {
-                'type': self.config['current_transformers']['channel_4']['type'],
-                'power': real_power_4,
-                'current': rms_current_ct4,
-                'voltage': rms_voltage_4,
-                'pf': power_factor_4
-            }
-
-        if ct5_samples:
-            avg_raw_current_ct5 = sum_raw_current_ct5 / num_samples
-            avg_raw_voltage_5 = sum_raw_voltage_5 / num_samples
-            real_power_5 = ((sum_inst_power_ct5 / num_samples) - (avg_raw_current_ct5 * avg_raw_voltage_5))  * ct5_scaling_factor * voltage_scaling_factor
-            mean_square_current_ct5 = sum_squared_current_ct5 / num_samples
-            mean_square_voltage_5 = sum_squared_voltage_5 / num_samples
-            rms_current_ct5 = sqrt(mean_square_current_ct5 - (avg_raw_current_ct5 * avg_raw_current_ct5)) * ct5_scaling_factor
-            rms_voltage_5 = sqrt(mean_square_voltage_5 - (avg_raw_voltage_5 * avg_raw_voltage_5)) * voltage_scaling_factor
-            apparent_power_5 = rms_voltage_5 * rms_current_ct5
+            # Scaling factors. With more than one board, each channel is scaled by the reference voltage of the board it's wired to.
+            if isinstance(board_voltage, dict):
+                vref = board_voltage[plan.board] / 1024
+            else:
+                vref = board_voltage / 1024
+            ct_scaling_factor = vref * plan.current_scale
+            voltage_scaling_factor = vref * self.voltage_scale
+
+            avg_raw_current = sums.current / num_samples
+            avg_raw_voltage = sums.voltage / num_samples
+            real_power = ((sums.inst_power / num_samples) - (avg_raw_current * avg_raw_voltage))  * ct_scaling_factor * voltage_scaling_factor
+            mean_square_current = sums.squared_current / num_samples
+            mean_square_voltage = sums.squared_voltage / num_samples
+            rms_current = sqrt(mean_square_current - (avg_raw_current * avg_raw_current)) * ct_scaling_factor
+            rms_voltage = sqrt(mean_square_voltage - (avg_raw_voltage * avg_raw_voltage)) * voltage_scaling_factor
+            apparent_power = rms_voltage * rms_current
             try:
-                power_factor_5 = real_power_5 / apparent_power_5
-                power_factor_5 = abs(power_factor_5)
+                power_factor = real_power / apparent_power
+                power_factor = abs(power_factor)
             except ZeroDivisionError:
-                power_factor_5 = 0
-            if self.config['current_transformers']['channel_5']['two_pole']:
-                real_power_5 = real_power_5 * 2
-            if self.config['current_transformers']['channel_5'].get('reversed'):
-                # Change the sign of the power calculation, and then make the current calculation match.
-                real_power_5 = real_power_5 * -1
-            if real_power_5 < 0 and rms_voltage_5 > 10:
-                rms_current_ct5 = abs(rms_current_ct5) * -1
+                power_factor = 0
+            # Double the power for two-pole circuits, and change the sign for reversed CTs. Then make the current calculation match the sign of the power.
+            real_power = real_power * plan.power_multiplier
+            if real_power < 0 and rms_voltage > 10:
+                rms_current = abs(rms_current) * -1
 
             # Filter out PF if the amperage data is not sufficient.
-            delta = max(ct5_samples) - min(ct5_samples)
-            if delta < self.PF_DELTA:
-                power_factor_5 = 0
-                
-            results[5] = {
-                'type': self.config['current_transformers']['channel_5']['type'],
-                'power': real_power_5,
-                'current': rms_current_ct5,
-                'voltage': rms_voltage_5,
-                'pf': power_factor_5
+            if sums.current_delta < self.PF_DELTA:
+                power_factor = 0
+
+            result = {
+                'type': plan.type,
+                'power': real_power,
+                'current': rms_current,
+                'voltage': rms_voltage,
+                'pf': power_factor
             }
 
-        if ct6_samples:
-            avg_raw_current_ct6 = sum_raw_current_ct6 / num_samples
-            avg_raw_voltage_6 = sum_raw_voltage_6 / num_samples
-            real_power_6 = ((sum_inst_power_ct6 / num_samples) - (avg_raw_current_ct6 * avg_raw_voltage_6))  * ct6_scaling_factor * voltage_scaling_factor
-            mean_square_current_ct6 = sum_squared_current_ct6 / num_samples
-            mean_square_voltage_6 = sum_squared_voltage_6 / num_samples
-            rms_current_ct6 = sqrt(mean_square_current_ct6 - (avg_raw_current_ct6 * avg_raw_current_ct6)) * ct6_scaling_factor
-            rms_voltage_6 = sqrt(mean_square_voltage_6 - (avg_raw_voltage_6 * avg_raw_voltage_6)) * voltage_scaling_factor
-            apparent_power_6 = rms_voltage_6 * rms_current_ct6
-            try:
-                power_factor_6 = real_power_6 / apparent_power_6
-                power_factor_6 = abs(power_factor_6)
-            except ZeroDivisionError:
-                power_factor_6 = 0        
-            if self.config['current_transformers']['channel_6']['two_pole']:
-                real_power_6 = real_power_6 * 2
-            if self.config['current_transformers']['channel_6'].get('reversed'):
-                # Change the sign of the power calculation, and then make the current calculation match.
-                real_power_6 = real_power_6 * -1
-            if real_power_6 < 0 and rms_voltage_6 > 10:
-                rms_current_ct6 = abs(rms_current_ct6) * -1
+            # Software Noise Filtering - Amps & Watts
+            # amps_cutoff_threshold (added in v0.3.2)
+            #   When the amperage reading falls below the specified value, all readings for the channel will be ignored.
+            #   `amps_cutoff_threshold` is preferred - `watts_cutoff_threshold` is deprecated as of v0.3.2 and will be removed in a future release.
+            #   `watts_cutoff_threshold` will be ignored if `amps_cutoff_threshold` is specified.
+            if plan.cutoff != 0 and abs(result[plan.cutoff_figure]) < plan.cutoff:
+                result['power'] = 0
+                result['current'] = 0
+                result['pf'] = 0
 
-            # Filter out PF if the amperage data is not sufficient.
-            delta = max(ct6_samples) - min(ct6_samples)
-            if delta < self.PF_DELTA:
-                power_factor_6 = 0
-                
-            results[6] = {
-                'type': self.config['current_transformers']['channel_6']['type'],
-                'power': real_power_6,
-                'current': rms_current_ct6,
-                'voltage': rms_voltage_6,
-                'pf': power_factor_6
-            }
+            results[chan_num] = result
 
-        # Software Noise Filtering - Amps & Watts
-        # amps_cutoff_threshold (added in v0.3.2)
-        #   When the amperage reading falls below the specified value, all readings for the channel will be ignored.
-        #   `amps_cutoff_threshold` is preferred - `watts_cutoff_threshold` is deprecated as of v0.3.2 and will be removed in a future release.
-        #   `watts_cutoff_threshold` will be ignored if `amps_cutoff_threshold` is specified.
-    
-    
-        # Check to see if amps_cutoff_threshold is defined in the config file. If not, fallback to using watts_cutoff_threshold.
-        for chan_num in self.enabled_channels:
-            if self.config['current_transformers'][f'channel_{chan_num}'].get('amps_cutoff_threshold') is not None:
-                cutoff = float(self.config['current_transformers'][f'channel_{chan_num}']['amps_cutoff_threshold'])
-                if cutoff != 0:
-                    if abs(results[chan_num]['current']) < cutoff:
-                        results[chan_num]['power'] = 0
-                        results[chan_num]['current'] = 0
-                        results[chan_num]['pf'] = 0
-            else:   # Filter is based off the `watts_cutoff_threshold` setting
-                cutoff = float(self.config['current_transformers'][f'channel_{chan_num}']['watts_cutoff_threshold'])    
-                if cutoff != 0:
-                    if abs(results[chan_num]['power']) < cutoff:
-                        results[chan_num]['power'] = 0
-                        results[chan_num]['current'] = 0
-                        results[chan_num]['pf'] = 0
-                    
         return results
 
     def run_main(self):
         """ Starts the main power monitor loop and launches plugins. """
         logger.info("... Starting Raspberry Pi Power Monitor")
         logger.info("Press Ctrl-c to quit...")
-        # The following empty dictionaries will hold the respective calculated values at the end
-        # of each polling cycle, which are then averaged prior to storing the value to the DB.
-        production_values = dict(power=[], pf=[], current=[])
-        home_consumption_values = dict(power=[], pf=[], current=[])
-        net_values = dict(power=[], current=[])
-        ct_dict = {channel : {'power' : [], 'pf' : [], 'current' : [], 'voltage' : []} for channel in self.enabled_channels}
-        rms_voltages = []
-        SMA_Data = {channel : {'power' : [], 'pf' : [], 'current' : []} for channel in self.enabled_channels}
-        # Add 'production', 'home-consumption', and 'net' figures to the SMA_Data dictionary:
-        SMA_Data.update({
-            'cts' : ct_dict,
-            'production' : {'power' : [], 'pf': [], 'current': []},
-            'home-consumption' : {'power': [], 'current': []},
-            'net' : {'power': [], 'current': []},
-            'voltage' : [],
-            })
+        # Each calculated figure is smoothed by a rolling aggregate over the last <window> polling cycles (see the [averaging] config section)
+        # before it's stored in the DB or published to plugins.
+        new_aggregate = partial(RollingAggregate, self.averaging_window, self.averaging_method, self.averaging_alpha)
+        SMA_Data = {
+            'cts' : {channel : {'power' : new_aggregate(), 'pf' : new_aggregate(), 'current' : new_aggregate(), 'voltage' : new_aggregate()} for channel in self.enabled_channels},
+            'production' : {'power' : new_aggregate(), 'pf' : new_aggregate(), 'current' : new_aggregate()},
+            'home-consumption' : {'power' : new_aggregate(), 'current' : new_aggregate()},
+            'net' : {'power' : new_aggregate(), 'current' : new_aggregate()},
+            'voltage' : new_aggregate(),
+        }
         SMA_Values = {
-            'cts' : deepcopy(ct_dict),
+            'cts' : {channel : {'power' : None, 'pf' : None, 'current' : None, 'voltage' : None} for channel in self.enabled_channels},
             'production' : {'power' : None, 'pf' : None, 'current' : None},
             'home-consumption' : {'power' : None, 'current' : None},
             'net' : {'power' : None, 'current' : None},
             'voltage' : None
         }
-        SMA_Window = 2      # This is the total number of calculations that are included in the simple-moving-average.
         write_threshold = 2 # This controls how many SMA_Data updates are processed before the resulting simple-moving-average values are sent to be stored in the database.
         write_threshold_counter = 0 # Counter that keeps track of the number of SMA updates processed. When write_threshold_counter == write_threshold, the current SMA values will be sent to influx DB cache for eventual storage.
-        num_samples = 500
+        num_samples = self.stream_frames if self.streaming else 500
 
         # Start plugins that have been imported.
         if len(self.imported_plugins.keys()) > 0:
@@ -852,21 +1129,63 @@ class RPiPowerMonitor:
             self.latest_results = dict()
 
 
-        # Get the expected sample count for the current configuration.
-        samples = self.collect_data(num_samples)
-        sample_count = sum([len(samples[x]) for x in samples.keys() if type(samples[x]) == list])
+        # Start the acquisition process, which captures blocks continuously while this process does everything else.
+        if self.background_acquisition:
+            capture = lambda: self.capture_frames(num_samples, continuous=True, streaming=self.streaming)
+            setup = self.enable_realtime if self.realtime else None
+            info = lambda: {'timing' : self.capture_timing, 'sums' : self.stream_sums}
+            self.acquisition = AcquisitionWorker(capture, self.max_capture_length(num_samples), self.get_board_voltages, setup=setup, info_func=info)
+            self.acquisition.start()
+            if self.realtime:
+                release_cpu(self.realtime_cpu)
+        elif self.realtime:
+            self.enable_realtime()
+
+        # The writer thread is started after the acquisition process is forked, so that the child can't inherit a lock held by the thread.
+        if self.writer:
+            self.writer.start()
+        timing_log_counter = 0
         
         while not halt_flag.is_set():
-            board_voltage = self.get_board_voltage()
-            samples = self.collect_data(num_samples)
+            if self.acquisition:
+                block = self.acquisition.get_block()
+                if block is None:
+                    logger.warning("The acquisition process has not produced any samples in the last 5 seconds.")
+                    continue
+                board_voltage = block.board_voltage
+                if self.streaming:
+                    samples = {'sums' : block.info['sums'], 'time' : block.time, 'duration' : block.duration}
+                else:
+                    samples = self.split_frames(block.frames, block.time, block.duration)
+                capture_timing = block.info['timing']
+            else:
+                board_voltage = self.get_board_voltages()
+                if self.streaming:
+                    samples = self.collect_sums(num_samples)
+                else:
+                    samples = self.collect_data(num_samples)
+                capture_timing = self.capture_timing
+            if self.timing_stats is not None:
+                self.timing_stats.add(capture_timing)
+                timing_log_counter += 1
+                if timing_log_counter == self.timing_window and not self.terminal_mode:
+                    logger.info(self.timing_stats.format())
+                    timing_log_counter = 0
             poll_time = samples['time']
             duration = samples['duration']
-            sample_rate = round((sample_count / duration) / num_samples, 2)
-            per_channel_sample_rate = round(sample_rate / (2 * len(rpm.enabled_channels)), 2)
+            if self.streaming:
+                sample_count = samples['sums'][self.enabled_channels[0]].num_samples * self.frame_reader.frame_size
+            else:
+                sample_count = len(samples[f'ct{self.enabled_channels[0]}']) * self.frame_reader.frame_size
+            sample_rate = round((sample_count / duration) / 1000, 2)
+            per_channel_sample_rate = round(sample_rate / self.frame_reader.frame_size, 2)
 
             results = self.calculate_power(samples, board_voltage)
             voltage = results[self.enabled_channels[0]]['voltage']
 
+            if self.harmonic_analyzer and self.harmonic_analyzer.due():
+                self.analyze_harmonics(samples)
+
             # Determine Production, Home Consumption, and Net Values
             
             # Home Consumption
@@ -884,7 +1203,7 @@ class RPiPowerMonitor:
                     home_consumption_current += results[chan_num]['current']
                 for chan_num in self.production_channels:
                     home_consumption_power += results[chan_num]['power']
-                    if self.config['current_transformers'][f'channel_{chan_num}']['two_pole']:
+                    if self.channel_plans[chan_num].two_pole:
                         home_consumption_current += ( 2 * results[chan_num]['current'])
                     else:
                         home_consumption_current += results[chan_num]['current']
@@ -920,64 +1239,56 @@ class RPiPowerMonitor:
             else:
                 current_status = "Consuming"
 
-
-            # Initial SMA Construction
-            if len(SMA_Data['cts'][self.enabled_channels[0]]['power']) < SMA_Window:
-                for chan in results.keys():
-                    for figure, value in results[chan].items():
-                        if figure != 'type':
-                            SMA_Data['cts'][chan][figure].append(value)
-                
-                # Voltage, Net, Home Power, and Production SMAs
-                SMA_Data['voltage'].append(voltage)
-                SMA_Data['home-consumption']['power'].append(home_consumption_power)
-                SMA_Data['home-consumption']['current'].append(home_consumption_current)
-                SMA_Data['net']['power'].append(net_power)
-                SMA_Data['net']['current'].append(net_current)
-                SMA_Data['production']['power'].append(production_power)
-                SMA_Data['production']['current'].append(production_current)
-                SMA_Data['production']['pf'].append(production_pf)
-            
-            else:
-                for chan in results.keys():
-                    for figure, value in results[chan].items():
-                        if figure != 'type': 
-                            SMA_Data['cts'][chan][figure].pop(0)
-                            SMA_Data['cts'][chan][figure].append(value)
-                
-                SMA_Data['voltage'].pop(0)
-                SMA_Data['home-consumption']['power'].pop(0)
-                SMA_Data['home-consumption']['current'].pop(0)
-                SMA_Data['net']['power'].pop(0)
-                SMA_Data['net']['current'].pop(0)
-                SMA_Data['production']['power'].pop(0)
-                SMA_Data['production']['current'].pop(0)
-                SMA_Data['production']['pf'].pop(0)
-
-                SMA_Data['voltage'].append(voltage)
-                SMA_Data['home-consumption']['power'].append(home_consumption_power)
-                SMA_Data['home-consumption']['current'].append(home_consumption_current)
-                SMA_Data['net']['power'].append(net_power)
-                SMA_Data['net']['current'].append(net_current)
-                SMA_Data['production']['power'].append(production_power)
-                SMA_Data['production']['current'].append(production_current)
-                SMA_Data['production']['pf'].append(production_pf)
-
-                # Calculate SMA
+            # Energy counters are integrated from every capture (not the SMA values), timestamped at the middle of the capture.
+            if self.energy:
+                powers = {f'ct{chan_num}' : results[chan_num]['power'] for chan_num in self.enabled_channels}
+                powers.update({'home-consumption' : home_consumption_power, 'production' : production_power, 'net' : net_power})
+                self.energy.update(powers, poll_time + timedelta(seconds=duration / 2))
+
+            if self.rollups:
+                self.update_rollups(results, home_consumption_power, home_consumption_current, production_power, production_current, net_power, net_current, poll_time + timedelta(seconds=duration / 2))
+
+            if self.decimator:
+                capture_values = {('cts', chan_num, figure) : results[chan_num][figure] for chan_num in self.enabled_channels for figure in ('power', 'current', 'pf')}
+                capture_values.update({
+                    ('home-consumption', 'power') : home_consumption_power,
+                    ('home-consumption', 'current') : home_consumption_current,
+                    ('production', 'power') : production_power,
+                    ('production', 'current') : production_current,
+                    ('production', 'pf') : production_pf,
+                    ('net', 'power') : net_power,
+                    ('net', 'current') : net_current,
+                    ('voltage',) : voltage,
+                })
+                interval = self.decimator.add(capture_values, poll_time)
+                if interval:
+                    self.queue_decimated(*interval)
+
+            # Update the rolling aggregates. Each update takes constant time, regardless of the window length.
+            for chan in results.keys():
+                for figure, aggregate in SMA_Data['cts'][chan].items():
+                    aggregate.add(results[chan][figure])
+            SMA_Data['voltage'].add(voltage)
+            SMA_Data['home-consumption']['power'].add(home_consumption_power)
+            SMA_Data['home-consumption']['current'].add(home_consumption_current)
+            SMA_Data['net']['power'].add(net_power)
+            SMA_Data['net']['current'].add(net_current)
+            SMA_Data['production']['power'].add(production_power)
+            SMA_Data['production']['current'].add(production_current)
+            SMA_Data['production']['pf'].add(production_pf)
+
+            # Values are only stored and published once the window has filled up.
+            if SMA_Data['voltage'].full:
                 for chan in SMA_Data['cts'].keys():
-                    for figure, values in SMA_Data['cts'][chan].items():
-                        SMA_Values['cts'][chan][figure] = sum(values) / len(values)
-                
+                    for figure, aggregate in SMA_Data['cts'][chan].items():
+                        SMA_Values['cts'][chan][figure] = aggregate.value
+
                 for summary_figure in ('home-consumption', 'net', 'production'):
-                    try:
-                        for measurement, values in SMA_Data[summary_figure].items():
-                            SMA_Values[summary_figure][measurement] = sum(values) / len(values)
-                    except ZeroDivisionError:
-                        SMA_Values[summary_figure][measurement] = 0
-                    
-                # Update Voltage SMA separately since it is not a dictionary.
-                SMA_Values['voltage'] = sum(SMA_Data['voltage']) / len(SMA_Data['voltage'])
-            
+                    for measurement, aggregate in SMA_Data[summary_figure].items():
+                        SMA_Values[summary_figure][measurement] = aggregate.value
+
+                SMA_Values['voltage'] = SMA_Data['voltage'].value
+
                 # Determine if the system is net producing or net consuming right now by looking at the panel mains.
                 # Since the current measured is always positive,
                 # we need to add a negative sign to the amperage value if we're exporting power.
@@ -996,58 +1307,168 @@ class RPiPowerMonitor:
                 # rms_power_5 = round(results['ct5']['current'] * results['ct5']['voltage'], 2)  # AKA apparent power
                 # rms_power_6 = round(results['ct6']['current'] * results['ct6']['voltage'], 2)  # AKA apparent power
 
-                # Prepare values for database storage
+                # Prepare values for database storage (with decimation, points are queued by queue_decimated() at the end of each interval instead)
 
-                if write_threshold_counter == write_threshold:
-                    self.queue_for_influx(SMA_Values, poll_time)
-                    write_threshold_counter = 0
-                else:
-                    write_threshold_counter += 1
+                if self.decimator is None:
+                    if write_threshold_counter == write_threshold:
+                        self.queue_for_influx(SMA_Values, poll_time)
+                        write_threshold_counter = 0
+                    else:
+                        write_threshold_counter += 1
 
                 # Expose data to plugins
                 self.latest_results.update(SMA_Values)
+                if self.timing_stats is not None:
+                    self.latest_results['acquisition'] = self.timing_stats.snapshot()
+                if self.energy:
+                    self.latest_results['energy'] = self.energy.snapshot()
+                if self.writer:
+                    self.latest_results['influx_writer'] = self.writer.snapshot()
 
                 if self.terminal_mode:
-                    self.print_results(SMA_Values, sample_rate)
+                    self.print_results(SMA_Values, sample_rate, self.energy.snapshot() if self.energy else None)
+                    if self.timing_stats is not None:
+                        logger.info(self.timing_stats.format())
 
         # Halt flag set
         self.cleanup()
 
-    def queue_for_influx(self, SMA_Values, poll_time):
-        '''Creates Point() objects from the measured values, and caches them into a small batch before writing to Influx.'''
+    def analyze_harmonics(self, samples):
+        """ Measures the harmonic content of each channel's current and of the AC voltage, and publishes it to plugins and the Influx write buffer. """
+        waveforms = {f'ct{chan_num}' : samples[f'ct{chan_num}'] for chan_num in self.enabled_channels}
+        waveforms['voltage'] = samples[f'v{self.enabled_channels[0]}']
+        sample_rate = len(waveforms['voltage']) / samples['duration']
+        harmonics = self.harmonic_analyzer.analyze(waveforms, sample_rate)
+        if harmonics is None:
+            return
+
+        self.latest_results['harmonics'] = harmonics
+        for source, figures in harmonics.items():
+            fields = {'thd' : figures['thd']}
+            for h, value in enumerate(figures['harmonics'], start=2):
+                fields[f'h{h}'] = value
+            self.points_buffer.add('harmonics', fields, samples['time'], (('source', source),))
+
+    def update_rollups(self, results, home_consumption_power, home_consumption_current, production_power, production_current, net_power, net_current, time):
+        """ Adds the figures of a capture to the rollups, and queues the points of any completed rollup intervals.
+
+        The rollup measurements use the same names as the continuous queries (home_load_5m, home_energy_5m, ct1_power_5m, ...), with each
+        interval's label as the suffix. Energy is in kWh, like the continuous queries' integral("power") / 3600000.
+        """
+        values = {f'ct{chan_num}' : {'power' : results[chan_num]['power'], 'current' : results[chan_num]['current']} for chan_num in self.enabled_channels}
+        values['home'] = {'power' : home_consumption_power, 'current' : home_consumption_current}
+        values['solar'] = {'power' : production_power, 'current' : production_current}
+        values['net'] = {'power' : net_power, 'current' : net_current}
+
+        for label, start, stats, energy in self.rollups.update(time, values):
+            rp_name = rollup_retention_policies[label]
+            for source, figures in stats.items():
+                fields = dict()
+                for figure, (mean, lo, hi) in figures.items():
+                    fields[figure] = mean
+                    fields[f'{figure}_min'] = lo
+                    fields[f'{figure}_max'] = hi
+                measurement = f'home_load_{label}' if source == 'home' else f'{source}_power_{label}'
+                self.rollup_points[rp_name].add(measurement, fields, start)
+            for source, kwh in energy.items():
+                self.rollup_points[rp_name].add(f'{source}_energy_{label}', {'energy' : kwh}, start)
+
+    def queue_decimated(self, start, summary):
+        """ Queues the points of a completed decimation interval. Each point holds the interval's mean values, plus <figure>_min and <figure>_max
+        (and <figure>_last, if include_last is set) fields.
 
-        # Create Points() for every measurement.
-        ct_points = []
+        Arguments:
+        start -- datetime, the time of the first capture in the interval, which is used as the points' timestamp.
+        summary -- dict, as returned by Decimator.add(), keyed by (section, [channel,] figure).
+        """
+        values = {'cts' : {chan_num : dict() for chan_num in self.enabled_channels}, 'production' : dict(), 'home-consumption' : dict(), 'net' : dict()}
+        extra_fields = {'cts' : {chan_num : dict() for chan_num in self.enabled_channels}, 'production' : dict(), 'home-consumption' : dict(), 'net' : dict(), 'voltage' : dict()}
+        for key, (mean, lo, hi, last) in summary.items():
+            figure = key[-1] if len(key) > 1 else 'voltage'
+            if key[0] == 'voltage':
+                values['voltage'] = mean
+                fields = extra_fields['voltage']
+            elif key[0] == 'cts':
+                values['cts'][key[1]][figure] = mean
+                fields = extra_fields['cts'][key[1]]
+            else:
+                values[key[0]][figure] = mean
+                fields = extra_fields[key[0]]
+            fields[f'{figure}_min'] = lo
+            fields[f'{figure}_max'] = hi
+            if self.decimation_last:
+                fields[f'{figure}_last'] = last
+
+        self.queue_for_influx(values, start, extra_fields)
+
+    def queue_for_influx(self, SMA_Values, poll_time, extra_fields=None):
+        '''Formats the measured values as line protocol, and caches them into a small batch before writing to Influx.
+
+        <extra_fields> optionally holds additional fields for each point (such as the min and max of a decimation interval), keyed like <SMA_Values>.
+
+        Measurements (every point is also tagged with the power monitor's name as 'id'):
+        home_load -- power, current
+        solar     -- power, current, pf
+        net       -- power, current. Tagged with status (Producing, Consuming, or No data).
+        voltages  -- voltage. Tagged with v_input, the identifier of the voltage input (always 0 for now).
+        raw_cts   -- power, current, pf. Tagged with ct, the channel number.
+        energy    -- import_wh, export_wh, the energy counters. Tagged with source [ct1, ..., home-consumption, production, net].
+        harmonics -- thd, h2, h3, ... (see analyze_harmonics()). Tagged with source [ct1, ..., voltage].
+        '''
+        if extra_fields is None:
+            extra_fields = {'cts' : dict()}
+        buffer = self.points_buffer
+
+        def fields(values, extra):
+            if extra:
+                values.update(extra)
+            return values
+
+        home_consumption = SMA_Values['home-consumption']
+        production = SMA_Values['production']
+        net = SMA_Values['net']
+        if net['power'] < 0:
+            status = 'Producing'
+        elif net['power'] > 0:
+            status = 'Consuming'
+        else:
+            status = 'No data'
+
+        buffer.add('home_load', fields({'current' : home_consumption['current'], 'power' : home_consumption['power']}, extra_fields.get('home-consumption')), poll_time)
+        buffer.add('solar', fields({'current' : production['current'], 'power' : production['power'], 'pf' : production['pf']}, extra_fields.get('production')), poll_time)
+        buffer.add('net', fields({'current' : net['current'], 'power' : net['power']}, extra_fields.get('net')), poll_time, (('status', status),))
+        buffer.add('voltages', fields({'voltage' : SMA_Values['voltage']}, extra_fields.get('voltage')), poll_time, (('v_input', 0),))
         for chan_num in self.enabled_channels:
             values = SMA_Values['cts'][chan_num]
-            ct_points.append(Point('ct', num=chan_num, power=values['power'], current=values['current'], pf=values['pf'], time=poll_time, name=self.name).to_dict())
-
-        home_load = Point('home_load', power=SMA_Values['home-consumption']['power'], current=SMA_Values['home-consumption']['current'], time=poll_time, name=self.name)
-        production = Point('solar', power=SMA_Values['production']['power'], current=SMA_Values['production']['current'], pf=SMA_Values['production']['pf'], time=poll_time, name=self.name)
-        net = Point('net', power=SMA_Values['net']['power'], current=SMA_Values['net']['current'], time=poll_time, name=self.name)
-        v = Point('voltage', voltage=SMA_Values['voltage'], v_input=0, time=poll_time, name=self.name)
-
-        points = [
-            home_load.to_dict(),
-            production.to_dict(),
-            net.to_dict(),
-            v.to_dict(),
-        ]
-        points += ct_points
-
-        self.points_buffer += points
-        batch_size = 25
-        if len(self.points_buffer) >= batch_size:
+            buffer.add('raw_cts', fields({'current' : values['current'], 'power' : values['power'], 'pf' : values['pf']}, extra_fields['cts'].get(chan_num)), poll_time, (('ct', chan_num),))
+
+        if self.energy:
+            for source, counters in self.energy.snapshot().items():
+                buffer.add('energy', {'import_wh' : counters['import'], 'export_wh' : counters['export']}, poll_time, (('source', source),))
+
+        if self.batch_policy.due(buffer):
             # Push buffer to DB
-            try:
-                self.client.write_points(self.points_buffer, time_precision='ms')
-            except InfluxDBServerError as e:
-                logger.critical(f"Failed to write data to Influx. Reason: {e}")
-            except ConnectionError:
-                logger.info("Connection to InfluxDB lost. Please investigate!")
-                self.cleanup()
-            
-            self.points_buffer = []
+            self.write_lines(buffer.getvalue())
+            buffer.clear()
+            for rp_name, rollup_points in self.rollup_points.items():
+                if len(rollup_points):
+                    self.write_lines(rollup_points.getvalue(), rp_name)
+                    rollup_points.clear()
+
+    def write_lines(self, data, retention_policy=None):
+        '''Writes a batch of line protocol to Influx, or hands it to the background writer if it's enabled.'''
+        if self.writer:
+            self.writer.submit(data, retention_policy)
+            return
+
+        start = timeit.default_timer()
+        try:
+            self.storage.write(data, retention_policy)
+            self.batch_policy.record(timeit.default_timer() - start, data.count('\n') + 1)
+        except RetryableWriteError as e:
+            logger.warning(f"Failed to write data to Influx, so the batch has been dropped. Is InfluxDB reachable? Reason: {e}")
+        except RejectedWriteError as e:
+            logger.warning(f"Influx rejected a batch of points, which has been dropped. Reason: {e}")
 
 
     def check_dup_process(self, *args, **kwargs):
@@ -1087,13 +1508,30 @@ class RPiPowerMonitor:
     def cleanup(self, *args, **kwargs):
         '''Performs necessary termination/shutdown procedures and exits the program.'''
         try:
-            if self.spi:
-                self.spi.close()
+            if self.acquisition:
+                self.acquisition.stop()
+                if self.acquisition.overruns:
+                    logger.info(f"The acquisition process overran the compute stage {self.acquisition.overruns} times.")
         except AttributeError:
             pass
         try:
-            if self.client:
-                self.client.close()
+            if self.energy:
+                self.energy.checkpoint()
+        except AttributeError:
+            pass
+        try:
+            for spi in self.spi_devices.values():
+                spi.close()
+        except AttributeError:
+            pass
+        try:
+            if self.writer:
+                self.writer.stop()
+        except AttributeError:
+            pass
+        try:
+            if self.storage:
+                self.storage.close()
         except AttributeError:
             pass
     
@@ -1124,31 +1562,15 @@ class RPiPowerMonitor:
 
 
     @staticmethod
-    def print_results(SMA_Values, sample_rate):
-        t = PrettyTable(['', 'ct1', 'ct2', 'ct3', 'ct4', 'ct5', 'ct6'])
-        t.add_row(['Watts',
-                   round(SMA_Values['cts'][1]['power'] if SMA_Values['cts'].get(1) else 0, 3),
-                   round(SMA_Values['cts'][2]['power'] if SMA_Values['cts'].get(2) else 0, 3),
-                   round(SMA_Values['cts'][3]['power'] if SMA_Values['cts'].get(3) else 0, 3),
-                   round(SMA_Values['cts'][4]['power'] if SMA_Values['cts'].get(4) else 0, 3),
-                   round(SMA_Values['cts'][5]['power'] if SMA_Values['cts'].get(5) else 0, 3),
-                   round(SMA_Values['cts'][6]['power'] if SMA_Values['cts'].get(6) else 0, 3)])
-        t.add_row(['Current',
-                   round(SMA_Values['cts'][1]['current'] if SMA_Values['cts'].get(1) else 0, 3),
-                   round(SMA_Values['cts'][2]['current'] if SMA_Values['cts'].get(2) else 0, 3),
-                   round(SMA_Values['cts'][3]['current'] if SMA_Values['cts'].get(3) else 0, 3),
-                   round(SMA_Values['cts'][4]['current'] if SMA_Values['cts'].get(4) else 0, 3),
-                   round(SMA_Values['cts'][5]['current'] if SMA_Values['cts'].get(5) else 0, 3),
-                   round(SMA_Values['cts'][6]['current'] if SMA_Values['cts'].get(6) else 0, 3)])
-        t.add_row(['P.F.',
-                   round(SMA_Values['cts'][1]['pf'] if SMA_Values['cts'].get(1) else 0, 3),
-                   round(SMA_Values['cts'][2]['pf'] if SMA_Values['cts'].get(2) else 0, 3),
-                   round(SMA_Values['cts'][3]['pf'] if SMA_Values['cts'].get(3) else 0, 3),
-                   round(SMA_Values['cts'][4]['pf'] if SMA_Values['cts'].get(4) else 0, 3),
-                   round(SMA_Values['cts'][5]['pf'] if SMA_Values['cts'].get(5) else 0, 3),
-                   round(SMA_Values['cts'][6]['pf'] if SMA_Values['cts'].get(6) else 0, 3)])
-        t.add_row(['Voltage', round(SMA_Values['voltage'], 3), '', '', '', '', ''])
-        t.add_row(['Sample Rate', sample_rate, 'kSPS', '', '', '', ''])
+    def print_results(SMA_Values, sample_rate, energy=None):
+        channels = range(1, max([6, *SMA_Values['cts'].keys()]) + 1)
+        blanks = [''] * (len(channels) - 1)
+        t = PrettyTable([''] + [f'ct{chan}' for chan in channels])
+        t.add_row(['Watts'] + [round(SMA_Values['cts'][chan]['power'] if SMA_Values['cts'].get(chan) else 0, 3) for chan in channels])
+        t.add_row(['Current'] + [round(SMA_Values['cts'][chan]['current'] if SMA_Values['cts'].get(chan) else 0, 3) for chan in channels])
+        t.add_row(['P.F.'] + [round(SMA_Values['cts'][chan]['pf'] if SMA_Values['cts'].get(chan) else 0, 3) for chan in channels])
+        t.add_row(['Voltage', round(SMA_Values['voltage'], 3)] + blanks)
+        t.add_row(['Sample Rate', sample_rate, 'kSPS'] + blanks[1:])
 
         summary_table = PrettyTable(['Summary Name', 'Watts', 'Amps', 'Power Factor'])
         summary_table.add_row(['Home Consumption', f"{round(SMA_Values['home-consumption']['power'], 3)} W", f"{round(SMA_Values['home-consumption']['current'], 3)} A", '--'])
@@ -1156,6 +1578,11 @@ class RPiPowerMonitor:
         summary_table.add_row(['Net', f"{round(SMA_Values['net']['power'], 3)} W", f"{round(SMA_Values['net']['current'], 3)} A", '--'])
         summary_string = summary_table.get_string()
         s = t.get_string()
+        if energy:
+            energy_table = PrettyTable(['Energy', 'Imported', 'Exported'])
+            for source, counters in energy.items():
+                energy_table.add_row([source, f"{round(counters['import'] / 1000, 3)} kWh", f"{round(counters['export'] / 1000, 3)} kWh"])
+            summary_string += f"\n{energy_table.get_string()}"
         logger.info(f"\n{s}\n{summary_string}")
 
     @staticmethod
@@ -1175,140 +1602,6 @@ class RPiPowerMonitor:
             s.close()
         return ip
 
-class Point:
-    def __init__(self, p_type, *args, **kwargs):
-
-        self.identifier = kwargs['name']    # Power Monitor Identifier, set in config.toml via 'name'
-
-        if p_type == 'home_load':
-            self.power = kwargs['power']
-            self.current = kwargs['current']
-            self.p_type = p_type
-            self.time = kwargs['time']
-        
-        elif p_type == 'solar':
-            self.power = kwargs['power']
-            self.current = kwargs['current']
-            self.pf = kwargs['pf']
-            self.p_type = p_type
-            self.time = kwargs['time']
-            
-        elif p_type == 'net': 
-            '''
-            This type represents the current net power situation at the time of sampling. 
-            self.power   : the real net power
-            self.current : the rms current as measured
-            self.p_type  : the type of point [home_load, solar, net, ct, voltage]
-            self.time    : timestamp from when the data was sampled
-            '''
-            self.power = kwargs['power']
-            self.current = kwargs['current']
-            self.p_type = p_type
-            self.time = kwargs['time']
-        
-        
-        elif p_type == 'ct':
-            '''
-            This type represents a CT reading.
-            self.power   : the real power as calculated in the calculate_power() function
-            self.current : the rms current as measured
-            self.p_type  : the type of point [home_load, solar, net, ct, voltage]
-            self.ct_num  : the CT number [0-6]
-            self.time    : timestamp from when the data was sampled
-            '''
-            self.power = kwargs['power']
-            self.current = kwargs['current']
-            self.p_type = p_type
-            self.pf = kwargs['pf']
-            self.ct_num = kwargs['num']
-            self.time = kwargs['time']
-
-        elif p_type == 'voltage':
-            '''
-            This type represents a voltage reading. 
-            The self.voltage is self explanatory.
-            The v_input represents the identifier of the voltage input. This is setting up for multiple voltage inputs in the future.
-            '''
-            self.voltage = kwargs['voltage']
-            self.v_input = kwargs['v_input']
-            self.time = kwargs['time']
-            self.p_type = p_type
-
-    def to_dict(self):
-        if self.p_type == 'home_load':
-            data = {
-                "measurement": 'home_load',
-                "fields": {
-                    "current": self.current,
-                    "power": self.power
-                },
-                "time": self.time
-            }
-        elif self.p_type == 'solar': 
-            data = {
-                "measurement": "solar",
-                "fields": {
-                    "current": self.current,
-                    "power": self.power,
-                    "pf": self.pf
-                },
-                "time": self.time
-            }
-        elif self.p_type == 'net':
-            if self.power < 0:
-                status = 'Producing'
-            elif self.power > 0:
-                status = 'Consuming'
-            else:
-                status = "No data"
-            data = {
-                "measurement": "net",
-                "fields": {
-                    "current": self.current,
-                    "power": self.power,
-                },
-                "tags": {
-                    "status": status,
-                },
-                "time": self.time
-            }
-
-        elif self.p_type == 'ct':
-            data = {
-                "measurement": "raw_cts",
-                "fields": {
-                    "current": self.current,
-                    "power": self.power,
-                    "pf": self.pf,
-                },
-                "tags": {
-                    "ct": self.ct_num
-                },
-                "time": self.time
-            }
-
-        elif self.p_type == 'voltage':
-            data = {
-                "measurement": "voltages",
-                "fields": {
-                    "voltage": self.voltage,
-                },
-                "tags": {
-                    "v_input": self.v_input
-                },
-                "time": self.time
-            }
-        else:
-            return
-        
-        # Set the identifier for the point.
-        if data.get('tags') is not None:
-            data['tags']['id'] = self.identifier
-        else:
-            data['tags'] = {'id' : self.identifier}
-
-        return data
-
 # Main Stop Event
 def halt(*args, **kwargs):
     if not halt_flag.is_set():
@@ -1341,7 +1634,12 @@ if __name__ == '__main__':
         logger.info("The --samples flag should only be used with '--mode plot'")
 
 
-    rpm = RPiPowerMonitor(mode=args.mode, config=args.config)
+    if args.simulate == 'synthetic':
+        logger.info("Using a simulated ADC with synthetic waveforms.")
+    elif args.simulate:
+        logger.info(f"Using a simulated ADC to replay {args.simulate}.")
+
+    rpm = RPiPowerMonitor(mode=args.mode, config=args.config, simulate=args.simulate)
 
     if args.mode == 'terminal':
         rpm.terminal_mode = True
@@ -1359,9 +1657,9 @@ if __name__ == '__main__':
         samples = rpm.collect_data(num_samples)
         duration = samples['duration']
         # Calculate Sample Rate in Kilo-Samples Per Second.
-        sample_count = sum([len(samples[x]) for x in samples.keys() if type(samples[x]) == list])
+        sample_count = num_samples * rpm.frame_reader.frame_size
         sample_rate = round((sample_count / duration) / 1000, 2)
-        per_channel_sample_rate = round(sample_rate / (2 * len(rpm.enabled_channels)), 2)
+        per_channel_sample_rate = round(sample_rate / rpm.frame_reader.frame_size, 2)
 
         if not args.title:
             now = datetime.now().strftime("%m-%d-%y_%H%M%S")
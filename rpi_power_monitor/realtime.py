@@ -0,0 +1,102 @@
+import ctypes
+import ctypes.util
+import gc
+import logging
+import os
+from contextlib import contextmanager
+from statistics import mean, pstdev
+from time import perf_counter_ns
+
+# This module is imported by power_monitor.py and provides the opt-in real-time mode for the process that samples the ADC.
+#
+# Sample timing suffers whenever another process (or the garbage collector) interrupts a capture. Real-time mode pins the sampling
+# process to a single core, moves it to the SCHED_FIFO scheduling class, and locks its memory so that it's never paged out. For best
+# results, keep other tasks off the chosen core by adding isolcpus=<core> to /boot/cmdline.txt.
+
+logger = logging.getLogger('power_monitor')
+
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+
+def apply_realtime(cpu=None, priority=50, lock_memory=True):
+    '''Applies real-time settings to the calling process. Each setting that can't be applied is logged and skipped.
+
+    Arguments:
+    cpu -- int, the CPU core to pin the process to. Defaults to the highest numbered core the process is allowed to run on.
+    priority -- int, the SCHED_FIFO priority (1-99).
+    lock_memory -- bool, True to lock all current and future memory pages with mlockall().
+
+    Returns a list of the settings that were applied.
+    '''
+    applied = []
+    allowed = os.sched_getaffinity(0)
+    if cpu is None:
+        cpu = max(allowed)
+    try:
+        os.sched_setaffinity(0, {cpu})
+        applied.append(f"pinned to CPU {cpu}")
+    except OSError as e:
+        logger.warning(f"Unable to pin the sampling process to CPU {cpu}: {e}")
+
+    if len(allowed) < 2:
+        # The sampler never sleeps, so on a single core it would starve everything else (including the power calculations) at FIFO priority.
+        logger.warning("SCHED_FIFO priority was not applied, because the power monitor can only run on a single CPU.")
+    else:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+            applied.append(f"SCHED_FIFO priority {priority}")
+        except (OSError, AttributeError) as e:
+            logger.warning(f"Unable to set SCHED_FIFO priority {priority} for the sampling process (the power monitor must run as root): {e}")
+
+    if lock_memory:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if libc.mlockall(MCL_CURRENT | MCL_FUTURE) == 0:
+            applied.append("memory locked")
+        else:
+            logger.warning(f"Unable to lock the sampling process's memory: {os.strerror(ctypes.get_errno())}")
+
+    return applied
+
+
+def release_cpu(cpu=None):
+    '''Removes <cpu> (by default, the highest numbered allowed core) from the calling process's CPU affinity, so that the core is left to
+    the sampling process. Nothing is changed if it's the only core the process can run on.
+    '''
+    allowed = os.sched_getaffinity(0)
+    if cpu is None:
+        cpu = max(allowed)
+    if allowed - {cpu}:
+        os.sched_setaffinity(0, allowed - {cpu})
+
+
+@contextmanager
+def gc_paused():
+    '''Disables the garbage collector for the duration of the block (if it was enabled), so that a collection can't interrupt a capture.'''
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def measure_jitter(read_block, count=200):
+    '''Times <count> calls of <read_block> and returns a dictionary with the mean, standard deviation, and maximum call time in microseconds.'''
+    durations = []
+    for _ in range(count):
+        start = perf_counter_ns()
+        read_block()
+        durations.append((perf_counter_ns() - start) / 1000)
+
+    return {
+        'mean' : mean(durations),
+        'stdev' : pstdev(durations),
+        'max' : max(durations),
+    }
+
+
+def format_jitter(jitter):
+    '''Returns a short, human readable summary of a measure_jitter() result.'''
+    return f"mean {round(jitter['mean'], 1)} us, stdev {round(jitter['stdev'], 1)} us, max {round(jitter['max'], 1)} us"
@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta
+from math import floor
+
+# This module is imported by power_monitor.py and maintains fixed-interval rollups (mean, min, max, and energy) of the calculated
+# figures, so that the power monitor can write downsampled data directly instead of relying on InfluxDB continuous queries.
+#
+# Each rollup interval (1s, 1m, 5m, ...) keeps one open bucket, aligned to the UTC clock like InfluxDB's GROUP BY time(). Every capture
+# updates the running count, sum, min, and max of each figure in the bucket, which is constant time no matter how long the interval is.
+# Energy is integrated with the trapezoid rule between consecutive captures. When a capture lands in the next bucket, the segment
+# between the two captures is split at the bucket boundary, and the open bucket is closed and returned so that it can be written.
+
+EPOCH = datetime(1970, 1, 1)    # The capture timestamps are naive UTC datetimes.
+UNITS = {'s' : 1, 'm' : 60, 'h' : 3600, 'd' : 86400}
+
+
+def parse_interval(label):
+    '''Converts an interval label such as '1s', '5m', or '1h' to seconds. Raises ValueError if the label is invalid.'''
+    try:
+        seconds = int(label[:-1]) * UNITS[label[-1]]
+    except (KeyError, IndexError):
+        raise ValueError(f"Invalid rollup interval {label!r}.")
+    if seconds < 1:
+        raise ValueError(f"Invalid rollup interval {label!r}.")
+    return seconds
+
+
+class Rollup:
+    '''The open bucket of a single rollup interval.
+
+    Arguments:
+    label -- str, the interval label (e.g. '5m').
+    seconds -- int, the interval length in seconds.
+    '''
+
+    def __init__(self, label, seconds):
+        self.label = label
+        self.seconds = seconds
+        self.start = None       # Start of the open bucket, in seconds since the epoch.
+        self.stats = dict()     # Source : {figure : [count, sum, min, max]}
+        self.energy = dict()    # Source : watt-seconds
+
+    def bucket(self, t):
+        '''Returns the start of the bucket that contains <t> (seconds since the epoch).'''
+        return floor(t / self.seconds) * self.seconds
+
+    def add(self, values):
+        for source, figures in values.items():
+            source_stats = self.stats.get(source)
+            if source_stats is None:
+                source_stats = self.stats[source] = dict()
+            for figure, value in figures.items():
+                stats = source_stats.get(figure)
+                if stats is None:
+                    source_stats[figure] = [1, value, value, value]
+                else:
+                    stats[0] += 1
+                    stats[1] += value
+                    if value < stats[2]:
+                        stats[2] = value
+                    elif value > stats[3]:
+                        stats[3] = value
+
+    def add_energy(self, powers, p_end, t0, t1):
+        '''Adds the energy of each source's linear power segment from <powers> (at t0) to <p_end> (at t1).'''
+        dt = t1 - t0
+        for source, p0 in powers.items():
+            p1 = p_end.get(source)
+            if p1 is not None:
+                self.energy[source] = self.energy.get(source, 0.0) + (p0 + p1) / 2 * dt
+
+    def close(self):
+        '''Returns the summary of the open bucket, and starts a new, empty one.
+
+        The summary is a tuple of (label, start time as a UTC datetime, {source : {figure : (mean, min, max)}}, {source : energy in kWh}).
+        '''
+        summary = (
+            self.label,
+            EPOCH + timedelta(seconds=self.start),
+            {source : {figure : (s / count, lo, hi) for figure, (count, s, lo, hi) in figures.items()} for source, figures in self.stats.items()},
+            {source : ws / 3600000 for source, ws in self.energy.items()},
+        )
+        self.stats = dict()
+        self.energy = dict()
+        return summary
+
+
+class Rollups:
+    '''Maintains the rollups of several intervals at once.
+
+    Arguments:
+    intervals -- list, interval labels such as ['1s', '1m', '5m', '1h'].
+    max_gap -- float, the longest gap (in seconds) between two captures that will be integrated into the energy figures.
+    '''
+
+    def __init__(self, intervals, max_gap=300):
+        self.rollups = [Rollup(label, parse_interval(label)) for label in intervals]
+        self.max_gap = max_gap
+        self._last = None   # (seconds since the epoch, {source : power}) of the previous update
+
+    def update(self, time, values):
+        '''Adds the figures of a capture to every rollup.
+
+        Arguments:
+        time -- datetime, the (naive UTC) time of the capture.
+        values -- dict, maps a source name to a dictionary of its figures. The 'power' figure (in watts) is also integrated into energy.
+
+        Returns a list of the summaries (see Rollup.close()) of the buckets that were completed by this capture.
+        '''
+        t = (time - EPOCH).total_seconds()
+        powers = {source : figures['power'] for source, figures in values.items() if 'power' in figures}
+        integrate = self._last is not None and 0 < t - self._last[0] <= self.max_gap
+
+        completed = []
+        for rollup in self.rollups:
+            bucket = rollup.bucket(t)
+            if rollup.start is None:
+                rollup.start = bucket
+
+            if bucket != rollup.start:
+                if integrate:
+                    # Split the segment at the end of the open bucket, interpolating each source's power at the boundary.
+                    t0, p0 = self._last
+                    boundary = min(rollup.start + rollup.seconds, t)
+                    if boundary > t0:
+                        fraction = (boundary - t0) / (t - t0)
+                        p_boundary = {source : p + (powers.get(source, p) - p) * fraction for source, p in p0.items()}
+                        rollup.add_energy(p0, p_boundary, t0, boundary)
+                        t0, p0 = boundary, p_boundary
+                if rollup.stats:
+                    completed.append(rollup.close())
+                rollup.start = bucket
+                if integrate:
+                    rollup.add_energy(p0, powers, t0, t)
+            elif integrate:
+                rollup.add_energy(self._last[1], powers, self._last[0], t)
+
+            rollup.add(values)
+
+        self._last = (t, powers)
+        return completed
@@ -0,0 +1,172 @@
+import csv
+import random
+from math import pi, sin
+from time import perf_counter
+
+from adc import ADC_CHANNELS, AC_VOLTAGE_CHANNEL, BOARD_VOLTAGE_CHANNEL
+
+# This module is imported by power_monitor.py and provides a stand-in for spidev.SpiDev, so that the power monitor can be run
+# and profiled on machines without the power monitor HAT (for example, an x86 build machine).
+#
+# SimulatedSpiDev answers MCP3008 conversion requests from xfer2() with either synthetic waveforms or waveforms replayed from a
+# CSV file written by RPiPowerMonitor.dump_data().
+
+
+class Waveform:
+    '''A synthetic ADC waveform.
+
+    Arguments:
+    amplitude -- float, peak amplitude of the fundamental, in ADC counts.
+    phase -- float, phase of the fundamental, in degrees.
+    harmonics -- dict, maps a harmonic number to a tuple of (amplitude relative to the fundamental, phase in degrees).
+    noise -- float, standard deviation of gaussian noise added to each reading, in ADC counts.
+    offset -- float, DC offset in ADC counts. The power monitor HAT biases its inputs to mid-scale.
+    '''
+
+    def __init__(self, amplitude=0, phase=0, harmonics=None, noise=0, offset=512):
+        self.amplitude = amplitude
+        self.phase = phase * pi / 180
+        self.harmonics = [(n, rel_amplitude * amplitude, h_phase * pi / 180) for n, (rel_amplitude, h_phase) in (harmonics or {}).items()]
+        self.noise = noise
+        self.offset = offset
+
+    def value(self, angle, rng):
+        '''Returns the waveform value when the fundamental is at <angle> radians.'''
+        value = self.offset + self.amplitude * sin(angle + self.phase)
+        for n, amplitude, phase in self.harmonics:
+            value += amplitude * sin(n * angle + phase)
+        if self.noise:
+            value += rng.gauss(0, self.noise)
+        return value
+
+
+def default_loads():
+    '''Returns a set of synthetic CT loads, keyed by PCB channel number, covering resistive, reactive, and non-linear loads.'''
+    return {
+        1 : Waveform(amplitude=220, phase=-5, noise=1),
+        2 : Waveform(amplitude=180, phase=175, noise=1),    # Exporting (production back-feeding the mains)
+        3 : Waveform(amplitude=90, phase=180, harmonics={3: (0.05, 0)}, noise=1),
+        4 : Waveform(amplitude=60, phase=-35, noise=1),     # Inductive load
+        5 : Waveform(amplitude=40, phase=-10, harmonics={3: (0.6, 30), 5: (0.35, 60), 7: (0.2, 90)}, noise=1),    # Switch mode power supply
+        6 : Waveform(amplitude=0, noise=1),                 # Idle circuit
+    }
+
+
+class SimulatedSpiDev:
+    '''Stand-in for spidev.SpiDev that answers MCP3008 conversion requests.
+
+    Arguments:
+    frequency -- float, the simulated line frequency in Hz.
+    voltage -- Waveform, the AC voltage waveform (ADC channel 5).
+    loads -- dict, maps PCB channel numbers to the Waveform of each CT. Channels without a load read as mid-scale.
+    board_voltage -- float, the voltage of the simulated +3.3V rail (ADC channel 4).
+    conversion_time -- float, seconds of simulated time that pass per conversion. If None, the wall clock is used instead, so
+                       that the simulated signal lines up with the capture durations measured by the power monitor.
+    replay_file -- str, optional path to a CSV written by dump_data(). When provided, each channel's readings are replayed
+                   (in a loop) from the file instead of being synthesized.
+    seed -- int, optional seed for the noise generator.
+    board -- int, the board number this device stands in for. Only the replayed channels that belong to this board are used.
+    '''
+
+    def __init__(self, frequency=60, voltage=None, loads=None, board_voltage=3.3, conversion_time=None, replay_file=None, seed=None, board=1):
+        self.max_speed_hz = 1750000
+        self.mode = 0
+        self.frequency = frequency
+        self.voltage = voltage or Waveform(amplitude=300, harmonics={3: (0.02, 0), 5: (0.01, 0)}, noise=1)
+        self.loads = {ADC_CHANNELS[pcb_chan] : waveform for pcb_chan, waveform in (default_loads() if loads is None else loads).items()}
+        self.board_reading = board_voltage / (3.31 * 2) * 1024
+        self.conversion_time = conversion_time
+        self.rng = random.Random(seed)
+        self.board = board
+        self.conversions = 0
+        self._start = perf_counter()
+
+        self.replay = None
+        if replay_file:
+            self.load_replay(replay_file)
+
+    def load_replay(self, replay_file):
+        '''Loads the per-channel readings from a CSV file written by dump_data().'''
+        with open(replay_file, 'r') as f:
+            rows = list(csv.DictReader(f))
+        if not rows:
+            raise ValueError(f"{replay_file} doesn't contain any samples.")
+
+        columns = {name : [round(float(row[name])) for row in rows] for name in rows[0].keys() if name != 'Sample#'}
+        cts, voltages = dict(), dict()
+        for name, readings in columns.items():
+            if name.startswith('ct'):
+                pcb_chan, channels = int(name[2:]), cts
+            elif name.startswith('v') and name[1:].isdigit():
+                pcb_chan, channels = int(name[1:]), voltages
+            else:
+                continue
+            # Channels 7-12 are on board 2, and so on.
+            if (pcb_chan - 1) // 6 + 1 == self.board:
+                channels[ADC_CHANNELS[(pcb_chan - 1) % 6 + 1]] = readings
+        self.replay = {'cts' : cts, 'voltages' : voltages}
+        if 'voltage' in columns:
+            self.replay['voltage'] = columns['voltage']
+        self._cursors = dict()
+        self._last_ct = None
+
+    def open(self, bus, device):
+        pass
+
+    def close(self):
+        pass
+
+    def xfer2(self, data):
+        '''Answers a 3 byte MCP3008 conversion request.'''
+        adc_num = (data[1] >> 4) - 8
+        if self.replay:
+            reading = self._replayed_reading(adc_num)
+        else:
+            reading = self._synthetic_reading(adc_num)
+
+        self.conversions += 1
+        reading = min(1023, max(0, int(reading)))
+        return [0, reading >> 8, reading & 0xFF]
+
+    xfer = xfer2
+
+    def _synthetic_reading(self, adc_num):
+        if self.conversion_time is None:
+            t = perf_counter() - self._start
+        else:
+            t = self.conversions * self.conversion_time
+        angle = 2 * pi * self.frequency * t
+
+        if adc_num == AC_VOLTAGE_CHANNEL:
+            return self.voltage.value(angle, self.rng)
+        if adc_num == BOARD_VOLTAGE_CHANNEL:
+            return self.board_reading
+        load = self.loads.get(adc_num)
+        if load is None:
+            return 512
+        return load.value(angle, self.rng)
+
+    def _replayed_reading(self, adc_num):
+        if adc_num == BOARD_VOLTAGE_CHANNEL:
+            return self.board_reading
+
+        if adc_num == AC_VOLTAGE_CHANNEL:
+            # Each CT has its own recorded voltage wave. Replay the one that belongs to the CT that was just read, if there is one.
+            if 'voltage' in self.replay:
+                key, readings = 'voltage', self.replay['voltage']
+            else:
+                voltages = self.replay['voltages']
+                if not voltages:
+                    return 512
+                adc_chan = self._last_ct if self._last_ct in voltages else next(iter(voltages))
+                key, readings = ('v', adc_chan), voltages[adc_chan]
+        else:
+            readings = self.replay['cts'].get(adc_num)
+            if readings is None:
+                return 512
+            key = ('ct', adc_num)
+            self._last_ct = adc_num
+
+        cursor = self._cursors.get(key, 0)
+        self._cursors[key] = cursor + 1
+        return readings[cursor % len(readings)]
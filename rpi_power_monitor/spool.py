@@ -0,0 +1,114 @@
+import logging
+import os
+import sqlite3
+from time import time
+
+# This module is imported by writer.py and stores batches of line protocol on disk while InfluxDB is unreachable, so that they can be
+# written once it's back.
+#
+# The spool is a SQLite database in WAL mode. Each batch is appended as a row in its own transaction, so a crash or power loss can lose
+# at most the batch being appended, and can't corrupt the batches that are already stored. Batches are read back oldest first, and are
+# only deleted once they've been written to InfluxDB. When the stored batches exceed <max_bytes>, the oldest are deleted to make room.
+
+logger = logging.getLogger('power_monitor')
+
+
+class Spool:
+    '''A crash-safe, size-capped FIFO of line protocol batches.
+
+    The SQLite connection is bound to the thread that calls open(), so all other methods must be called from that thread as well.
+
+    Arguments:
+    path -- str, the spool database file.
+    max_bytes -- int, the most line protocol (in bytes) that will be kept. The oldest batches are deleted beyond that.
+    '''
+
+    def __init__(self, path, max_bytes=100 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.db = None
+        self.batches = 0        # Number of stored batches.
+        self.bytes = 0          # Size of the stored line protocol.
+        self.dropped = 0        # Batches deleted because the spool was full.
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(self.path, isolation_level=None)
+        self.db.execute('PRAGMA auto_vacuum = INCREMENTAL')     # Only takes effect when the file is created.
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS batches (id INTEGER PRIMARY KEY AUTOINCREMENT, retention_policy TEXT, data TEXT NOT NULL, created REAL NOT NULL)')
+        self.batches, self.bytes = self.db.execute('SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM batches').fetchone()
+        if self.batches:
+            logger.info(f"Found {self.batches} batches ({round(self.bytes / 1024)} kB) in the Influx spool. They will be written once InfluxDB is reachable.")
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def append(self, data, retention_policy=None):
+        '''Stores a batch, deleting the oldest batches if the spool is full.'''
+        self.db.execute('INSERT INTO batches (retention_policy, data, created) VALUES (?, ?, ?)', (retention_policy, data, time()))
+        self.batches += 1
+        self.bytes += len(data)
+
+        if self.bytes > self.max_bytes:
+            dropped = 0
+            while self.bytes > self.max_bytes and self.batches > 1:
+                row_id, size = self.db.execute('SELECT id, LENGTH(data) FROM batches ORDER BY id LIMIT 1').fetchone()
+                self.db.execute('DELETE FROM batches WHERE id = ?', (row_id,))
+                self.batches -= 1
+                self.bytes -= size
+                dropped += 1
+            if self.dropped == 0 or self.dropped // 100 != (self.dropped + dropped) // 100:
+                logger.warning(f"The Influx spool is full ({round(self.max_bytes / 1048576)} MB), so the oldest batches are being deleted ({self.dropped + dropped} so far).")
+            self.dropped += dropped
+            self.db.execute('PRAGMA incremental_vacuum')
+
+    def read(self, max_bytes):
+        '''Returns the oldest stored batches, up to about <max_bytes> of line protocol (at least one batch, if there are any).
+
+        Returns a list of (id, retention policy, data) tuples.
+        '''
+        rows = []
+        total = 0
+        for row in self.db.execute('SELECT id, retention_policy, data FROM batches ORDER BY id'):
+            if rows and total + len(row[2]) > max_bytes:
+                break
+            rows.append(row)
+            total += len(row[2])
+        return rows
+
+    def delete(self, ids):
+        '''Deletes batches that have been written.
+
+        Raises sqlite3.Error if the batches couldn't be deleted, in which case none of them are.
+        '''
+        batches = 0
+        size = 0
+        self.db.execute('BEGIN')
+        try:
+            for row_id in ids:
+                row = self.db.execute('SELECT LENGTH(data) FROM batches WHERE id = ?', (row_id,)).fetchone()
+                if row is not None:
+                    self.db.execute('DELETE FROM batches WHERE id = ?', (row_id,))
+                    batches += 1
+                    size += row[0]
+            self.db.execute('COMMIT')
+        except sqlite3.Error:
+            if self.db.in_transaction:
+                self.db.rollback()
+            raise
+        self.batches -= batches
+        self.bytes -= size
+
+        if not self.batches:
+            # The backlog has been written - give the disk space back. The batches are already deleted, so this can fail harmlessly.
+            try:
+                self.db.execute('PRAGMA incremental_vacuum')
+                self.db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            except sqlite3.Error as e:
+                logger.debug(f"Unable to shrink the Influx spool: {e}")
@@ -0,0 +1,278 @@
+import gzip
+import http.client
+import json
+import logging
+import queue
+import ssl
+from base64 import b64encode
+from urllib.parse import urlencode
+
+from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
+
+# This module is imported by power_monitor.py and provides the storage backends that points are written to.
+#
+# A backend accepts batches of line protocol (with millisecond timestamps) through write(), and raises RetryableWriteError when the
+# database is unreachable or failing (so the batch should be written later, see writer.py), or RejectedWriteError when the database
+# refuses the batch. Backends that manage their own schema also provide the retention policy and continuous query methods that
+# RPiPowerMonitor.validate_rps() and validate_cqs() use, which follow the influxdb client's method names and return values.
+#
+# 'influxdb' uses the influxdb (1.x) client package. 'http' sends line protocol directly over a small pool of persistent (keep-alive)
+# HTTP connections, to either the 1.x /write endpoint or the 2.x /api/v2/write endpoint (which InfluxDB 1.8 also provides). 'local' keeps
+# the points on the Pi, in SQLite files (see local_store.py).
+
+logger = logging.getLogger('power_monitor')
+
+BACKENDS = ('influxdb', 'http', 'local')
+GZIP_LEVEL = 5
+
+
+class RetryableWriteError(Exception):
+    '''The database is unreachable or failing. The batch wasn't written, and should be written again later.'''
+
+
+class RejectedWriteError(Exception):
+    '''The database refused the batch (e.g. invalid line protocol, or a field type conflict). Writing it again won't help.'''
+
+
+class StorageBackend:
+    '''The interface of a storage backend.
+
+    Backends that set manages_schema to True must also implement get_list_retention_policies(), create_retention_policy(),
+    get_list_continuous_queries(), and create_continuous_query() like the influxdb client.
+    '''
+
+    manages_schema = False
+
+    def connect(self):
+        '''Checks that the database is reachable (creating it if needed). Raises an exception if it isn't.'''
+
+    def write(self, data, retention_policy=None):
+        '''Writes a batch of line protocol with millisecond timestamps. Raises RetryableWriteError or RejectedWriteError on failure.'''
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class InfluxClientBackend(StorageBackend):
+    '''Writes to InfluxDB 1.x with the influxdb client package.
+
+    Arguments:
+    host, port, username, password, database -- the [database] settings.
+    compress -- bool, True to gzip the request bodies of writes.
+    '''
+
+    manages_schema = True
+
+    def __init__(self, host, port, username, password, database, compress=False):
+        self.database = database
+        self.compress = compress
+        self.client = InfluxDBClient(host=host, port=port, username=username, password=password, database=database, timeout=7, retries=2)
+
+    def connect(self):
+        self.client.create_database(self.database)
+
+    def write(self, data, retention_policy=None):
+        try:
+            if not self.compress:
+                self.client.write_points(data, time_precision='ms', retention_policy=retention_policy, protocol='line')
+                return
+
+            # The influxdb client doesn't compress write requests itself, so compressed batches are sent with client.request().
+            params = {'db' : self.database, 'precision' : 'ms'}
+            if retention_policy is not None:
+                params['rp'] = retention_policy
+            headers = {'Content-Type' : 'application/octet-stream', 'Accept' : 'text/plain', 'Content-Encoding' : 'gzip'}
+            self.client.request(url='write', method='POST', params=params, data=gzip.compress(f'{data}\n'.encode('utf-8'), GZIP_LEVEL), expected_response_code=204, headers=headers)
+        except InfluxDBServerError as e:
+            raise RetryableWriteError(e) from e
+        except InfluxDBClientError as e:
+            raise RejectedWriteError(e) from e
+        except OSError as e:   # Includes connection errors and timeouts.
+            raise RetryableWriteError(e) from e
+
+    def get_list_retention_policies(self):
+        return self.client.get_list_retention_policies()
+
+    def create_retention_policy(self, name, duration, replication, default=False):
+        self.client.create_retention_policy(name, duration, replication, default=default)
+
+    def get_list_continuous_queries(self):
+        return self.client.get_list_continuous_queries()
+
+    def create_continuous_query(self, name, select):
+        self.client.create_continuous_query(name, select)
+
+    def close(self):
+        self.client.close()
+
+
+class HttpLineProtocolBackend(StorageBackend):
+    '''Writes line protocol over persistent HTTP connections.
+
+    Arguments:
+    host, port -- str and int, the InfluxDB server.
+    database -- str, the database (1.x), or the bucket (2.x).
+    api -- str, 'v1' to write to /write (InfluxDB 1.x), or 'v2' to write to /api/v2/write (InfluxDB 2.x, or 1.8+).
+    username, password -- str, the 1.x credentials (sent with HTTP basic authentication). Leave empty if authentication is disabled.
+    token -- str, the 2.x API token. For InfluxDB 1.8's 2.x endpoint, use 'username:password'.
+    org -- str, the 2.x organization.
+    ssl -- bool, True to use HTTPS.
+    compress -- bool, True to gzip the request bodies.
+    pool_size -- int, the most idle connections that are kept open.
+    timeout -- float, the socket timeout in seconds.
+
+    With the 2.x API, retention policies are written to the bucket named <database>/<retention policy>, like InfluxDB 1.8's DBRP
+    naming. The database's schema (buckets, retention, and tasks) isn't managed by the power monitor.
+    '''
+
+    def __init__(self, host, port, database, api='v1', username=None, password=None, token=None, org=None, ssl=False, compress=False, pool_size=2, timeout=7):
+        if api not in ('v1', 'v2'):
+            raise ValueError(f"Unknown InfluxDB API version {api!r}. Choose v1 or v2.")
+        self.host = host
+        self.port = port
+        self.database = database
+        self.api = api
+        self.org = org
+        self.ssl = ssl
+        self.compress = compress
+        self.timeout = timeout
+        self.manages_schema = api == 'v1'
+        self.pool = queue.LifoQueue(maxsize=pool_size)  # Idle connections. The most recently used one is reused first.
+
+        self.headers = {'Content-Type' : 'text/plain; charset=utf-8', 'Connection' : 'keep-alive'}
+        if compress:
+            self.headers['Content-Encoding'] = 'gzip'
+        if api == 'v2' and token:
+            self.headers['Authorization'] = f'Token {token}'
+        elif username:
+            self.headers['Authorization'] = 'Basic ' + b64encode(f'{username}:{password or ""}'.encode('utf-8')).decode('ascii')
+
+    def new_connection(self):
+        if self.ssl:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=ssl.create_default_context())
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, params, body=None, headers=None):
+        '''Sends a request on a pooled connection, and returns a tuple of (status, response body).
+
+        A request that fails on a reused connection (which the server may have closed while it was idle) is sent once more on a new one.
+        Raises OSError (or http.client.HTTPException) if the server can't be reached.
+        '''
+        url = f'{path}?{urlencode(params)}'
+        headers = headers or self.headers
+        for attempt in range(2):
+            try:
+                connection = self.pool.get_nowait()
+                reused = True
+            except queue.Empty:
+                connection = self.new_connection()
+                reused = False
+
+            try:
+                connection.request(method, url, body=body, headers=headers)
+                response = connection.getresponse()
+                content = response.read()
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                try:
+                    self.pool.put_nowait(connection)
+                except queue.Full:
+                    connection.close()
+            return response.status, content
+
+    def write(self, data, retention_policy=None):
+        body = f'{data}\n'.encode('utf-8')
+        if self.compress:
+            body = gzip.compress(body, GZIP_LEVEL)
+
+        if self.api == 'v2':
+            bucket = f'{self.database}/{retention_policy}' if retention_policy else self.database
+            path, params = '/api/v2/write', {'bucket' : bucket, 'precision' : 'ms'}
+            if self.org:
+                params['org'] = self.org
+        else:
+            path, params = '/write', {'db' : self.database, 'precision' : 'ms'}
+            if retention_policy:
+                params['rp'] = retention_policy
+
+        try:
+            status, content = self.request('POST', path, params, body)
+        except (OSError, http.client.HTTPException) as e:
+            raise RetryableWriteError(e) from e
+        if status == 204:
+            return
+        message = f"HTTP {status}: {content.decode('utf-8', 'replace').strip()}"
+        if status >= 500 or status in (408, 429):
+            raise RetryableWriteError(message)
+        raise RejectedWriteError(message)
+
+    def query(self, q):
+        '''Runs an InfluxQL statement on the 1.x /query endpoint, and returns its first result.'''
+        headers = {key : value for key, value in self.headers.items() if key in ('Authorization', 'Connection')}
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        status, content = self.request('POST', '/query', {'db' : self.database}, urlencode({'q' : q}).encode('utf-8'), headers)
+        if status != 200:
+            raise RuntimeError(f"HTTP {status}: {content.decode('utf-8', 'replace').strip()}")
+        result = json.loads(content)['results'][0]
+        if 'error' in result:
+            raise RuntimeError(result['error'])
+        return result
+
+    def connect(self):
+        status, content = self.request('GET', '/ping', {})
+        if status != 204:
+            raise RuntimeError(f"Unexpected response to /ping (HTTP {status}).")
+        if self.api == 'v1':
+            self.query(f'CREATE DATABASE "{self.database}"')
+
+    def get_list_retention_policies(self):
+        series = self.query(f'SHOW RETENTION POLICIES ON "{self.database}"').get('series', [])
+        return [dict(zip(s['columns'], values)) for s in series for values in s.get('values', [])]
+
+    def create_retention_policy(self, name, duration, replication, default=False):
+        self.query(f'CREATE RETENTION POLICY "{name}" ON "{self.database}" DURATION {duration} REPLICATION {replication}' + (' DEFAULT' if default else ''))
+
+    def get_list_continuous_queries(self):
+        series = self.query('SHOW CONTINUOUS QUERIES').get('series', [])
+        return [{s['name'] : [dict(zip(s['columns'], values)) for values in s.get('values', [])]} for s in series]
+
+    def create_continuous_query(self, name, select):
+        self.query(f'CREATE CONTINUOUS QUERY "{name}" ON "{self.database}" BEGIN {select} END')
+
+    def close(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def create_backend(settings, compress=False):
+    '''Creates the storage backend that's selected by the [database] <settings>, other than 'local' (which is created from the [local_store] settings).'''
+    backend = settings.get('backend', 'influxdb')
+    if backend == 'http':
+        return HttpLineProtocolBackend(
+            host=settings['host'],
+            port=settings['port'],
+            database=settings.get('database_name', settings.get('bucket')),
+            api=settings.get('api', 'v1'),
+            username=settings.get('username'),
+            password=settings.get('password'),
+            token=settings.get('token'),
+            org=settings.get('org'),
+            ssl=settings.get('ssl', False),
+            compress=compress,
+            pool_size=int(settings.get('pool_size', 2)),
+        )
+    if backend == 'influxdb':
+        return InfluxClientBackend(settings['host'], settings['port'], settings['username'], settings['password'], settings['database_name'], compress)
+    raise ValueError(f"Unknown storage backend {backend!r}. Choose one of {', '.join(BACKENDS)}.")
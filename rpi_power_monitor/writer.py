@@ -0,0 +1,272 @@
+import logging
+import sqlite3
+import threading
+from collections import deque
+from time import perf_counter, monotonic
+
+from storage import RejectedWriteError, RetryableWriteError
+
+# This module is imported by power_monitor.py and writes batches of line protocol to InfluxDB from a background thread, so that a slow
+# or unreachable database never blocks the sampling loop.
+#
+# Batches are queued with submit(), which never waits. The queue holds at most <max_queue> batches. When it's full, the 'drop_oldest'
+# policy discards the oldest batch to make room, and the 'coalesce' policy appends the new batch to the newest queued batch with the same
+# retention policy (so that nothing is lost, and the backlog is sent with fewer requests once the database catches up), falling back to
+# dropping the oldest batch once a coalesced batch reaches <max_coalesce_bytes>.
+#
+# With a spool (see spool.py), batches that can't be written because the database is unreachable or failing are stored on disk instead
+# of being dropped. While the database is down, new batches go straight to the spool, and a write of the oldest spooled batches is
+# retried every <retry_interval> seconds. Once one succeeds, the backlog is replayed in large batches, at most <replay_rate> per second,
+# alongside the new batches. Batches that the database rejects as invalid (client errors) are dropped, since retrying can't help.
+#
+# The batches are written with a storage backend (see storage.py), which may gzip compress the request bodies. Line protocol compresses
+# very well (mostly repeated series keys and digits), which saves airtime on remote databases.
+
+logger = logging.getLogger('power_monitor')
+
+POLICIES = ('drop_oldest', 'coalesce')
+
+# Results of a write attempt.
+WRITTEN = 'written'
+RETRY = 'retry'         # The database is unreachable or failing - the batch should be written later.
+REJECTED = 'rejected'   # The database refused the batch.
+
+
+class InfluxWriter:
+    '''Writes batches of line protocol with <storage> from a background thread.
+
+    Arguments:
+    storage -- StorageBackend.
+    max_queue -- int, the maximum number of queued batches.
+    policy -- str, what to do when the queue is full: 'drop_oldest' or 'coalesce'.
+    max_coalesce_bytes -- int, the largest batch that 'coalesce' will build before it drops the oldest batch instead.
+    latency_window -- int, the number of recent writes that the latency figures cover.
+    spool -- Spool, stores the batches that can't be written while the database is unreachable. None to drop them instead.
+    retry_interval -- float, seconds between attempts to reach the database while it's down.
+    replay_rate -- float, the maximum number of spooled batches replayed per second.
+    replay_bytes -- int, roughly how much spooled line protocol is combined into each replayed batch.
+    batch_policy -- AdaptiveBatchPolicy, which is told the latency of each successful write.
+    '''
+
+    def __init__(self, storage, max_queue=20, policy='drop_oldest', max_coalesce_bytes=1048576, latency_window=100, spool=None, retry_interval=30, replay_rate=2, replay_bytes=524288, batch_policy=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown write queue policy {policy!r}. Choose one of {', '.join(POLICIES)}.")
+        self.storage = storage
+        self.max_queue = max_queue
+        self.policy = policy
+        self.max_coalesce_bytes = max_coalesce_bytes
+        self.spool = spool
+        self.retry_interval = retry_interval
+        self.replay_interval = 1 / replay_rate
+        self.replay_bytes = replay_bytes
+        self.batch_policy = batch_policy
+        self.queue = deque()    # [data, retention_policy] batches, oldest first.
+        self.condition = threading.Condition()
+        self.latencies = deque(maxlen=latency_window)   # Seconds taken by each recent write.
+        self.written = 0        # Batches written.
+        self.failed = 0         # Batches that the database rejected, or that couldn't be sent.
+        self.dropped = 0        # Batches discarded because the queue was full.
+        self.coalesced = 0      # Batches appended to a queued batch because the queue was full.
+        self.spooled = 0        # Batches stored in the spool.
+        self.replayed = 0       # Spooled batches that have been written.
+        self.online = True      # False while the database is unreachable.
+        self._next_replay = 0
+        self._stopping = False
+        self._reported_dead = False
+        self._thread = threading.Thread(target=self.run, name='influx-writer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    def submit(self, data, retention_policy=None):
+        '''Queues a batch of line protocol for writing. Never blocks.'''
+        if not self.alive and self._thread.ident is not None and not self._stopping and not self._reported_dead:
+            self._reported_dead = True
+            logger.error("The Influx writer thread has stopped, so points are no longer being written. Please restart the power monitor.")
+        with self.condition:
+            if len(self.queue) >= self.max_queue:
+                if self.policy == 'coalesce':
+                    for batch in reversed(self.queue):
+                        if batch[1] == retention_policy and len(batch[0]) + len(data) < self.max_coalesce_bytes:
+                            batch[0] = f'{batch[0]}\n{data}'
+                            self.coalesced += 1
+                            return
+                self.queue.popleft()
+                self.dropped += 1
+                if self.dropped == 1 or self.dropped % 100 == 0:
+                    logger.warning(f"The Influx write queue is full. {self.dropped} batches have been dropped so far.")
+            self.queue.append([data, retention_policy])
+            self.condition.notify()
+
+    def run(self):
+        if self.spool:
+            try:
+                self.spool.open()
+            except Exception as e:
+                logger.warning(f"Unable to open the Influx spool at {self.spool.path} ({e}). Batches that can't be written will be dropped.")
+                self.spool = None
+
+        while True:
+            with self.condition:
+                while not self.queue and not self._stopping:
+                    if self.spool and self.spool.batches:
+                        timeout = self._next_replay - monotonic()
+                        if timeout <= 0:
+                            break
+                        self.condition.wait(timeout)
+                    else:
+                        self.condition.wait()
+                if not self.queue and self._stopping:
+                    break
+                batch = self.queue.popleft() if self.queue else None
+
+            try:
+                if batch is not None:
+                    self.handle(*batch)
+                if self.spool and self.spool.batches and monotonic() >= self._next_replay:
+                    self.replay()
+            except Exception:
+                # An unexpected error (e.g. a bug in a backend) mustn't stop the thread, or every later batch would be dropped.
+                logger.exception("Unexpected error in the Influx writer.")
+                if batch is not None:
+                    self.failed += 1
+                self._next_replay = monotonic() + self.retry_interval
+
+        if self.spool:
+            self.spool.close()
+
+    def handle(self, data, retention_policy):
+        '''Writes a new batch, or spools it if the database is down.'''
+        if self.spool and not self.online:
+            self.store(data, retention_policy)
+            return
+
+        if self.write(data, retention_policy) == RETRY:
+            if self.spool:
+                self.store(data, retention_policy)
+            self.go_offline()
+
+    def replay(self):
+        '''Writes the oldest spooled batches (combined by retention policy), and deletes them from the spool once they're written.'''
+        try:
+            rows = self.spool.read(self.replay_bytes)
+        except sqlite3.Error as e:
+            self.spool_failed(f"Unable to read the spooled batches ({e}).")
+            return
+        written_ids = []
+        for retention_policy in dict.fromkeys(row[1] for row in rows):
+            batch_rows = [row for row in rows if row[1] == retention_policy]
+            result = self.write('\n'.join(row[2] for row in batch_rows), retention_policy)
+            if result == RETRY:
+                break
+            # Written, or rejected as invalid (which won't change on a retry).
+            written_ids += [row[0] for row in batch_rows]
+            if result == WRITTEN:
+                self.replayed += len(batch_rows)
+        else:
+            if not self.delete_spooled(written_ids):
+                return
+            if not self.online:
+                self.online = True
+                logger.info(f"The connection to InfluxDB has been restored. Replaying {self.spool.batches} spooled batches.")
+            elif not self.spool.batches:
+                logger.info("Finished replaying the spooled batches.")
+            self._next_replay = monotonic() + self.replay_interval
+            return
+
+        self.delete_spooled(written_ids)
+        self.go_offline()
+
+    def delete_spooled(self, ids):
+        '''Deletes replayed batches from the spool. Returns False if the spool failed.'''
+        try:
+            self.spool.delete(ids)
+            return True
+        except sqlite3.Error as e:
+            self.spool_failed(f"Unable to delete {len(ids)} replayed batches from the spool ({e}). They will be written again.")
+            return False
+
+    def spool_failed(self, message):
+        '''Logs a spool error, and retries the replay after <retry_interval>, like a failed write.'''
+        logger.warning(f"{message} Retrying in {self.retry_interval} seconds.")
+        self._next_replay = monotonic() + self.retry_interval
+
+    def store(self, data, retention_policy):
+        try:
+            self.spool.append(data, retention_policy)
+            self.spooled += 1
+        except Exception as e:
+            self.failed += 1
+            logger.warning(f"Unable to store a batch in the Influx spool: {e}")
+
+    def go_offline(self):
+        if self.online:
+            self.online = False
+            if self.spool:
+                logger.warning("Lost the connection to InfluxDB. Points will be stored in the spool, and written once InfluxDB is back.")
+            else:
+                logger.warning("Lost the connection to InfluxDB. Points will be dropped until it's back.")
+        self._next_replay = monotonic() + self.retry_interval
+
+    def write(self, data, retention_policy):
+        '''Writes a batch. Returns WRITTEN, RETRY (the database is unreachable or failing), or REJECTED.'''
+        start = perf_counter()
+        try:
+            self.storage.write(data, retention_policy)
+        except RetryableWriteError as e:
+            self.failed += 1
+            logger.debug(f"Failed to write data to Influx. Reason: {e}")
+            return RETRY
+        except RejectedWriteError as e:
+            self.failed += 1
+            logger.warning(f"Influx rejected a batch of points, which has been dropped. Reason: {e}")
+            return REJECTED
+        finally:
+            latency = perf_counter() - start
+            self.latencies.append(latency)
+
+        self.written += 1
+        if self.batch_policy:
+            self.batch_policy.record(latency, data.count('\n') + 1)
+        if not self.online and not self.spool:
+            self.online = True
+            logger.info("The connection to InfluxDB has been restored.")
+        return WRITTEN
+
+    def stop(self, timeout=10):
+        '''Writes the batches that are still queued (for up to <timeout> seconds), and stops the thread.'''
+        with self.condition:
+            self._stopping = True
+            self.condition.notify()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        if self.queue:
+            logger.warning(f"{len(self.queue)} batches of points were still queued for Influx at shutdown, and have been discarded.")
+
+    def snapshot(self):
+        '''Returns a dictionary of whether the writer thread is alive, its queue depth, counters, backlog, and write latency (in milliseconds) over the recent writes.'''
+        latencies = list(self.latencies)
+        return {
+            'alive' : self.alive,
+            'online' : self.online,
+            'queue_depth' : len(self.queue),
+            'max_queue' : self.max_queue,
+            'written' : self.written,
+            'failed' : self.failed,
+            'dropped' : self.dropped,
+            'coalesced' : self.coalesced,
+            'spooled' : self.spooled,
+            'replayed' : self.replayed,
+            'spool_batches' : self.spool.batches if self.spool else 0,
+            'spool_bytes' : self.spool.bytes if self.spool else 0,
+            'spool_dropped' : self.spool.dropped if self.spool else 0,
+            'batch_points' : self.batch_policy.points if self.batch_policy else None,
+            'last_latency_ms' : latencies[-1] * 1000 if latencies else None,
+            'mean_latency_ms' : sum(latencies) / len(latencies) * 1000 if latencies else None,
+            'max_latency_ms' : max(latencies) * 1000 if latencies else None,
+        }
+
@@ -0,0 +1,162 @@
+import gzip
+import json
+import os
+import sys
+import threading
+import unittest
+from base64 import b64encode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'rpi_power_monitor'))
+
+from storage import HttpLineProtocolBackend, RejectedWriteError, RetryableWriteError
+
+# Tests HttpLineProtocolBackend against a stub InfluxDB server, built on http.server.
+
+
+class StubInflux(BaseHTTPRequestHandler):
+    '''Records every request, and answers with the status in <server.status>.'''
+
+    protocol_version = 'HTTP/1.1'   # Keep-alive, like InfluxDB.
+
+    def do_GET(self):
+        self.record(b'')
+        self.respond(204)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        self.record(body)
+        if self.path.startswith('/query'):
+            statement = parse_qs(body.decode())['q'][0]
+            result = {'statement_id' : 0}
+            if statement.startswith('SHOW RETENTION POLICIES'):
+                result['series'] = [{'columns' : ['name', 'duration', 'shardGroupDuration', 'replicaN', 'default'], 'values' : [['autogen', '0s', '168h0m0s', 1, True]]}]
+            self.respond(200, json.dumps({'results' : [result]}).encode())
+        else:
+            self.respond(self.server.status, b'' if self.server.status == 204 else b'{"error":"stub error"}')
+
+    def record(self, body):
+        url = urlsplit(self.path)
+        self.server.requests.append({
+            'method' : self.command,
+            'path' : url.path,
+            'params' : {key : values[0] for key, values in parse_qs(url.query).items()},
+            'headers' : dict(self.headers),
+            'body' : body.decode(),
+            'port' : self.client_address[1],
+        })
+
+    def respond(self, status, body=b''):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.server.drop_connections:
+            # Close the connection without telling the client, like a server that times out an idle keep-alive connection.
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpLineProtocolBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubInflux)
+        self.server.daemon_threads = True
+        self.server.requests = []
+        self.server.status = 204
+        self.server.drop_connections = False
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.port = self.server.server_address[1]
+        self.backends = []
+
+    def tearDown(self):
+        for backend in self.backends:
+            backend.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def backend(self, **kwargs):
+        backend = HttpLineProtocolBackend('127.0.0.1', self.port, 'power_monitor', **kwargs)
+        self.backends.append(backend)
+        return backend
+
+    def writes(self):
+        return [request for request in self.server.requests if request['method'] == 'POST' and not request['path'].startswith('/query')]
+
+    def test_v1_write(self):
+        backend = self.backend(username='user', password='pass')
+        backend.write('home_load,id=pm power=1.0 1000')
+        backend.write('home_load_5m,id=pm power=2.0 1000', 'rp_5min')
+
+        first, second = self.writes()
+        self.assertEqual(first['path'], '/write')
+        self.assertEqual(first['params'], {'db' : 'power_monitor', 'precision' : 'ms'})
+        self.assertEqual(second['params'], {'db' : 'power_monitor', 'precision' : 'ms', 'rp' : 'rp_5min'})
+        self.assertEqual(first['headers']['Authorization'], 'Basic ' + b64encode(b'user:pass').decode())
+        self.assertEqual(first['body'], 'home_load,id=pm power=1.0 1000\n')
+
+    def test_v2_write(self):
+        backend = self.backend(api='v2', token='secret', org='home', compress=True)
+        self.assertFalse(backend.manages_schema)
+        backend.write('home_load,id=pm power=1.0 1000')
+        backend.write('home_load_5m,id=pm power=2.0 1000', 'rp_5min')
+
+        first, second = self.writes()
+        self.assertEqual(first['path'], '/api/v2/write')
+        self.assertEqual(first['params'], {'bucket' : 'power_monitor', 'org' : 'home', 'precision' : 'ms'})
+        self.assertEqual(second['params']['bucket'], 'power_monitor/rp_5min')
+        self.assertEqual(first['headers']['Authorization'], 'Token secret')
+        self.assertEqual(first['headers']['Content-Encoding'], 'gzip')
+        self.assertEqual(first['body'], 'home_load,id=pm power=1.0 1000\n')
+
+    def test_status_codes(self):
+        backend = self.backend()
+        for status, error in ((400, RejectedWriteError), (404, RejectedWriteError), (408, RetryableWriteError), (429, RetryableWriteError),
+                              (500, RetryableWriteError), (503, RetryableWriteError)):
+            self.server.status = status
+            with self.subTest(status=status), self.assertRaises(error):
+                backend.write('home_load,id=pm power=1.0 1000')
+
+    def test_unreachable(self):
+        backend = self.backend()
+        self.server.shutdown()
+        self.server.server_close()
+        backend.port = self.port    # Nothing listens on the port anymore.
+        with self.assertRaises(RetryableWriteError):
+            backend.write('home_load,id=pm power=1.0 1000')
+
+    def test_connection_reuse(self):
+        backend = self.backend()
+        backend.connect()
+        for i in range(5):
+            backend.write(f'home_load,id=pm power={i}.0 1000')
+        self.assertEqual(len({request['port'] for request in self.server.requests}), 1)
+
+    def test_retry_on_closed_connection(self):
+        backend = self.backend()
+        self.server.drop_connections = True
+        backend.write('home_load,id=pm power=1.0 1000')
+        # The pooled connection was closed by the server, so this write fails on it, and is sent again on a new connection.
+        backend.write('home_load,id=pm power=2.0 1000')
+
+        writes = self.writes()
+        self.assertEqual([request['body'] for request in writes], ['home_load,id=pm power=1.0 1000\n', 'home_load,id=pm power=2.0 1000\n'])
+        self.assertNotEqual(writes[0]['port'], writes[1]['port'])
+
+    def test_v1_schema(self):
+        backend = self.backend()
+        backend.connect()
+        self.assertEqual(backend.get_list_retention_policies(), [{'name' : 'autogen', 'duration' : '0s', 'shardGroupDuration' : '168h0m0s', 'replicaN' : 1, 'default' : True}])
+        backend.create_retention_policy('rp_5min', 'INF', 1)
+
+        statements = [parse_qs(request['body'])['q'][0] for request in self.server.requests if request['path'] == '/query']
+        self.assertEqual(statements, ['CREATE DATABASE "power_monitor"', 'SHOW RETENTION POLICIES ON "power_monitor"', 'CREATE RETENTION POLICY "rp_5min" ON "power_monitor" DURATION INF REPLICATION 1'])
+
+
+if __name__ == '__main__':
+    unittest.main()